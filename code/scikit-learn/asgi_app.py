@@ -0,0 +1,216 @@
+# ASGI serving mode: same /postData and /predictBatch contract as flask_post_data2.py
+#
+# Run with uvicorn:
+#   uvicorn asgi_app:app --host 0.0.0.0 --port 5000
+# or, to share one loaded copy of the models across worker processes (loaded before fork):
+#   PRELOAD_MODELS=1 gunicorn asgi_app:app --preload -w 4 -k uvicorn.workers.UvicornWorker -b 0.0.0.0:5000
+import asyncio
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+
+from starlette.applications import Starlette
+from starlette.responses import JSONResponse, PlainTextResponse
+from starlette.routing import Route
+
+import prediction_service as svc
+import point_stream
+import service_metrics as sm
+from node_red_sender import async_node_red_sender
+import influx_writer
+from diagnostics import diagnostics_log
+
+logging.basicConfig(level=logging.INFO)
+
+NODE_RED_URL = os.environ.get("NODE_RED_URL", "http://localhost:1880/predictions")
+NODE_RED_QUEUE_SIZE = 1000   # results waiting for delivery; new results are dropped when full
+NODE_RED_BATCH_SIZE = 20     # max results per POST (sent as a JSON array when more than one)
+
+INFERENCE_WORKERS = int(os.environ.get("INFERENCE_WORKERS", os.cpu_count() or 1))   # threads running model inference
+STREAMING_POSTDATA = os.environ.get("STREAMING_POSTDATA", "0") == "1"   # scan /postData bodies incrementally (point_stream.py)
+MAX_IN_FLIGHT = int(os.environ.get("MAX_IN_FLIGHT", "64"))   # requests beyond this are rejected with 503 (backpressure)
+
+DIAGNOSTICS_DIR = os.environ.get("DIAGNOSTICS_DIR")
+DIAGNOSTICS_SAMPLE_RATE = float(os.environ.get("DIAGNOSTICS_SAMPLE_RATE", "0.01"))
+diagnostics = diagnostics_log(DIAGNOSTICS_DIR, sample_rate=DIAGNOSTICS_SAMPLE_RATE)
+
+# City models load on first use; with PRELOAD_MODELS=1 they load here, before a pre-forking server
+# (gunicorn --preload) forks its workers, so every worker shares them
+models = svc.load_models()
+
+executor = ThreadPoolExecutor(max_workers=INFERENCE_WORKERS, thread_name_prefix="inference")
+node_red = async_node_red_sender(NODE_RED_URL, max_queue=NODE_RED_QUEUE_SIZE, batch_size=NODE_RED_BATCH_SIZE) if NODE_RED_URL else None
+influx = influx_writer.from_env()   # INFLUX_WRITE=1: also write predictions straight to the <city>Predictions buckets
+in_flight = 0
+
+# /metrics: request counts, per-stage latency histograms, model versions and delivery counters (service_metrics.py)
+sm.metrics.add_collector(sm.model_collector(models))
+sm.metrics.add_collector(sm.cache_collector(svc.predictions))
+sm.metrics.add_collector(sm.coalescing_collector(svc.coalescing))
+sm.metrics.add_collector(sm.sender_collector({"Node-RED": node_red, "InfluxDB": influx}))
+sm.metrics.add_collector(lambda: [("in_flight", "gauge", "Requests being served.", [({}, in_flight)])])
+
+
+async def read_json(request):
+    try:
+        return await request.json()
+    except Exception:
+        return None
+
+
+async def run_bounded(fn, *args):
+    """Run CPU-bound work in the inference pool, or return None when the server is saturated."""
+    global in_flight
+    if in_flight >= MAX_IN_FLIGHT:
+        return None
+    in_flight += 1
+    try:
+        return await asyncio.get_running_loop().run_in_executor(executor, fn, *args)
+    finally:
+        in_flight -= 1
+
+
+def overloaded():
+    return JSONResponse({"error": "server overloaded, retry later"}, status_code=503, headers={"Retry-After": "1"})
+
+
+async def scan_body(request):
+    """Feed the request body to a point_scanner as it arrives; scanning runs in the inference pool."""
+    loop = asyncio.get_running_loop()
+    scanner = point_stream.point_scanner()
+    async for chunk in request.stream():
+        if chunk:
+            await loop.run_in_executor(executor, scanner.feed, chunk)
+    return scanner.close()
+
+
+async def postData(request):
+    start = time.perf_counter()
+    response, city = await handle_post_data(request)
+    sm.count_request("/postData", sm.city_label(city, models), response.status_code, time.perf_counter() - start)
+    return response
+
+
+async def handle_post_data(request):
+    """/postData; returns (response, city as posted)."""
+    if STREAMING_POSTDATA:
+        try:
+            opts = svc.stream_options(request.query_params)
+        except ValueError as e:
+            return JSONResponse({"error": str(e)}, status_code=400), None
+        with sm.stage('parse'):
+            scanner = await scan_body(request)
+        outcome = await run_bounded(lambda: svc.predict_post_stream(scanner, models, **opts))
+        points = scanner.values
+        city = scanner.city
+    else:
+        with sm.stage('parse'):
+            data = await read_json(request)
+        outcome = await run_bounded(svc.predict_post_data, data, models)
+        points = data if isinstance(data, dict) else {}
+        city = points.get("city")
+    if outcome is None:
+        return overloaded(), city
+    body, status = outcome
+    if status != 200:
+        return JSONResponse(body, status_code=status), city
+    result_payload = body["result"]
+    city = result_payload["city"]
+
+    with sm.stage('diagnostics'):
+        diagnostics.capture(city, points.get("temperature", []), points.get("aqi", []), result_payload["predictions"])
+
+    with sm.stage('deliver'):
+        queued = node_red.submit(result_payload) if node_red else False
+        if node_red and not queued:
+            logging.warning(f"Node-RED queue full; dropped result for {city}")
+        node_red_status = {"success": queued, "queued": queued, "url": NODE_RED_URL or None}
+        response = {"result": result_payload, "node_red_post": node_red_status}
+        if influx:
+            written = influx.submit_result(result_payload)
+            if not written:
+                logging.warning(f"InfluxDB write queue full; dropped predictions for {city}")
+            response["influx_write"] = {"queued": written}
+    with sm.stage('respond'):
+        return JSONResponse(response), city
+
+
+async def predictBatch(request):
+    start = time.perf_counter()
+    data = await read_json(request)
+    outcome = await run_bounded(svc.predict_batch_request, data, models)
+    response = overloaded() if outcome is None else JSONResponse(outcome[0], status_code=outcome[1])
+    sm.count_request("/predictBatch", "", response.status_code, time.perf_counter() - start)
+    return response
+
+
+async def metrics(request):
+    return PlainTextResponse(sm.metrics.render(), headers={"Content-Type": sm.CONTENT_TYPE})
+
+
+async def adminReload(request):
+    if not svc.admin_authorized(request.headers):
+        return JSONResponse({"error": "forbidden"}, status_code=403)
+    body, status = svc.admin_reload(await read_json(request), models)
+    return JSONResponse(body, status_code=status)
+
+
+async def adminFeelings(request):
+    if not svc.admin_authorized(request.headers):
+        return JSONResponse({"error": "forbidden"}, status_code=403)
+    # fitting the new trees takes seconds: keep it off the event loop
+    body, status = await asyncio.get_running_loop().run_in_executor(None, svc.admin_feelings, await read_json(request),
+                                                                    models)
+    return JSONResponse(body, status_code=status)
+
+
+async def adminStatus(request):
+    if not svc.admin_authorized(request.headers):
+        return JSONResponse({"error": "forbidden"}, status_code=403)
+    return JSONResponse({"models": models.status(), "predictions": svc.predictions.status(),
+                         "coalescing": svc.coalescing.status(),
+                         "rolling_features": svc.rolling.status(),
+                         "node_red": node_red.status() if node_red else None,
+                         "influx_write": influx.status() if influx else None, "in_flight": in_flight})
+
+
+async def adminProfile(request):
+    """POST starts (or stops) the sampling profiler; GET returns the folded stacks for a flame graph."""
+    if not svc.admin_authorized(request.headers):
+        return JSONResponse({"error": "forbidden"}, status_code=403)
+    if request.method == "GET":
+        return PlainTextResponse(sm.profiler.folded())
+    # starting/stopping joins the previous sampler thread, so keep it off the event loop
+    body, status = await asyncio.get_running_loop().run_in_executor(None, sm.admin_profile, await read_json(request))
+    return JSONResponse(body, status_code=status)
+
+
+@asynccontextmanager
+async def lifespan(app):
+    if node_red:
+        await node_red.start()
+    yield
+    if node_red:
+        await node_red.close()
+    if influx:
+        influx.close()
+    executor.shutdown(wait=False)
+
+
+app = Starlette(routes=[
+    Route("/postData", postData, methods=["POST"]),
+    Route("/predictBatch", predictBatch, methods=["POST"]),
+    Route("/admin/reload", adminReload, methods=["POST"]),
+    Route("/admin/feelings", adminFeelings, methods=["POST"]),
+    Route("/admin/status", adminStatus, methods=["GET"]),
+    Route("/admin/profile", adminProfile, methods=["GET", "POST"]),
+    Route("/metrics", metrics, methods=["GET"]),
+], lifespan=lifespan)
+
+
+if __name__ == "__main__":
+    import uvicorn
+
+    uvicorn.run(app, host="0.0.0.0", port=5000)
@@ -0,0 +1,286 @@
+# Benchmark suite: data preparation, training, prediction latency, /postData throughput and request coalescing, as JSON.
+#
+#   python benchmarks.py                                  # every city, results in benchmarks/<timestamp>.json
+#   python benchmarks.py Lahore --quick --out bench.json   # fewer repetitions
+#   python benchmarks.py --compare benchmarks/old.json     # also print the change against an earlier run
+#
+# Runs offline on the CSV files of the city registry (cities.json or CITY_REGISTRY); cities whose files are
+# missing are reported as skipped. Prepared data and trained models go to a temporary folder, so the
+# benchmark neither reads nor touches the real caches and always measures a cold start first.
+import argparse
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+
+BENCH_FORMAT = 1
+DEFAULT_OUT_DIR = Path(__file__).resolve().parent / "benchmarks"
+
+# metric name endings where higher is better (used by --compare); all other metrics are timings
+HIGHER_IS_BETTER = ('per_s', 'rps', 'speedup', 'mean_batch')
+
+
+def _percentiles(seconds):
+    ms = np.asarray(seconds) * 1e3
+    return {'p50_ms': round(float(np.percentile(ms, 50)), 4), 'p99_ms': round(float(np.percentile(ms, 99)), 4),
+            'mean_ms': round(float(ms.mean()), 4)}
+
+
+def environment():
+    """What the numbers were measured on."""
+    import pandas
+    import sklearn
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                                cwd=Path(__file__).resolve().parent, timeout=10).stdout.strip() or None
+    except Exception:
+        commit = None
+    return {'commit': commit, 'python': platform.python_version(), 'numpy': np.__version__,
+            'pandas': pandas.__version__, 'sklearn': sklearn.__version__, 'platform': platform.platform(),
+            'cpus': os.cpu_count(), 'time': time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())}
+
+
+def available_cities(cities=None):
+    """(cities whose registry files all exist, {skipped city: missing files})."""
+    import random_forest_model as rfm
+
+    ok, skipped = [], {}
+    for city in cities or list(rfm.CITIES_FILES):
+        if city not in rfm.CITIES_FILES:
+            skipped[city] = "not in the city registry"
+            continue
+        missing = [p for p in rfm.CITIES_FILES[city].values() if not Path(p).exists()]
+        if missing:
+            skipped[city] = missing
+        else:
+            ok.append(city)
+    return ok, skipped
+
+
+# ---------------------------
+# Stages
+# ---------------------------
+def bench_data_prep(cities, repeat):
+    """CSV load + alignment against the prepared-data cache, per city (prepared_data.benchmark)."""
+    import prepared_data as pdc
+
+    return {row.pop('city'): {k: round(v, 4) if isinstance(v, float) else v for k, v in row.items()}
+            for row in pdc.benchmark(cities, repeat=repeat)}
+
+
+def bench_training(cities):
+    """Fit time of both forests per city (from the prepared data), artifact load time and model size."""
+    import random_forest_model as rfm
+
+    out = {}
+    for city in cities:
+        start = time.perf_counter()
+        m = rfm.model(city, retrain=True)
+        t_fit = time.perf_counter() - start
+        start = time.perf_counter()
+        rfm.model(city)
+        t_load = time.perf_counter() - start
+        out[city] = {'fit_s': round(t_fit, 4), 'load_s': round(t_load, 4), 'memory_mb': round(m.memory_bytes() / 1e6, 3),
+                     'backend': m.backend['name'],
+                     'trees': sum(len(getattr(m.models[k], 'estimators_', ())) or m.models[k].n_iter_
+                                  for k in ('weather', 'air_quality') if m.models.get(k))}
+    return out
+
+
+def bench_inference(cities, n_single, batch_sizes, seed=0):
+    """Single-prediction latency (model.run) and batch throughput (model.predict_batch) per city."""
+    import random_forest_model as rfm
+
+    rng = np.random.default_rng(seed)
+    out = {}
+    for city in cities:
+        m = rfm.model(city)
+        temps, aqis = rng.uniform(-5, 50, n_single), rng.uniform(1, 400, n_single)
+        m.run(float(temps[0]), float(aqis[0]))   # warm-up
+        lat = []
+        for t, a in zip(temps.tolist(), aqis.tolist()):
+            start = time.perf_counter()
+            m.run(t, a)
+            lat.append(time.perf_counter() - start)
+        batches = {}
+        for n in batch_sizes:
+            bt, ba = rng.uniform(-5, 50, n), rng.uniform(1, 400, n)
+            reps = max(3, min(200, 20_000 // n))
+            start = time.perf_counter()
+            for _ in range(reps):
+                m.predict_batch(bt, ba)
+            elapsed = (time.perf_counter() - start) / reps
+            batches[str(n)] = {'ms': round(elapsed * 1e3, 4), 'predictions_per_s': round(n / elapsed, 1)}
+        out[city] = {'single': _percentiles(lat), 'batch': batches}
+    return out
+
+
+def bench_postdata(cities, n_requests, n_points, seed=0):
+    """End-to-end /postData through the Flask test client, with the prediction cache off and on."""
+    import random
+
+    os.environ["NODE_RED_URL"] = ""   # results are not delivered anywhere
+    import flask_post_data2 as app
+    import prediction_service as svc
+
+    rnd = random.Random(seed)
+    client = app.app.test_client()
+    bodies = [{"city": rnd.choice(cities),
+               "temperature": [{"_value": round(rnd.uniform(5, 45), 2)} for _ in range(n_points)],
+               "aqi": [{"_value": round(rnd.uniform(20, 300), 1)} for _ in range(n_points)]}
+              for _ in range(n_requests)]
+    for city in cities:
+        client.post("/postData", json=bodies[0] | {"city": city})   # load every model first
+
+    out = {}
+    enabled = svc.predictions.enabled
+    for label, cache_on in (('cache_off', False), ('cache_on', True)):
+        svc.predictions.enabled = cache_on
+        svc.predictions.invalidate()
+        lat, errors = [], 0
+        wall = time.perf_counter()
+        for body in bodies:
+            start = time.perf_counter()
+            r = client.post("/postData", json=body)
+            lat.append(time.perf_counter() - start)
+            errors += r.status_code != 200
+        wall = time.perf_counter() - wall
+        out[label] = dict(_percentiles(lat), rps=round(n_requests / wall, 1), errors=errors)
+    svc.predictions.enabled = enabled
+    out.update(requests=n_requests, points_per_request=n_points)
+    return out
+
+
+def bench_coalescing(cities, threads, windows, requests):
+    """Throughput and latency of concurrent single predictions per coalescing window (request_coalescing.benchmark)."""
+    import random_forest_model as rfm
+    import request_coalescing as rc
+
+    out = {}
+    for city in cities:
+        rows = rc.benchmark(rfm.model(city), threads, windows, requests=requests)
+        out[city] = {f"threads_{r['threads']}": {} for r in rows}
+        for r in rows:
+            out[city][f"threads_{r['threads']}"][f"window_{r['window_ms']:g}ms"] = {
+                k: r[k] for k in ('predictions_per_s', 'p50_ms', 'p99_ms', 'mean_batch')}
+    return out
+
+
+STAGES = ('data_prep', 'training', 'inference', 'postdata', 'coalescing')
+
+
+def run(cities=None, stages=STAGES, quick=False):
+    """Run the stages in a scratch cache/store and return the result document."""
+    import model_store as ms
+    import prepared_data as pdc
+
+    scratch = Path(tempfile.mkdtemp(prefix="bench-"))
+    # the modules read their directories at call time, so this holds even if they were imported (and used) before;
+    # the environment is for modules imported from here on (flask_post_data2 loads its models on import)
+    saved_env = {key: os.environ.get(key) for key in ("PREPARED_DATA_DIR", "MODEL_STORE_DIR")}
+    saved_dirs = (pdc.DEFAULT_CACHE_DIR, ms.DEFAULT_STORE_DIR)
+    pdc.DEFAULT_CACHE_DIR, ms.DEFAULT_STORE_DIR = scratch / "prepared", scratch / "store"
+    os.environ["PREPARED_DATA_DIR"], os.environ["MODEL_STORE_DIR"] = str(scratch / "prepared"), str(scratch / "store")
+    os.environ.setdefault("PRELOAD_MODELS", "0")
+    os.environ.setdefault("MODEL_WATCH_INTERVAL", "0")
+
+    cities, skipped = available_cities(cities)
+    results = {}
+    timings = {}
+    try:
+        for stage in stages:
+            if not cities:
+                break
+            start = time.perf_counter()
+            if stage == 'data_prep':
+                results[stage] = bench_data_prep(cities, repeat=2 if quick else 5)
+            elif stage == 'training':
+                results[stage] = bench_training(cities)
+            elif stage == 'inference':
+                results[stage] = bench_inference(cities, n_single=200 if quick else 2000,
+                                                 batch_sizes=(1, 100, 10_000) if quick else (1, 100, 10_000, 100_000))
+            elif stage == 'postdata':
+                results[stage] = bench_postdata(cities, n_requests=100 if quick else 1000, n_points=60)
+            elif stage == 'coalescing':
+                results[stage] = bench_coalescing(cities, threads=(1, 16) if quick else (1, 4, 16, 64),
+                                                  windows=(0, 2) if quick else (0, 0.5, 1, 2, 5),
+                                                  requests=500 if quick else 2000)
+            timings[stage] = round(time.perf_counter() - start, 2)
+            print(f"{stage}: done in {timings[stage]}s", file=sys.stderr)
+    finally:
+        pdc.DEFAULT_CACHE_DIR, ms.DEFAULT_STORE_DIR = saved_dirs
+        for key, value in saved_env.items():
+            if value is None:
+                os.environ.pop(key, None)
+            else:
+                os.environ[key] = value
+        shutil.rmtree(scratch, ignore_errors=True)
+    return {'format': BENCH_FORMAT, 'environment': environment(), 'quick': quick, 'cities': cities,
+            'skipped': skipped, 'stage_seconds': timings, 'results': results}
+
+
+# ---------------------------
+# Comparing two runs
+# ---------------------------
+def flatten(results, prefix=""):
+    """{'inference.Lahore.single.p50_ms': 0.8, ...} for every number in a results tree."""
+    out = {}
+    for key, value in results.items():
+        name = f"{prefix}{key}"
+        if isinstance(value, dict):
+            out.update(flatten(value, name + "."))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            out[name] = value
+    return out
+
+
+def compare(old, new, threshold=0.20):
+    """Rows (metric, old, new, change, regressed) for the metrics both runs have."""
+    a, b = flatten(old['results']), flatten(new['results'])
+    rows = []
+    for name in sorted(a.keys() & b.keys()):
+        if not a[name]:
+            continue
+        change = b[name] / a[name] - 1
+        higher_better = name.rsplit(".", 1)[-1].endswith(HIGHER_IS_BETTER)
+        regressed = change < -threshold if higher_better else change > threshold
+        rows.append((name, a[name], b[name], change, regressed))
+    return rows
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark data preparation, training, inference and /postData")
+    parser.add_argument("cities", nargs="*", help="cities to benchmark (default: every city in the registry)")
+    parser.add_argument("--stages", nargs="+", choices=STAGES, default=list(STAGES))
+    parser.add_argument("--quick", action="store_true", help="fewer repetitions, for a fast check")
+    parser.add_argument("--out", default=None, help="JSON file to write (default: benchmarks/<timestamp>.json)")
+    parser.add_argument("--compare", metavar="JSON", help="earlier result file to compare with")
+    parser.add_argument("--threshold", type=float, default=0.20, help="relative change reported as a regression")
+    args = parser.parse_args()
+
+    doc = run(args.cities or None, args.stages, args.quick)
+    out = Path(args.out) if args.out else DEFAULT_OUT_DIR / f"{time.strftime('%Y%m%d-%H%M%S')}.json"
+    out.parent.mkdir(parents=True, exist_ok=True)
+    with open(out, "w", encoding="utf-8") as f:
+        json.dump(doc, f, indent=2)
+    print(json.dumps(doc['results'], indent=2))
+    for city, why in doc['skipped'].items():
+        print(f"skipped {city}: {why}", file=sys.stderr)
+    print(f"wrote {out}", file=sys.stderr)
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            old = json.load(f)
+        rows = compare(old, doc, args.threshold)
+        for name, a, b, change, regressed in rows:
+            print(f"{'REGRESSED ' if regressed else '          '}{name:<55} {a:>12.4g} -> {b:>12.4g}  {change:+.1%}")
+        n_bad = sum(r[4] for r in rows)
+        print(f"{n_bad} of {len(rows)} metrics regressed by more than {args.threshold:.0%}")
+        sys.exit(1 if n_bad else 0)
@@ -0,0 +1,28 @@
+import json
+import os
+from pathlib import Path
+
+# ---------------------------
+# City registry: which cities exist and where their training data lives
+# ---------------------------
+# cities.json (or the file named by CITY_REGISTRY) maps each city to its weather,
+# aqi and feeling CSVs. Relative paths are resolved against "data_dir", which is
+# itself relative to the registry file. Adding a city only means adding an entry.
+
+DEFAULT_REGISTRY = Path(__file__).resolve().parent / "cities.json"
+REQUIRED_SOURCES = ('weather', 'aqi', 'feeling')
+
+
+def load_registry(path=None):
+    """Return {city: {'weather': path, 'aqi': path, 'feeling': path}} with absolute paths."""
+    path = Path(path or os.environ.get("CITY_REGISTRY") or DEFAULT_REGISTRY)
+    with open(path, encoding="utf-8") as f:
+        config = json.load(f)
+    data_dir = path.parent / config.get("data_dir", ".")
+    cities = {}
+    for city, sources in config.get("cities", {}).items():
+        missing = [s for s in REQUIRED_SOURCES if s not in sources]
+        if missing:
+            raise KeyError(f"City '{city}' in {path} is missing data sources: {missing}")
+        cities[city] = {role: str(data_dir / src) for role, src in sources.items()}
+    return cities
@@ -0,0 +1,68 @@
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import threading
+import time
+from pathlib import Path
+
+# ---------------------------
+# Sampled capture of raw request points (off unless a directory is configured)
+# ---------------------------
+# capture() only draws a random number and enqueues references to the request
+# data; serialization and file I/O happen on a background writer thread that
+# appends JSON Lines to a size-rotated log (points.jsonl, points.jsonl.1, ...).
+
+
+class diagnostics_log():
+    def __init__(self, directory=None, sample_rate=0.01, max_bytes=50 * 1024 * 1024, backup_count=5, max_queue=1000):
+        self.enabled = bool(directory) and sample_rate > 0
+        self.sample_rate = sample_rate
+        self.stats = {'captured': 0, 'dropped': 0, 'written': 0}
+        if not self.enabled:
+            return
+        Path(directory).mkdir(parents=True, exist_ok=True)
+        self.directory = Path(directory)
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self.max_queue = max_queue
+        self._start("points.jsonl")
+        if hasattr(os, "register_at_fork"):
+            # threads do not survive fork (e.g. gunicorn --preload): each worker gets its own writer and file
+            os.register_at_fork(after_in_child=lambda: self._start(f"points-{os.getpid()}.jsonl"))
+
+    def _start(self, filename):
+        self.path = self.directory / filename
+        self._handler = logging.handlers.RotatingFileHandler(self.path, maxBytes=self.max_bytes,
+                                                             backupCount=self.backup_count, encoding="utf-8")
+        self._handler.setFormatter(logging.Formatter("%(message)s"))
+        self.queue = queue.Queue(maxsize=self.max_queue)
+        self._thread = threading.Thread(target=self._run, name="diagnostics-writer", daemon=True)
+        self._thread.start()
+
+    def capture(self, city, temps, aqis, result=None):
+        """Sample one request's raw points for the log; never blocks the caller."""
+        if not self.enabled or random.random() >= self.sample_rate:
+            return False
+        try:
+            self.queue.put_nowait((time.time(), city, temps, aqis, result))
+        except queue.Full:
+            self.stats['dropped'] += 1
+            return False
+        self.stats['captured'] += 1
+        return True
+
+    def _run(self):
+        while True:
+            ts, city, temps, aqis, result = self.queue.get()
+            try:
+                line = json.dumps({"ts": ts, "city": city, "temperature": temps, "aqi": aqis, "result": result},
+                                  default=lambda o: o.tolist() if hasattr(o, "tolist") else str(o))
+                self._handler.handle(logging.makeLogRecord({"msg": line, "levelno": logging.INFO}))
+                self.stats['written'] += 1
+            except Exception:
+                logging.exception("Failed to write diagnostics record (non-fatal)")
+            finally:
+                self.queue.task_done()
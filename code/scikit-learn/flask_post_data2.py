@@ -1,166 +1,170 @@
 # app.py
 # save as app.py
-from flask import Flask, request, jsonify
-import pandas as pd
-import random_forest_model as rfm
-import json
+from flask import Flask, request, jsonify, Response
+from werkzeug.exceptions import HTTPException
+import prediction_service as svc
+import point_stream
+import service_metrics as sm
 import logging
-
-# try to import requests; if unavailable, we'll fallback to urllib
-try:
-    import requests
-except Exception:
-    requests = None
-    from urllib import request as urlrequest
-    from urllib.error import URLError, HTTPError
+import os
+import time
+from node_red_sender import node_red_sender
+import influx_writer
+from diagnostics import diagnostics_log
 
 app = Flask(__name__)
 logging.basicConfig(level=logging.INFO)
 
-NODE_RED_URL = "http://localhost:1880/predictions"
+NODE_RED_URL = os.environ.get("NODE_RED_URL", "http://localhost:1880/predictions")
   # endpoint to POST results to (adjust if you have a specific path)
+NODE_RED_QUEUE_SIZE = 1000   # results waiting for delivery; new results are dropped when full
+NODE_RED_BATCH_SIZE = 20     # max results per POST (sent as a JSON array when more than one)
+
+# results are delivered to Node-RED from a background thread, never on the request thread
+# (NODE_RED_URL= set empty turns delivery off, e.g. when the predictions are written to InfluxDB directly)
+node_red = node_red_sender(NODE_RED_URL, max_queue=NODE_RED_QUEUE_SIZE, batch_size=NODE_RED_BATCH_SIZE) if NODE_RED_URL else None
+
+# With INFLUX_WRITE=1 predictions are also written straight to the <city>Predictions buckets (influx_writer.py)
+influx = influx_writer.from_env()
+
+# Raw request points are only logged for debugging when DIAGNOSTICS_DIR is set (off by default)
+DIAGNOSTICS_DIR = os.environ.get("DIAGNOSTICS_DIR")
+DIAGNOSTICS_SAMPLE_RATE = float(os.environ.get("DIAGNOSTICS_SAMPLE_RATE", "0.01"))   # fraction of requests captured
+diagnostics = diagnostics_log(DIAGNOSTICS_DIR, sample_rate=DIAGNOSTICS_SAMPLE_RATE)
 
 #Instantiate model
 try:
-    models = {}
-    for city in ["Lahore", "Islamabad", "Karachi"]:
-        models[city] = rfm.model(city)
+    models = svc.load_models()
     
 except Exception as e:
     logging.exception("Failed to instantiate random_forest_model")
     raise(f"errormodel initialization error: {e}")
 
-def safe_mean(arr, key_candidates=("value", "_value")):
-    """Compute mean of numeric values in array of dicts, checking several possible field names."""
-    vals = []
-    for item in arr:
-        if not isinstance(item, dict):
-            continue
-        for k in key_candidates:
-            if k in item and item[k] is not None:
-                try:
-                    vals.append(float(item[k]))
-                except Exception:
-                    pass
-                break
-    if not vals:
-        return None
-    return sum(vals) / len(vals)
-
-@app.route("/postData", methods=["POST"])
-def postData():
-    data = request.get_json()
-    if not data:
-        return jsonify({"error": "invalid or missing json body"}), 400
-
-    city = data.get("city")
-    temps = data.get("temperature", [])
-    aqis = data.get("aqi", [])
-
-    if not city:
-        return jsonify({"error": "missing city"}), 400
-
-    if not isinstance(temps, list) or not isinstance(aqis, list):
-        return jsonify({"error": "temperature and aqi must be arrays"}), 400
-
-    if len(temps) == 0 and len(aqis) == 0:
-        return jsonify({"error": "both temperature and aqi arrays are empty"}), 400
+# With STREAMING_POSTDATA=1 /postData bodies are scanned chunk by chunk (point_stream.py) instead of parsed
+# with get_json(); query parameters ?agg=mean|median|trimmed&window=<last n points>&trim=<fraction> apply
+STREAMING_POSTDATA = os.environ.get("STREAMING_POSTDATA", "0") == "1"
 
-    # compute averages (try both 'value' and '_value' field names)
-    avg_temp = safe_mean(temps, key_candidates=("value", "_value"))
-    avg_aqi = safe_mean(aqis, key_candidates=("value", "_value"))
+# /metrics: request counts, per-stage latency histograms, model versions and delivery counters (service_metrics.py)
+sm.metrics.add_collector(sm.model_collector(models))
+sm.metrics.add_collector(sm.cache_collector(svc.predictions))
+sm.metrics.add_collector(sm.coalescing_collector(svc.coalescing))
+sm.metrics.add_collector(sm.sender_collector({"Node-RED": node_red, "InfluxDB": influx}))
 
-    if avg_temp is None and avg_aqi is None:
-        return jsonify({"error": "no numeric values found in temperature or aqi arrays"}), 400
-
-    # If one of them is missing, set to 0 (or you can choose to return error)
-    if avg_temp is None:
-        avg_temp = 0.0
-    if avg_aqi is None:
-        avg_aqi = 0.0
-
-    logging.info(f"Received city={city}, avg_temp={avg_temp}, avg_aqi={avg_aqi}")
-
-    # run predictions
-    model = models[city]
 
+@app.route("/postData", methods=["POST"])
+def postData():
+    start = time.perf_counter()
+    status, city = 500, None
     try:
-        raw_result = model.run(avg_temp, avg_aqi)
-    except Exception as e:
-        logging.exception("Failed to run model")
-        return jsonify({"error": f"model run error: {e}"}), 500
-
-    # raw_result expected to be like: { "<city_key>": { "weather_satisfaction": float, "air_quality_satisfaction": float } }
-    # Extract the predictions dict (first value)
-    preds_dict = None
-    if isinstance(raw_result, dict) and len(raw_result) > 0:
-        # pick either the entry matching incoming city (if exists), else first key
-        if city in raw_result:
-            preds_dict = raw_result[city]
-        else:
-            # take first value
-            preds_dict = next(iter(raw_result.values()))
-    else:
-        preds_dict = raw_result  # fallback if model returns a simple dict
-
-    if not isinstance(preds_dict, dict):
-        logging.error(f"Unexpected model output format: {raw_result}")
-        return jsonify({"error": "unexpected model output format"}), 500
-
-    # Extract floats and round them (nearest integer). Change rounding precision here if you prefer decimals.
-    raw_weather = preds_dict.get("weather_satisfaction")
-    raw_air = preds_dict.get("air_quality_satisfaction")
-
-    def safe_round(v):
+        response, status, city = handle_post_data()
+        return response, status
+    except HTTPException as e:
+        status = e.code   # e.g. a body that is not JSON
+        raise
+    finally:
+        sm.count_request("/postData", sm.city_label(city, models), status, time.perf_counter() - start)
+
+
+def handle_post_data():
+    """/postData; returns (response, status, city as posted)."""
+    if STREAMING_POSTDATA:
         try:
-            return round(float(v), 3)
-        except Exception:
-            return None
-
-    weather_rounded = safe_round(raw_weather)
-    air_rounded = safe_round(raw_air)
-
-    result_payload = {
-        "city": city,
-        "avg_temperature": avg_temp,
-        "avg_aqi": avg_aqi,
-        "predictions": {
-            "weather_satisfaction": weather_rounded,
-            "air_quality_satisfaction": air_rounded
-        },
-        # include raw_model_output for debugging
-        "raw_model_output": raw_result
-    }
-
-    # Save CSV locally for debugging (optional) - safe path in current working dir
-    try:
-        # create a small diagnostic dataframe
-        df_t = pd.DataFrame(temps)
-        df_a = pd.DataFrame(aqis)
-        df_t.to_csv(f"{city}_temperature_points.csv", index=False)
-        df_a.to_csv(f"{city}_aqi_points.csv", index=False)
-    except Exception:
-        logging.exception("Failed to write CSVs (non-fatal)")
-
-    # Try to POST the result back to Node-RED
-    try:
-        if requests is not None:
-            r = requests.post(NODE_RED_URL, json=result_payload, timeout=60)
-            logging.info(f"Posted results to Node-RED ({NODE_RED_URL}) - status {r.status_code}")
-            node_red_status = {"success": True, "status_code": r.status_code, "response_text": r.text[:200]}
-        else:
-            # fallback using urllib
-            req = urlrequest.Request(NODE_RED_URL, data=json.dumps(result_payload).encode("utf-8"),
-                                     headers={"Content-Type": "application/json"})
-            with urlrequest.urlopen(req, timeout=5) as resp:
-                resp_text = resp.read().decode("utf-8", errors="ignore")
-                node_red_status = {"success": True, "status_code": resp.getcode(), "response_text": resp_text[:200]}
-    except Exception as e:
-        logging.warning(f"Failed to POST to Node-RED at {NODE_RED_URL}: {e}")
-        node_red_status = {"success": False, "error": str(e)}
+            opts = svc.stream_options(request.args)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400, None
+        with sm.stage('parse'):
+            scanner = point_stream.scan(request.stream)
+        body, status = svc.predict_post_stream(scanner, models, **opts)
+        points = scanner.values
+        city = scanner.city
+    else:
+        with sm.stage('parse'):
+            data = request.get_json()
+        body, status = svc.predict_post_data(data, models)
+        points = data if isinstance(data, dict) else {}
+        city = points.get("city")
+    if status != 200:
+        return jsonify(body), status, city
+    result_payload = body["result"]
+    city = result_payload["city"]
+
+    # Sample the raw points into the diagnostics log (no-op unless enabled)
+    with sm.stage('diagnostics'):
+        diagnostics.capture(city, points.get("temperature", []), points.get("aqi", []), result_payload["predictions"])
+
+    # Hand the result to the background sender for delivery to Node-RED
+    with sm.stage('deliver'):
+        queued = node_red.submit(result_payload) if node_red else False
+        if node_red and not queued:
+            logging.warning(f"Node-RED queue full; dropped result for {city}")
+        node_red_status = {"success": queued, "queued": queued, "url": NODE_RED_URL or None}
+        response = {"result": result_payload, "node_red_post": node_red_status}
+
+        if influx:
+            written = influx.submit_result(result_payload)
+            if not written:
+                logging.warning(f"InfluxDB write queue full; dropped predictions for {city}")
+            response["influx_write"] = {"queued": written}
 
     # Return final JSON to requestor, including node-red post status for transparency
-    return jsonify({"result": result_payload, "node_red_post": node_red_status}), 200
+    with sm.stage('respond'):
+        return jsonify(response), 200, city
+
+
+@app.route("/predictBatch", methods=["POST"])
+def predictBatch():
+    """Score many (temperature, aqi) pairs for one or more cities; see prediction_service.predict_batch_request."""
+    start = time.perf_counter()
+    body, status = svc.predict_batch_request(request.get_json(), models)
+    sm.count_request("/predictBatch", "", status, time.perf_counter() - start)
+    return jsonify(body), status
+
+
+@app.route("/metrics", methods=["GET"])
+def metrics():
+    """Prometheus scrape endpoint."""
+    return Response(sm.metrics.render(), content_type=sm.CONTENT_TYPE)
+
+
+@app.route("/admin/reload", methods=["POST"])
+def adminReload():
+    """Reload city models from the model store in the background; swapped in once warmed up."""
+    if not svc.admin_authorized(request.headers):
+        return jsonify({"error": "forbidden"}), 403
+    body, status = svc.admin_reload(request.get_json(silent=True), models)
+    return jsonify(body), status
+
+
+@app.route("/admin/feelings", methods=["POST"])
+def adminFeelings():
+    """Fold newly recorded feelings into a city's models and swap the updated models in."""
+    if not svc.admin_authorized(request.headers):
+        return jsonify({"error": "forbidden"}), 403
+    body, status = svc.admin_feelings(request.get_json(silent=True), models)
+    return jsonify(body), status
+
+
+@app.route("/admin/status", methods=["GET"])
+def adminStatus():
+    """Loaded models, their versions and request counts per version, plus Node-RED and InfluxDB delivery counters."""
+    if not svc.admin_authorized(request.headers):
+        return jsonify({"error": "forbidden"}), 403
+    return jsonify({"models": models.status(), "predictions": svc.predictions.status(),
+                    "coalescing": svc.coalescing.status(),
+                    "rolling_features": svc.rolling.status(),
+                    "node_red": node_red.status() if node_red else None,
+                    "influx_write": influx.status() if influx else None}), 200
+
+
+@app.route("/admin/profile", methods=["GET", "POST"])
+def adminProfile():
+    """POST starts (or stops) the sampling profiler; GET returns the folded stacks for a flame graph."""
+    if not svc.admin_authorized(request.headers):
+        return jsonify({"error": "forbidden"}), 403
+    if request.method == "GET":
+        return Response(sm.profiler.folded(), content_type="text/plain; charset=utf-8")
+    body, status = sm.admin_profile(request.get_json(silent=True))
+    return jsonify(body), status
 
 
 if __name__ == "__main__":
@@ -0,0 +1,139 @@
+import time
+from pathlib import Path
+
+import numpy as np
+
+# ---------------------------
+# Flat array-based inference engine for fitted RandomForestRegressors
+# ---------------------------
+# All trees of a forest are concatenated into contiguous node arrays
+# (feature, threshold, left, right, value). Leaves point to themselves, so every
+# sample can be walked for a fixed number of steps (the forest depth) with pure
+# NumPy gathers and no Python loop over trees or samples.
+
+ARRAYS = ('feature', 'threshold', 'left', 'right', 'missing_left', 'value', 'roots')
+
+
+class flat_forest():
+    def __init__(self, feature, threshold, left, right, missing_left, value, roots, depth, n_features):
+        self.feature = feature
+        self.threshold = threshold
+        self.left = left
+        self.right = right
+        self.missing_left = missing_left
+        self.value = value
+        self.roots = roots
+        self.depth = int(depth)
+        self.n_features = int(n_features)
+
+    @classmethod
+    def from_sklearn(cls, forest):
+        """Flatten a fitted single-output RandomForestRegressor (or a single DecisionTreeRegressor)."""
+        estimators = getattr(forest, 'estimators_', [forest])
+        feature, threshold, left, right, missing_left, value, roots = [], [], [], [], [], [], []
+        offset = 0
+        depth = 0
+        for est in estimators:
+            tree = est.tree_
+            if tree.n_outputs != 1:
+                raise ValueError("only single-output regression forests can be flattened")
+            n = tree.node_count
+            ids = np.arange(n, dtype=np.int32)
+            is_leaf = tree.children_left == -1
+            feature.append(np.where(is_leaf, 0, tree.feature).astype(np.int32))
+            threshold.append(np.where(is_leaf, np.inf, tree.threshold).astype(np.float64))
+            left.append((np.where(is_leaf, ids, tree.children_left) + offset).astype(np.int32))
+            right.append((np.where(is_leaf, ids, tree.children_right) + offset).astype(np.int32))
+            mgl = getattr(tree, 'missing_go_to_left', None)
+            missing_left.append(np.zeros(n, dtype=bool) if mgl is None else np.asarray(mgl, dtype=bool))
+            value.append(tree.value[:, 0, 0].astype(np.float64))
+            roots.append(offset)
+            depth = max(depth, tree.max_depth)
+            offset += n
+        return cls(np.concatenate(feature), np.concatenate(threshold), np.concatenate(left),
+                   np.concatenate(right), np.concatenate(missing_left), np.concatenate(value),
+                   np.asarray(roots, dtype=np.int32), depth, estimators[0].n_features_in_)
+
+    def predict(self, X):
+        """Mean leaf value over all trees for each row of X (same result as sklearn's predict)."""
+        # sklearn compares float32 inputs against float64 thresholds
+        X = np.asarray(X, dtype=np.float32).astype(np.float64)
+        if X.ndim == 1:
+            X = X.reshape(1, -1)
+        if X.shape[1] != self.n_features:
+            raise ValueError(f"X has {X.shape[1]} features, forest expects {self.n_features}")
+        n = X.shape[0]
+        flat_x = X.ravel()
+        row_offset = (np.arange(n, dtype=np.int64) * self.n_features)[None, :]
+
+        # nodes has shape (n_trees, n_samples)
+        nodes = np.repeat(self.roots[:, None], n, axis=1)
+        for _ in range(self.depth):
+            x = flat_x[row_offset + self.feature[nodes]]
+            go_left = x <= self.threshold[nodes]
+            nan = np.isnan(x)
+            if nan.any():
+                go_left = np.where(nan, self.missing_left[nodes], go_left)
+            nodes = np.where(go_left, self.left[nodes], self.right[nodes])
+
+        # summing over axis 0 adds the trees in order, as sklearn's accumulator does
+        return self.value[nodes].sum(axis=0) / len(self.roots)
+
+    def save(self, directory):
+        directory = Path(directory)
+        directory.mkdir(parents=True, exist_ok=True)
+        for name in ARRAYS:
+            np.save(directory / f"{name}.npy", getattr(self, name))
+        np.save(directory / "shape.npy", np.array([self.depth, self.n_features], dtype=np.int64))
+
+    @classmethod
+    def load(cls, directory, mmap_mode=None):
+        directory = Path(directory)
+        arrays = {name: np.load(directory / f"{name}.npy", mmap_mode=mmap_mode) for name in ARRAYS}
+        depth, n_features = np.load(directory / "shape.npy")
+        return cls(depth=depth, n_features=n_features, **arrays)
+
+
+def compile_models(models):
+    """Flatten the 'weather' and 'air_quality' forests of a city models dict (other estimators are left to sklearn)."""
+    return {key: flat_forest.from_sklearn(models[key]) for key in ('weather', 'air_quality')
+            if hasattr(models.get(key), 'estimators_')}
+
+
+def _time_per_call(fn, repeat):
+    fn()
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter() - start) / repeat
+
+
+def benchmark(forest, X, batch_sizes=(1, 100, 10000), repeat=50):
+    """Compare sklearn and flat-engine latency on rows of X; raises if the outputs ever differ."""
+    flat = flat_forest.from_sklearn(forest)
+    results = []
+    for size in batch_sizes:
+        batch = X[np.arange(size) % len(X)]
+        expected = forest.predict(batch)
+        got = flat.predict(batch)
+        if not np.array_equal(expected, got):
+            raise AssertionError(f"flat engine differs from sklearn (max abs diff {np.abs(expected - got).max()})")
+        reps = max(1, repeat // max(1, size // 100))
+        t_sk = _time_per_call(lambda: forest.predict(batch), reps)
+        t_flat = _time_per_call(lambda: flat.predict(batch), reps)
+        results.append({'batch': size, 'sklearn_us': t_sk * 1e6, 'flat_us': t_flat * 1e6, 'speedup': t_sk / t_flat})
+    return results
+
+
+if __name__ == "__main__":
+    # Benchmark on a forest shaped like the serving models (100 trees on temp/aqi)
+    from sklearn.ensemble import RandomForestRegressor
+
+    rng = np.random.default_rng(0)
+    X = np.column_stack([rng.uniform(-5, 50, 2400), rng.uniform(1, 325, 2400)])
+    y = np.clip(9 - np.abs(X[:, 0] - 22) / 4 - X[:, 1] / 80 + rng.normal(0, 1, len(X)), 1, 10)
+    rf = RandomForestRegressor(n_estimators=100, random_state=42).fit(X, y)
+
+    X_test = np.column_stack([rng.uniform(-5, 60, 10000), rng.uniform(1, 325, 10000)])
+    for row in benchmark(rf, X_test):
+        print(f"batch={row['batch']:>6}  sklearn={row['sklearn_us']:>10.1f} us  flat={row['flat_us']:>10.1f} us  speedup={row['speedup']:.1f}x")
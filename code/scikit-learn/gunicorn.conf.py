@@ -0,0 +1,33 @@
+# gunicorn settings for the pre-fork serving mode; picked up automatically when gunicorn is started in this folder.
+#
+#   SHARED_WEIGHTS=1 gunicorn flask_post_data2:app
+#   SHARED_WEIGHTS=1 gunicorn asgi_app:app -k uvicorn.workers.UvicornWorker
+#
+# The city models are loaded once in the master (preload_app) before the workers are forked. With
+# SHARED_WEIGHTS=1 they are served from memory-mapped tree arrays in the model store, so all workers
+# use the same physical pages. Start-up time and per-process memory are logged; for a full breakdown run
+#   python process_memory.py <master pid>
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import process_memory as pm
+
+bind = os.environ.get("BIND", "0.0.0.0:5000")
+workers = int(os.environ.get("WEB_CONCURRENCY", "4"))
+preload_app = True
+# load every city in the master (instead of lazily in each worker) so the workers share them
+os.environ.setdefault("PRELOAD_MODELS", "1")
+
+_started = time.perf_counter()
+
+
+def when_ready(server):
+    server.log.info(f"Models loaded in master in {time.perf_counter() - _started:.2f}s; "
+                    f"master memory: {pm.format_usage(pm.memory_usage())}")
+
+
+def post_worker_init(worker):
+    worker.log.info(f"Worker {worker.pid} serving {time.perf_counter() - _started:.2f}s after start; "
+                    f"memory: {pm.format_usage(pm.memory_usage())}")
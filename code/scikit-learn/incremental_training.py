@@ -0,0 +1,169 @@
+# Incremental training: fold newly recorded feelings into a city's models without refitting from 1980.
+#
+#   python incremental_training.py Lahore new_feelings.csv                  # add trees fitted on the recent window
+#   python incremental_training.py Lahore new_feelings.csv --mode window    # refit on the recent window only
+#
+# The feelings file has the columns of the feeling CSVs (date, weather_satisfaction, air_quality_satisfaction)
+# and optionally temp and aqi; rows without them take the city's recorded weather and AQI of their day
+# (attach_readings), and rows of days that have no readings are dropped.
+# A running server takes new feelings on POST /admin/feelings (prediction_service.admin_feelings).
+import argparse
+import copy
+
+import pandas as pd
+from sklearn.metrics import r2_score
+
+import model_store as ms
+import prepared_data as pdc
+import random_forest_model as rfm
+import rolling_features as rf
+
+DEFAULT_ADD_TREES = 20        # trees added per update in 'grow' mode
+DEFAULT_MAX_TREES = 200       # oldest trees are dropped beyond this, so the forest follows recent data
+DEFAULT_WINDOW_DAYS = 5 * 365  # rows used to fit the new trees ('grow') or the whole forest ('window')
+
+
+def read_feelings(rows):
+    """New feeling rows (frame, list of dicts or CSV path) as a frame with prepared_data.COLUMNS."""
+    if isinstance(rows, str):
+        rows = pd.read_csv(rows)
+    df = pd.DataFrame(rows).copy()
+    for alt in ('_time', 'time'):
+        if 'date' not in df.columns and alt in df.columns:
+            df = df.rename(columns={alt: 'date'})
+    missing = [c for c in ('date',) + tuple(ms.TARGETS.values()) if c not in df.columns]
+    if missing:
+        raise KeyError(f"feeling rows are missing columns: {missing}")
+    for col in pdc.COLUMNS[3:]:
+        if col not in df.columns:
+            df[col] = float('nan')
+    df['date'] = pd.to_datetime(df['date'], errors='coerce', utc=True).dt.tz_localize(None).dt.normalize()
+    # several views on one day become that day's mean, like the daily rows of the feeling CSVs
+    return df.dropna(subset=['date']).groupby('date', as_index=False)[pdc.COLUMNS[1:]].mean()[pdc.COLUMNS]
+
+
+def attach_readings(city, rows, source=None):
+    """
+    Fill the feature columns a feeling row lacks with the city's recorded weather and AQI of that day.
+    Rows whose day has no temperature or AQI reading are dropped: the last known reading would teach
+    the new trees another day's conditions.
+    """
+    features = pdc.COLUMNS[3:]
+    need = rows[features].isna().any(axis=1)
+    if not need.any():
+        return rows
+    w_df, aqi_df = rfm.raw_readings(city, source)
+    w_df = rfm.to_date_only(w_df, 'date')
+    aqi_daily = rfm.daily_aqi(rfm.to_date_only(aqi_df, 'date'))
+    recorded = rows['date'].isin(w_df['date']) & rows['date'].isin(aqi_daily['date'])
+    rows = rows.set_index('date')
+    lookup = rows[(need & recorded).to_numpy()].reset_index()
+    if not lookup.empty:
+        days = rfm.prepare_frames(w_df, aqi_df, lookup[['date'] + list(ms.TARGETS.values())]).set_index('date')
+        rows[features] = rows[features].fillna(days[features])
+
+    missing = rows[['temp', 'aqi']].isna().any(axis=1)
+    if missing.any():
+        print(f"{city} - dropping {int(missing.sum())} feeling rows without temperature/AQI readings for their day: "
+              f"{[str(d.date()) for d in rows.index[missing]]}")
+        rows = rows[~missing]
+    # rows that brought their own temp and aqi but have no raw readings: a steady day, as rolling_features.neutral
+    steady = pd.DataFrame(rf.neutral(rows[['temp', 'aqi']].to_numpy(), rf.ROLLING), index=rows.index, columns=rf.ROLLING)
+    rows[rf.ROLLING] = rows[rf.ROLLING].fillna(steady)
+    return rows.reset_index()[pdc.COLUMNS]
+
+
+def grow_forest(est, X, y, add_trees=DEFAULT_ADD_TREES, max_trees=DEFAULT_MAX_TREES):
+    """Copy of a fitted forest with add_trees more trees fitted on (X, y); est itself is not modified."""
+    new = copy.copy(est)
+    new.estimators_ = list(est.estimators_)
+    new.set_params(warm_start=True, n_estimators=len(est.estimators_) + add_trees)
+    new.fit(X, y)
+    if max_trees and len(new.estimators_) > max_trees:
+        new.estimators_ = new.estimators_[-max_trees:]
+    new.set_params(warm_start=False, n_estimators=len(new.estimators_))
+    return new
+
+
+def _size(est):
+    if hasattr(est, 'estimators_'):
+        return f"{len(est.estimators_)} trees"
+    return f"{est.n_iter_} iterations"
+
+
+def update_city(city_model, rows, mode='grow', add_trees=DEFAULT_ADD_TREES, max_trees=DEFAULT_MAX_TREES,
+                window_days=DEFAULT_WINDOW_DAYS, store_dir=None, cache_dir=None):
+    """
+    Append the feelings newer than the city's training watermark and update its forests.
+    Returns (model, number of new rows). The updated model is a new object: city_model keeps serving
+    unchanged until the caller swaps the reference (see prediction_service.model_cache.update).
+    """
+    if mode not in ('grow', 'window'):
+        raise ValueError(f"Unknown mode '{mode}', expected 'grow' or 'window'")
+    city = city_model.city
+    source = getattr(city_model, 'source', None)
+
+    prepared = rfm.prepare_training_data(city, city_model.fingerprint, source, cache_dir)
+    rows = read_feelings(rows)
+    if not prepared.empty:
+        rows = rows[rows['date'] > prepared['date'].max()]
+    if not rows.empty:
+        rows = attach_readings(city, rows, source)
+    if rows.empty:
+        return city_model, 0
+    pdc.append_rows(city, rows, cache_dir)
+
+    df = rfm.prepare_training_data(city, city_model.fingerprint, source, cache_dir).dropna(subset=list(ms.TARGETS.values()))
+    recent = df[df['date'] > df['date'].max() - pd.Timedelta(days=window_days)]
+    features = getattr(city_model, 'features', ms.FEATURES)
+    X = recent[features].to_numpy()
+    backend = getattr(city_model, 'backend', None)
+
+    current = city_model.models
+    if mode == 'grow' and not any(current.get(key) is not None for key in ms.TARGETS):
+        # shared-weights models keep only the flat arrays in memory; grow from the stored forests
+        current = ms.load_artifact(city, city_model.fingerprint, store_dir=store_dir, features=features, backend=backend) or {}
+
+    models = {'scores': {}}
+    for key, col in ms.TARGETS.items():
+        y = recent[col].to_numpy()
+        est = current.get(key)
+        if len(y) < rfm.MIN_ROWS:
+            print(f"{city} - not enough recent samples for {key} model ({len(y)} rows); keeping it unchanged.")
+            if est is not None:
+                models[key] = est
+            continue
+        if mode == 'grow' and hasattr(est, 'estimators_'):
+            models[key] = grow_forest(est, X, y, add_trees, max_trees)
+        else:
+            # boosted models cannot take extra trees fitted on other rows; they are refitted on the window
+            models[key], _ = rfm.fit_target(X, y, backend=backend)
+        models['scores'][f"{key}_r2"] = r2_score(y, models[key].predict(X))
+        print(f"{city} - {key} model updated ({_size(models[key])}) on {len(y)} recent rows, "
+              f"R^2 = {models['scores'][f'{key}_r2']:.3f}")
+
+    watermark = str(df['date'].max().date())
+    path = ms.save_artifact(city, models, city_model.fingerprint, n_rows=len(df), store_dir=store_dir, watermark=watermark,
+                            backend=backend, features=features)
+    ms.prune(city, city_model.fingerprint, store_dir=store_dir)
+    print(f"Saved {city} models to {path} (watermark {watermark})")
+    models['meta'] = ms.artifact_meta(city, city_model.fingerprint, store_dir=store_dir, features=features, backend=backend)
+    if getattr(city_model, 'shared_weights', False):
+        models = ms.load_artifact(city, city_model.fingerprint, store_dir=store_dir, estimators=False, features=features,
+                                  backend=backend)
+    return city_model.with_models(models), len(rows)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Add newly recorded feelings to a city's models")
+    parser.add_argument("city")
+    parser.add_argument("feelings", help="CSV with date, weather_satisfaction, air_quality_satisfaction[, temp, aqi]")
+    parser.add_argument("--mode", choices=("grow", "window"), default="grow")
+    parser.add_argument("--add-trees", type=int, default=DEFAULT_ADD_TREES)
+    parser.add_argument("--max-trees", type=int, default=DEFAULT_MAX_TREES)
+    parser.add_argument("--window-days", type=int, default=DEFAULT_WINDOW_DAYS)
+    args = parser.parse_args()
+
+    m, n_new = update_city(rfm.model(args.city), args.feelings, mode=args.mode, add_trees=args.add_trees,
+                           max_trees=args.max_trees, window_days=args.window_days)
+    print(f"{args.city}: {n_new} new rows")
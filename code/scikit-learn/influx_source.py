@@ -0,0 +1,325 @@
+# Training data straight from InfluxDB instead of the CSV files (TRAINING_SOURCE=influx).
+#
+#   INFLUX_URL=http://localhost:8086 INFLUX_TOKEN=... TRAINING_SOURCE=influx python random_forest_model.py
+#   python influx_source.py Lahore --stand-in        # check the pipeline offline against the CSV files
+#   python influx_source.py Lahore --record fixtures # pull from InfluxDB and keep the responses as fixtures
+#   python influx_source.py Lahore --replay fixtures # rerun from the recorded fixtures only
+#
+# Each city's series (<city>Weather/Temperature, <city>AQI/AQI and <city>FeelsLike/weather + AirQuality, the
+# buckets the Node-RED flows write) is pulled as daily means computed by InfluxDB (aggregateWindow), plus
+# the daily minimum and maximum temperature for the rolling features (rolling_features.py), in
+# time chunks that are queried in parallel. The rows go straight into arrays and through the same
+# alignment as the CSV path (random_forest_model.prepare_frames); the result lands in the prepared-data cache.
+# The data version (fingerprint) is the time of the last stored point of every series, so it only changes when
+# new points arrive. random_forest_model uses one source per process (shared()), whose client is closed at exit.
+import argparse
+import atexit
+import hashlib
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+import random_forest_model as rfm
+
+# influxdb_client is only needed when querying a real InfluxDB
+try:
+    from influxdb_client import InfluxDBClient
+except Exception:
+    InfluxDBClient = None
+
+# column -> (bucket, measurement, daily aggregate) per city, as written by code/nodered/flows.json
+SERIES = {
+    'temp': ('{city}Weather', 'Temperature', 'mean'),
+    'temp_min': ('{city}Weather', 'Temperature', 'min'),
+    'temp_max': ('{city}Weather', 'Temperature', 'max'),
+    'aqi': ('{city}AQI', 'AQI', 'mean'),
+    'weather_satisfaction': ('{city}FeelsLike', 'weather', 'mean'),
+    'air_quality_satisfaction': ('{city}FeelsLike', 'AirQuality', 'mean'),
+}
+# the CSV column each series comes from (csv_stand_in)
+CSV_COLUMNS = {'temp_min': 'temp', 'temp_max': 'temp'}
+FIELD = '_value'
+DEFAULT_START = '1980-01-01'
+DEFAULT_CHUNK_DAYS = 365
+DEFAULT_WORKERS = 4
+
+
+def query_specs(city, start, stop, chunk_days=DEFAULT_CHUNK_DAYS, series=SERIES):
+    """One query per (column, time chunk): dicts with city, column, bucket, measurement, field, fn, start, stop."""
+    edges = list(pd.date_range(start, stop, freq=f"{chunk_days}D"))
+    if not edges or edges[-1] < pd.Timestamp(stop):
+        edges.append(pd.Timestamp(stop))
+    prefix = city[:1].lower() + city[1:]
+    specs = []
+    for column, (bucket, measurement, fn) in series.items():
+        for lo, hi in zip(edges[:-1], edges[1:]):
+            specs.append({'city': city, 'column': column, 'bucket': bucket.format(city=prefix),
+                          'measurement': measurement, 'field': FIELD, 'fn': fn,
+                          'start': lo.strftime("%Y-%m-%dT%H:%M:%SZ"), 'stop': hi.strftime("%Y-%m-%dT%H:%M:%SZ")})
+    return specs
+
+
+def last_point_specs(city, start, stop, series=SERIES):
+    """One query per distinct (bucket, measurement) of a city: its last point in [start, stop) (fn 'last')."""
+    prefix = city[:1].lower() + city[1:]
+    specs = {}
+    for column, (bucket, measurement, _) in series.items():
+        specs.setdefault((bucket, measurement), {
+            'city': city, 'column': column, 'bucket': bucket.format(city=prefix), 'measurement': measurement,
+            'field': FIELD, 'fn': 'last', 'start': pd.Timestamp(start).strftime("%Y-%m-%dT%H:%M:%SZ"),
+            'stop': pd.Timestamp(stop).strftime("%Y-%m-%dT%H:%M:%SZ")})
+    return list(specs.values())
+
+
+def flux(spec):
+    """
+    Flux for one spec: daily aggregates (mean, min or max) computed in the database, one row per day that has data;
+    for fn 'last' the last point of the range.
+    """
+    if spec.get("fn") == "last":
+        window = '  |> last()\n'
+    else:
+        window = f'  |> aggregateWindow(every: 1d, fn: {spec.get("fn", "mean")}, createEmpty: false, timeSrc: "_start")\n'
+    return (f'from(bucket: "{spec["bucket"]}")\n'
+            f'  |> range(start: {spec["start"]}, stop: {spec["stop"]})\n'
+            f'  |> filter(fn: (r) => r._measurement == "{spec["measurement"]}" and r._field == "{spec["field"]}")\n'
+            + window +
+            f'  |> keep(columns: ["_time", "_value"])')
+
+
+# ---------------------------
+# Query runners: spec -> (datetime64[ns] array of UTC days, float array of daily aggregates)
+# ---------------------------
+def influx_runner(url, token, org, timeout=120_000):
+    """Runs specs against InfluxDB, reading the result records as a stream."""
+    if InfluxDBClient is None:
+        raise ImportError("TRAINING_SOURCE=influx needs influxdb-client: pip install influxdb-client")
+    client = InfluxDBClient(url=url, token=token, org=org, timeout=timeout)
+    query_api = client.query_api()
+
+    def run(spec):
+        times, values = [], []
+        for record in query_api.query_stream(flux(spec), org=org):
+            times.append(record.get_time())
+            values.append(record.get_value())
+        return _arrays(times, values)
+
+    run.source = f"{url}|{org}"
+    run.close = client.close
+    return run
+
+
+def recorded_runner(directory, runner=None):
+    """Replays responses saved in directory (one JSON file per query); with a runner, records missing ones."""
+    directory = Path(directory)
+
+    def run(spec):
+        path = directory / f"{hashlib.sha256(flux(spec).encode('utf-8')).hexdigest()[:16]}.json"
+        if path.exists():
+            with open(path, encoding="utf-8") as f:
+                rec = json.load(f)
+            return _arrays(rec['times'], rec['values'])
+        if runner is None:
+            raise FileNotFoundError(f"no recorded response for {spec['bucket']} {spec['start']}..{spec['stop']} in {directory}")
+        times, values = runner(spec)
+        directory.mkdir(parents=True, exist_ok=True)
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump({'query': flux(spec), 'times': [str(t) for t in times], 'values': values.tolist()}, f)
+        return times, values
+
+    run.source = f"recorded:{directory.resolve()}"
+    if runner is not None and hasattr(runner, 'close'):
+        run.close = runner.close
+    return run
+
+
+def csv_stand_in(cities_files=None):
+    """Answers specs from the CSV files with the same daily-aggregate semantics, for offline runs of the pipeline."""
+    cities_files = cities_files or rfm.CITIES_FILES
+    frames = {}
+    lock = threading.Lock()
+    roles = {'temp': 'weather', 'temp_min': 'weather', 'temp_max': 'weather', 'aqi': 'aqi',
+             'weather_satisfaction': 'feeling', 'air_quality_satisfaction': 'feeling'}
+    def run(spec):
+        path = cities_files[spec['city']][roles[spec['column']]]
+        with lock:
+            if path not in frames:
+                frames[path] = rfm.to_date_only(pd.read_csv(path), 'date')
+        df = frames[path]
+        lo, hi = pd.Timestamp(spec['start']).tz_localize(None), pd.Timestamp(spec['stop']).tz_localize(None)
+        column = CSV_COLUMNS.get(spec['column'], spec['column'])
+        rows = df[(df['date'] >= lo) & (df['date'] < hi)].dropna(subset=[column])
+        if spec.get('fn') == 'last':
+            rows = rows.sort_values('date', kind='stable').tail(1)
+            return rows['date'].to_numpy(dtype='datetime64[ns]'), rows[column].to_numpy(dtype=float)
+        daily = rows.groupby('date')[column].agg(spec.get('fn', 'mean'))
+        return daily.index.to_numpy(dtype='datetime64[ns]'), daily.to_numpy(dtype=float)
+
+    run.source = "csv-stand-in"
+    return run
+
+
+def csv_frame(city, start, stop, cities_files=None):
+    """What the CSV pipeline prepares for a city over [start, stop): the reference for csv_stand_in runs."""
+    files = (cities_files or rfm.CITIES_FILES)[city]
+    lo, hi = pd.Timestamp(start), pd.Timestamp(stop)
+    raw = [rfm.to_date_only(pd.read_csv(files[role]), 'date') for role in ('weather', 'aqi', 'feeling')]
+    return rfm.prepare_frames(*[df[(df['date'] >= lo) & (df['date'] < hi)] for df in raw])
+
+
+def _arrays(times, values):
+    t = pd.to_datetime(pd.Series(times, dtype=object), utc=True).dt.tz_localize(None).to_numpy(dtype='datetime64[ns]')
+    v = np.array([np.nan if x is None else x for x in values], dtype=float)
+    return t, v
+
+
+class influx_source():
+    def __init__(self, runner, start=DEFAULT_START, stop=None, chunk_days=DEFAULT_CHUNK_DAYS, workers=DEFAULT_WORKERS):
+        self.runner = runner
+        self.start = start
+        self._stop = stop
+        self.chunk_days = chunk_days
+        self.workers = workers
+
+    @property
+    def stop(self):
+        # up to the start of today (UTC), so a day's data is only pulled once it is complete; a long-lived
+        # source (shared()) moves on with the date
+        return self._stop or pd.Timestamp.now(tz='UTC').normalize().strftime("%Y-%m-%d")
+
+    def fingerprint(self, city):
+        """
+        Identifies the data load_city(city) would pull: source, start and the time of the last point of every
+        series before stop. It stays the same from day to day until new points arrive (points written later
+        into days already covered are not noticed; delete the city's prepared data to pull them).
+        """
+        stop = self.stop
+        specs = last_point_specs(city, self.start, stop)
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="influx") as pool:
+            results = list(pool.map(self.runner, specs))
+        h = hashlib.sha256(f"{getattr(self.runner, 'source', 'influx')}\n{self.start}\n".encode("utf-8"))
+        for spec, (times, _) in zip(specs, results):
+            last = str(times.max()) if len(times) else "<empty>"
+            h.update(f"{spec['bucket']}/{spec['measurement']}/{spec['field']}:{last}\n".encode("utf-8"))
+        return h.hexdigest()
+
+    def close(self):
+        """Close the InfluxDB client of the runner, if it has one."""
+        close = getattr(self.runner, 'close', None)
+        if close is not None:
+            close()
+
+    def pull(self, city):
+        """{column: (days, values)} for a city, every chunk queried in parallel."""
+        specs = query_specs(city, self.start, self.stop, self.chunk_days)
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="influx") as pool:
+            results = list(pool.map(self.runner, specs))
+        out = {}
+        for column in SERIES:
+            parts = [res for spec, res in zip(specs, results) if spec['column'] == column]
+            days = np.concatenate([p[0] for p in parts]) if parts else np.array([], dtype='datetime64[ns]')
+            values = np.concatenate([p[1] for p in parts]) if parts else np.array([], dtype=float)
+            if len(np.unique(days)) != len(days):
+                # a day split over two chunks comes back once per chunk
+                daily = pd.Series(values).groupby(days).agg(SERIES[column][2])
+                days, values = daily.index.to_numpy(dtype='datetime64[ns]'), daily.to_numpy()
+            out[column] = (days, values)
+        return out
+
+    @staticmethod
+    def _frames(series):
+        # one row per day: the mean for the daily temperature, min and max for the rolling features
+        w_df = pd.concat([pd.Series(series[col][1], index=series[col][0], name=col) for col in ('temp', 'temp_min', 'temp_max')],
+                         axis=1).rename_axis('date').reset_index()
+        aqi_df = pd.DataFrame({'date': series['aqi'][0], 'aqi': series['aqi'][1]})
+        return w_df, aqi_df
+
+    def readings(self, city):
+        """Raw (weather, aqi) frames of a city, before they are aligned to the feeling dates."""
+        return self._frames(self.pull(city))
+
+    def load_city(self, city):
+        """Daily-aligned training frame of a city (same columns as load_and_prepare_city)."""
+        series = self.pull(city)
+        w_df, aqi_df = self._frames(series)
+        feelings = [pd.Series(series[col][1], index=series[col][0], name=col)
+                    for col in ('weather_satisfaction', 'air_quality_satisfaction')]
+        f_df = pd.concat(feelings, axis=1).rename_axis('date').reset_index()
+        buckets = {spec['column']: spec['bucket'] for spec in query_specs(city, self.start, self.stop, self.chunk_days)}
+        return rfm.prepare_frames(w_df, aqi_df, f_df,
+                                  sources=(buckets['temp'], buckets['aqi'], buckets['weather_satisfaction']))
+
+
+_shared = None
+_shared_lock = threading.Lock()
+
+
+def shared():
+    """The influx_source of this process (from_env(), created on first use): one InfluxDB client, closed at exit."""
+    global _shared
+    with _shared_lock:
+        if _shared is None:
+            _shared = from_env()
+            atexit.register(_shared.close)
+        return _shared
+
+
+def _after_fork():
+    # a forked worker (gunicorn --preload) opens its own client instead of sharing the parent's connections
+    global _shared, _shared_lock
+    _shared = None
+    _shared_lock = threading.Lock()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_after_fork)
+
+
+def from_env():
+    """influx_source configured by INFLUX_URL, INFLUX_TOKEN, INFLUX_ORG, INFLUX_START, INFLUX_CHUNK_DAYS, INFLUX_WORKERS
+    and INFLUX_FIXTURES (replay recorded responses from that folder instead of querying)."""
+    if os.environ.get("INFLUX_FIXTURES"):
+        runner = recorded_runner(os.environ["INFLUX_FIXTURES"])
+    else:
+        runner = influx_runner(os.environ.get("INFLUX_URL", "http://localhost:8086"), os.environ.get("INFLUX_TOKEN", ""),
+                               os.environ.get("INFLUX_ORG", "abacus-demo"))
+    return influx_source(runner, start=os.environ.get("INFLUX_START", DEFAULT_START),
+                         stop=os.environ.get("INFLUX_STOP") or None,
+                         chunk_days=int(os.environ.get("INFLUX_CHUNK_DAYS", DEFAULT_CHUNK_DAYS)),
+                         workers=int(os.environ.get("INFLUX_WORKERS", DEFAULT_WORKERS)))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Pull a city's training data from InfluxDB into the prepared-data cache")
+    parser.add_argument("city")
+    mode = parser.add_mutually_exclusive_group()
+    mode.add_argument("--stand-in", action="store_true", help="answer the queries from the CSV files and compare")
+    mode.add_argument("--record", metavar="DIR", help="query InfluxDB and save every response in DIR")
+    mode.add_argument("--replay", metavar="DIR", help="use only the responses recorded in DIR")
+    parser.add_argument("--stop", default=None, help="end of the range (default: start of today, UTC)")
+    args = parser.parse_args()
+
+    if args.stand_in:
+        runner = csv_stand_in()
+    elif args.replay:
+        runner = recorded_runner(args.replay)
+    else:
+        env = from_env()
+        runner = recorded_runner(args.record, env.runner) if args.record else env.runner
+    src = influx_source(runner, start=os.environ.get("INFLUX_START", DEFAULT_START), stop=args.stop,
+                        chunk_days=int(os.environ.get("INFLUX_CHUNK_DAYS", DEFAULT_CHUNK_DAYS)),
+                        workers=int(os.environ.get("INFLUX_WORKERS", DEFAULT_WORKERS)))
+
+    start = time.perf_counter()
+    df = src.load_city(args.city)
+    print(f"{args.city}: {len(df)} daily rows from {len(query_specs(args.city, src.start, src.stop, src.chunk_days))} "
+          f"queries in {time.perf_counter() - start:.2f}s")
+    if args.stand_in:
+        pd.testing.assert_frame_equal(csv_frame(args.city, src.start, src.stop)[df.columns], df, check_dtype=False)
+        print("matches the CSV pipeline")
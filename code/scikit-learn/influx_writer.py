@@ -0,0 +1,174 @@
+# Direct writes of predictions into the <city>Predictions buckets, without the hop through Node-RED.
+#
+#   INFLUX_WRITE=1 INFLUX_URL=http://localhost:8086 INFLUX_TOKEN=... python flask_post_data2.py
+#   python influx_writer.py --stand-in        # check batching and retries against a local HTTP stand-in
+#
+# Each /postData result becomes two points in the city's bucket, in the schema the Node-RED flow writes
+# and the Grafana panels read: measurement Temperature (weather satisfaction) and AQI (air quality
+# satisfaction), field _value. Points are queued as line protocol and a background thread sends them to
+# /api/v2/write, one request per bucket per batch, flushed when batch_size lines are waiting or
+# flush_interval has passed. Delivery, connection reuse and retries are those of node_red_sender.
+import argparse
+import http.server
+import os
+import threading
+import time
+from collections import defaultdict
+from urllib.parse import parse_qs, urlencode, urlsplit
+
+from node_red_sender import node_red_sender
+
+# prediction key -> measurement in the <city>Predictions buckets, as written by code/nodered/flows.json
+MEASUREMENTS = {
+    'weather_satisfaction': 'Temperature',
+    'air_quality_satisfaction': 'AQI',
+}
+FIELD = '_value'
+BUCKET = '{city}Predictions'
+
+
+def bucket_for(city, bucket=BUCKET):
+    return bucket.format(city=city[:1].lower() + city[1:])
+
+
+def _escape(name):
+    return name.replace(',', r'\,').replace(' ', r'\ ').replace('=', r'\=')
+
+
+def prediction_lines(predictions, ts_ms):
+    """Line protocol for one result's predictions (None values are skipped)."""
+    lines = []
+    for key, measurement in MEASUREMENTS.items():
+        value = predictions.get(key)
+        if value is None:
+            continue
+        lines.append(f"{_escape(measurement)} {FIELD}={float(value)!r} {int(ts_ms)}")
+    return lines
+
+
+class influx_writer(node_red_sender):
+    """node_red_sender that writes line protocol to InfluxDB; each queued item is (bucket, line)."""
+    target = "InfluxDB"
+    content_type = "text/plain; charset=utf-8"
+
+    def __init__(self, url, token="", org="abacus-demo", bucket=BUCKET, max_queue=10000, batch_size=500,
+                 flush_interval=1.0, **kw):
+        self.token = token
+        self.org = org
+        self.bucket = bucket
+        self.write_url = url.rstrip("/") + "/api/v2/write"
+        super().__init__(self.write_url, max_queue=max_queue, batch_size=batch_size, flush_interval=flush_interval, **kw)
+
+    def _start(self):
+        super()._start()
+        self.stats.update({'points': 0, 'writes': 0})
+
+    def submit_result(self, result_payload, ts_ms=None):
+        """Queue the points of one /postData result; returns False if any of them was dropped."""
+        ts_ms = int(time.time() * 1000) if ts_ms is None else ts_ms
+        bucket = bucket_for(result_payload["city"], self.bucket)
+        return all([self.submit((bucket, line)) for line in prediction_lines(result_payload["predictions"], ts_ms)])
+
+    def _headers(self):
+        headers = {"Content-Type": self.content_type}
+        if self.token:
+            headers["Authorization"] = f"Token {self.token}"
+        return headers
+
+    def _send_batch(self, batch):
+        by_bucket = defaultdict(list)
+        for bucket, line in batch:
+            by_bucket[bucket].append(line)
+        ok = True
+        for bucket, lines in by_bucket.items():
+            url = f"{self.write_url}?{urlencode({'org': self.org, 'bucket': bucket, 'precision': 'ms'})}"
+            if self._deliver("\n".join(lines).encode("utf-8"), url):
+                self._count('points', len(lines))
+                self._count('writes')
+            else:
+                ok = False
+        return ok
+
+
+def from_env():
+    """influx_writer for INFLUX_URL, INFLUX_TOKEN and INFLUX_ORG when INFLUX_WRITE=1, else None.
+    INFLUX_WRITE_BATCH (lines per write) and INFLUX_WRITE_INTERVAL (seconds) tune the flushing."""
+    if os.environ.get("INFLUX_WRITE", "0") != "1":
+        return None
+    return influx_writer(os.environ.get("INFLUX_URL", "http://localhost:8086"), os.environ.get("INFLUX_TOKEN", ""),
+                         os.environ.get("INFLUX_ORG", "abacus-demo"),
+                         batch_size=int(os.environ.get("INFLUX_WRITE_BATCH", "500")),
+                         flush_interval=float(os.environ.get("INFLUX_WRITE_INTERVAL", "1.0")))
+
+
+# ---------------------------
+# Local stand-in for /api/v2/write, for checking the writer without an InfluxDB
+# ---------------------------
+class stand_in():
+    """HTTP server on 127.0.0.1 that accepts writes and records lines per bucket; the first `fail` writes get 503."""
+
+    def __init__(self, fail=0):
+        self.lines = defaultdict(list)
+        self.requests = 0
+        self.fail = fail
+        owner = self
+
+        class handler(http.server.BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get("Content-Length", 0))).decode("utf-8")
+                query = parse_qs(urlsplit(self.path).query)
+                owner.requests += 1
+                if owner.fail > 0:
+                    owner.fail -= 1
+                    status = 503
+                else:
+                    owner.lines[query["bucket"][0]].extend(body.split("\n"))
+                    status = 204
+                self.send_response(status)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+
+            def log_message(self, *args):
+                pass
+
+        self.server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), handler)
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def close(self):
+        self.server.shutdown()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Write predictions straight to the <city>Predictions buckets")
+    parser.add_argument("--stand-in", action="store_true", help="write to a local HTTP stand-in and check what arrived")
+    parser.add_argument("--results", type=int, default=4000, help="number of results to write")
+    parser.add_argument("--fail", type=int, default=2, help="writes the stand-in rejects with 503 first (--stand-in)")
+    args = parser.parse_args()
+
+    server = stand_in(fail=args.fail) if args.stand_in else None
+    writer = influx_writer(server.url, backoff=0.05) if server else from_env()
+    if writer is None:
+        parser.error("set INFLUX_WRITE=1 (and INFLUX_URL/INFLUX_TOKEN) or use --stand-in")
+
+    cities = ("Lahore", "Islamabad", "Karachi")
+    start = time.perf_counter()
+    for i in range(args.results):
+        writer.submit_result({"city": cities[i % 3],
+                              "predictions": {"weather_satisfaction": 5 + i % 5, "air_quality_satisfaction": 3.5}},
+                             ts_ms=1_700_000_000_000 + i)
+    writer.flush()
+    elapsed = time.perf_counter() - start
+    status = writer.status()
+    print(f"{status['points']} points in {status['writes']} writes ({status['retries']} retries) "
+          f"in {elapsed:.2f}s: {status['points'] / elapsed:,.0f} points/s")
+    if server:
+        got = {bucket: len(lines) for bucket, lines in server.lines.items()}
+        expected = {bucket_for(c): 2 * len(range(i, args.results, 3)) for i, c in enumerate(cities)}
+        if got != expected:
+            raise AssertionError(f"stand-in received {got}, expected {expected}")
+        print(f"stand-in received every point ({server.requests} requests): {got}")
+        server.close()
+    writer.close()
@@ -0,0 +1,102 @@
+# Load test for the prediction service (Flask or ASGI mode).
+#
+# 1. Start a local Node-RED stub (this script does it with --stub-port) and point the server at it:
+#      NODE_RED_URL=http://127.0.0.1:1881/predictions uvicorn asgi_app:app --port 5000
+# 2. Run:
+#      python load_test.py --url http://127.0.0.1:5000/postData --requests 2000 --concurrency 50 --stub-port 1881
+import argparse
+import asyncio
+import http.server
+import json
+import random
+import threading
+import time
+
+import httpx
+import numpy as np
+
+
+class _stub_handler(http.server.BaseHTTPRequestHandler):
+    """Accepts every POST like the Node-RED /predictions flow and counts the results received."""
+    protocol_version = "HTTP/1.1"
+    received = 0
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"null")
+        _stub_handler.received += len(body) if isinstance(body, list) else 1
+        self.send_response(200)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+def start_node_red_stub(port):
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", port), _stub_handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def make_payload(cities, n_points):
+    return {
+        "city": random.choice(cities),
+        "temperature": [{"_value": round(random.uniform(5, 45), 2)} for _ in range(n_points)],
+        "aqi": [{"_value": round(random.uniform(20, 300), 1)} for _ in range(n_points)],
+    }
+
+
+async def run_load(url, n_requests, concurrency, cities, n_points):
+    latencies = []
+    statuses = {}
+    payloads = [make_payload(cities, n_points) for _ in range(n_requests)]
+    next_idx = iter(range(n_requests))
+
+    async def worker(client):
+        for i in next_idx:
+            start = time.perf_counter()
+            try:
+                r = await client.post(url, json=payloads[i])
+                status = r.status_code
+            except Exception:
+                status = "error"
+            latencies.append(time.perf_counter() - start)
+            statuses[status] = statuses.get(status, 0) + 1
+
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(timeout=120, limits=limits) as client:
+        wall = time.perf_counter()
+        await asyncio.gather(*(worker(client) for _ in range(concurrency)))
+        wall = time.perf_counter() - wall
+
+    lat_ms = np.array(latencies) * 1000
+    return {
+        "requests": n_requests,
+        "concurrency": concurrency,
+        "points_per_request": n_points,
+        "wall_s": round(wall, 3),
+        "rps": round(n_requests / wall, 1),
+        "p50_ms": round(float(np.percentile(lat_ms, 50)), 2),
+        "p99_ms": round(float(np.percentile(lat_ms, 99)), 2),
+        "max_ms": round(float(lat_ms.max()), 2),
+        "status_counts": {str(k): v for k, v in statuses.items()},
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load test /postData and report latency percentiles and throughput")
+    parser.add_argument("--url", default="http://127.0.0.1:5000/postData")
+    parser.add_argument("--requests", type=int, default=1000)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--points", type=int, default=12, help="temperature/aqi points per request")
+    parser.add_argument("--cities", default="Lahore,Islamabad,Karachi")
+    parser.add_argument("--stub-port", type=int, default=None, help="also run a Node-RED stub on this port")
+    args = parser.parse_args()
+
+    stub = start_node_red_stub(args.stub_port) if args.stub_port else None
+    report = asyncio.run(run_load(args.url, args.requests, args.concurrency, args.cities.split(","), args.points))
+    if stub is not None:
+        time.sleep(1)  # let the server flush its queued callbacks
+        report["node_red_stub_received"] = _stub_handler.received
+        stub.shutdown()
+    print(json.dumps(report, indent=2))
@@ -0,0 +1,215 @@
+# Model backends per city, and tuning of their size against a latency and size budget.
+#
+#   python model_backends.py Lahore --backend hist_gb --p99-ms 2 --max-kb 500            # tune and report
+#   python model_backends.py Lahore --backend capped_forest --p99-ms 1 --max-kb 2000 --apply   # ...and serve it
+#
+# Backends:
+#   forest         the 100-tree random forest (FOREST_PARAMS), served by the flat engine
+#   capped_forest  a random forest with fewer, depth-limited trees, also served by the flat engine
+#   hist_gb        histogram gradient boosting (HistGradientBoostingRegressor), served by sklearn
+# The backend of each city comes from model_backends.json (written by --apply; MODEL_BACKENDS names another
+# file); cities without an entry use MODEL_BACKEND (default 'forest'). A stored artifact is only reused when it
+# was trained with the same backend and parameters.
+# tune() fits every candidate size on all rows first and measures the p99 latency of one prediction (both
+# targets, through the serving path) and the model size; only candidates within the budget are scored with
+# time-series cross-validation. The most accurate of them is chosen and its R^2 is reported next to the
+# default forest's.
+import argparse
+import json
+import os
+import pickle
+import time
+from pathlib import Path
+
+import numpy as np
+from sklearn.ensemble import HistGradientBoostingRegressor, RandomForestRegressor
+
+BACKENDS = ('forest', 'capped_forest', 'hist_gb')
+DEFAULT_BACKEND = os.environ.get("MODEL_BACKEND", "forest")
+DEFAULT_PARAMS = {
+    'forest': {},   # random_forest_model.FOREST_PARAMS
+    'capped_forest': {'n_estimators': 25, 'max_depth': 10},
+    'hist_gb': {'max_iter': 100, 'max_depth': 6},
+}
+# candidate sizes tried by tune(), smallest first along each axis
+GRIDS = {
+    'capped_forest': {'n_estimators': (10, 25, 50, 100), 'max_depth': (6, 8, 10, 14, None)},
+    'hist_gb': {'max_iter': (25, 50, 100, 200, 400), 'max_depth': (3, 4, 6, 8, None)},
+}
+CONFIG_PATH = Path(os.environ.get("MODEL_BACKENDS", Path(__file__).resolve().parent / "model_backends.json"))
+
+
+def make(backend, params=None, n_jobs=None):
+    """Unfitted estimator of a backend."""
+    import random_forest_model as rfm
+
+    params = dict(params or {})
+    if backend == 'forest':
+        return RandomForestRegressor(**{**rfm.FOREST_PARAMS, **params}, n_jobs=n_jobs)
+    if backend == 'capped_forest':
+        return RandomForestRegressor(**{**rfm.FOREST_PARAMS, **DEFAULT_PARAMS['capped_forest'], **params}, n_jobs=n_jobs)
+    if backend == 'hist_gb':
+        # a fixed number of iterations: early stopping would make the size depend on the data split
+        return HistGradientBoostingRegressor(**{'random_state': 42, 'early_stopping': False,
+                                                **DEFAULT_PARAMS['hist_gb'], **params})
+    raise ValueError(f"Unknown backend '{backend}', expected one of {BACKENDS}")
+
+
+def is_forest(est):
+    """True for estimators the flat engine can serve."""
+    return hasattr(est, 'estimators_') or hasattr(est, 'tree_')
+
+
+def estimator_bytes(est):
+    """Approximate RAM of a fitted estimator's trees."""
+    if is_forest(est):
+        # sklearn tree nodes are 64-byte structs plus one float64 value per node
+        return sum(e.tree_.node_count * (64 + 8 * e.tree_.value.shape[1] * e.tree_.value.shape[2])
+                   for e in getattr(est, 'estimators_', [est]))
+    predictors = getattr(est, '_predictors', None)
+    if predictors is not None:
+        return sum(p.nodes.nbytes for per_iter in predictors for p in per_iter)
+    return len(pickle.dumps(est, protocol=pickle.HIGHEST_PROTOCOL))
+
+
+def load_config(path=None):
+    path = Path(path or CONFIG_PATH)
+    if not path.exists():
+        return {}
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def config_for(city, path=None):
+    """{'name': backend, 'params': {...}} serving a city."""
+    entry = load_config(path).get(city) or {'backend': DEFAULT_BACKEND}
+    if entry['backend'] not in BACKENDS:
+        raise ValueError(f"Unknown backend '{entry['backend']}' for {city}, expected one of {BACKENDS}")
+    return {'name': entry['backend'], 'params': entry.get('params', {})}
+
+
+def save_config(city, backend, params, report=None, path=None):
+    path = Path(path or CONFIG_PATH)
+    config = load_config(path)
+    config[city] = {'backend': backend, 'params': params}
+    if report is not None:
+        config[city]['tuning'] = report
+    tmp = path.with_name(path.name + f".tmp{os.getpid()}")
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(config, f, indent=2)
+    os.replace(tmp, path)
+
+
+# ---------------------------
+# Tuning against a latency and size budget
+# ---------------------------
+def _latency_p99(models, n=300, seed=0):
+    """p99 ms of one prediction through every target model, on the engine serving would use (predict_raw)."""
+    import random_forest_model as rfm
+
+    rng = np.random.default_rng(seed)
+    rows = np.column_stack([rng.uniform(-5, 50, n), rng.uniform(1, 400, n)])
+    served = rfm.model.from_models("tune", models)
+    for key in models:
+        served.predict_raw(key, rows[:1])
+    lat = []
+    for i in range(n):
+        inp = rows[i:i + 1]
+        start = time.perf_counter()
+        for key in models:
+            served.predict_raw(key, inp)
+        lat.append(time.perf_counter() - start)
+    return float(np.percentile(np.array(lat) * 1e3, 99))
+
+
+def _cv_r2(backend, params, X, ys, splits):
+    from sklearn.metrics import r2_score
+    from sklearn.model_selection import TimeSeriesSplit
+
+    scores = []
+    for y in ys.values():
+        for train, test in TimeSeriesSplit(n_splits=splits).split(X):
+            est = make(backend, params).fit(X[train], y[train])
+            scores.append(r2_score(y[test], np.clip(est.predict(X[test]), 1.0, 10.0)))
+    return float(np.mean(scores))
+
+
+def _candidates(backend):
+    grid = GRIDS[backend]
+    (size_key, sizes), (depth_key, depths) = grid.items()
+    return [{size_key: n, depth_key: d} for d in depths for n in sizes]
+
+
+def tune(X, ys, backend, p99_ms=None, max_kb=None, splits=3):
+    """
+    Choose the size of a backend for rows X and targets ys ({key: y}, in date order) within the budget.
+    Returns (params or None if nothing fits, report).
+    """
+    if backend not in GRIDS:
+        raise ValueError(f"Backend '{backend}' has no tuning grid; expected one of {sorted(GRIDS)}")
+    rows = []
+    too_big = set()   # depths for which a smaller size already broke the budget
+    for params in _candidates(backend):
+        depth = tuple(v for k, v in params.items() if k == 'max_depth')
+        if depth in too_big:
+            rows.append(dict(params=params, skipped="a smaller candidate of this depth was over budget"))
+            continue
+        start = time.perf_counter()
+        models = {key: make(backend, params).fit(X, y) for key, y in ys.items()}
+        fit_s = time.perf_counter() - start
+        row = {'params': params, 'fit_s': round(fit_s, 3), 'p99_ms': round(_latency_p99(models), 4),
+               'size_kb': round(sum(estimator_bytes(m) for m in models.values()) / 1e3, 1)}
+        row['within_budget'] = (p99_ms is None or row['p99_ms'] <= p99_ms) and (max_kb is None or row['size_kb'] <= max_kb)
+        if row['within_budget']:
+            row['cv_r2'] = round(_cv_r2(backend, params, X, ys, splits), 4)
+        else:
+            too_big.add(depth)
+        rows.append(row)
+
+    fitting = [r for r in rows if r.get('within_budget')]
+    chosen = max(fitting, key=lambda r: r['cv_r2']) if fitting else None
+
+    # the default forest, for the accuracy cost of the budget
+    base_models = {key: make('forest').fit(X, y) for key, y in ys.items()}
+    baseline = {'backend': 'forest', 'cv_r2': round(_cv_r2('forest', {}, X, ys, splits), 4),
+                'p99_ms': round(_latency_p99(base_models), 4),
+                'size_kb': round(sum(estimator_bytes(m) for m in base_models.values()) / 1e3, 1)}
+    report = {'backend': backend, 'budget': {'p99_ms': p99_ms, 'max_kb': max_kb}, 'splits': splits,
+              'candidates': rows, 'baseline': baseline, 'chosen': chosen}
+    if chosen is not None:
+        report['accuracy_cost_r2'] = round(baseline['cv_r2'] - chosen['cv_r2'], 4)
+    return (chosen['params'] if chosen else None), report
+
+
+if __name__ == "__main__":
+    import model_families as mf
+    import random_forest_model as rfm
+
+    parser = argparse.ArgumentParser(description="Tune a city's model backend to a latency and size budget")
+    parser.add_argument("city")
+    parser.add_argument("--backend", choices=sorted(GRIDS), default='hist_gb')
+    parser.add_argument("--p99-ms", type=float, default=None, help="p99 latency of one prediction (both targets)")
+    parser.add_argument("--max-kb", type=float, default=None, help="size of both models together")
+    parser.add_argument("--splits", type=int, default=3, help="TimeSeriesSplit folds for the accuracy estimate")
+    parser.add_argument("--apply", action="store_true", help="serve the chosen backend for this city and retrain it")
+    args = parser.parse_args()
+
+    X, ys = mf.city_arrays(args.city)
+    params, report = tune(X, ys, args.backend, args.p99_ms, args.max_kb, args.splits)
+    for row in report['candidates']:
+        if 'skipped' in row:
+            print(f"  {row['params']}  skipped: {row['skipped']}")
+            continue
+        accuracy = f"cv R^2={row['cv_r2']:.3f}" if 'cv_r2' in row else "over budget"
+        print(f"  {row['params']}  p99={row['p99_ms']:.3f} ms  size={row['size_kb']:.0f} kB  fit={row['fit_s']:.2f}s  {accuracy}")
+    base = report['baseline']
+    print(f"default forest: cv R^2={base['cv_r2']:.3f}  p99={base['p99_ms']:.3f} ms  size={base['size_kb']:.0f} kB")
+    if params is None:
+        raise SystemExit(f"no {args.backend} candidate fits p99 <= {args.p99_ms} ms and size <= {args.max_kb} kB")
+    chosen = report['chosen']
+    print(f"chosen {args.backend} {params}: cv R^2={chosen['cv_r2']:.3f} (cost {report['accuracy_cost_r2']:+.3f} vs the "
+          f"default forest), p99={chosen['p99_ms']:.3f} ms, size={chosen['size_kb']:.0f} kB")
+    if args.apply:
+        save_config(args.city, args.backend, params, report)
+        rfm.model(args.city, retrain=True)
+        print(f"{args.city} now serves {args.backend} (saved in {CONFIG_PATH})")
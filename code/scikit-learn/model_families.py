@@ -0,0 +1,198 @@
+# Evaluation of the model families on every city with time-series cross-validation.
+#
+#   python model_families.py                         # every city and family, all cores
+#   python model_families.py Lahore --splits 8       # more folds
+#   python model_families.py --tolerance 0.02        # accept up to 0.02 R^2 less for a faster model
+#
+# The families are the estimators of random_forest_model.model (the served forest), of
+# deprecated/gradient_boosting_model.py and of deprecated/regression_model.py, built here with the same
+# settings (the deprecated modules train at import time from fixed paths and cannot be imported), plus the
+# default hist_gb backend of model_backends.py.
+# Rows are ordered by date and TimeSeriesSplit always validates on the years after the training folds,
+# unlike the in-sample R^2 the training code prints. City x family tasks run in a process pool; latency
+# is then measured one model at a time in this process, so the workers do not disturb it, through the
+# servers' prediction path (the flat engine of forest_engine.py for forests).
+# The pick per city (best cross-validated R^2, or the fastest model within `tolerance` of it) is written
+# with the full report to model_selection.json, next to the same pick among the families the servers can
+# run (BACKENDS); --apply records that one in model_backends.json and retrains the city with it.
+import argparse
+import json
+import pickle
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import numpy as np
+from sklearn.ensemble import GradientBoostingRegressor, RandomForestRegressor
+from sklearn.linear_model import LinearRegression
+from sklearn.metrics import mean_absolute_error, mean_squared_error, r2_score
+from sklearn.model_selection import TimeSeriesSplit
+
+import model_backends as mb
+import model_store as ms
+import random_forest_model as rfm
+
+FAMILIES = {
+    'random_forest': lambda: RandomForestRegressor(**rfm.FOREST_PARAMS),
+    'gradient_boosting': lambda: GradientBoostingRegressor(n_estimators=200, learning_rate=0.05, random_state=42),
+    'hist_gradient_boosting': lambda: mb.make('hist_gb'),
+    'linear': lambda: LinearRegression(),
+}
+# families that have a model_backends.py backend (the others are only evaluated)
+BACKENDS = {'random_forest': 'forest', 'hist_gradient_boosting': 'hist_gb'}
+DEFAULT_SPLITS = 5
+DEFAULT_TOLERANCE = 0.01
+DEFAULT_SELECTION = Path(__file__).resolve().parent / "model_selection.json"
+
+
+def city_arrays(city):
+    """(X, {target key: y}) of a city, rows in date order."""
+    df = rfm.prepare_training_data(city, rfm.source_fingerprint(city)).dropna(subset=list(ms.TARGETS.values()))
+    df = df.sort_values('date', kind='stable')
+    return df[ms.FEATURES].to_numpy(), {key: df[col].to_numpy() for key, col in ms.TARGETS.items()}
+
+
+def evaluate(city, family, splits=DEFAULT_SPLITS):
+    """Worker: cross-validate one family on one city, then fit it on all rows. Returns (city, family, report, models)."""
+    X, ys = city_arrays(city)
+    report = {'rows': len(X), 'targets': {}}
+    models = {}
+    fit_s = 0.0
+    for key, y in ys.items():
+        if len(y) < max(rfm.MIN_ROWS, splits + 1):
+            continue
+        folds = []
+        for train, test in TimeSeriesSplit(n_splits=splits).split(X):
+            est = FAMILIES[family]().fit(X[train], y[train])
+            pred = np.clip(est.predict(X[test]), 1.0, 10.0)
+            folds.append((r2_score(y[test], pred), mean_absolute_error(y[test], pred),
+                          mean_squared_error(y[test], pred) ** 0.5))
+        folds = np.array(folds)
+        start = time.perf_counter()
+        models[key] = FAMILIES[family]().fit(X, y)
+        fit_s += time.perf_counter() - start
+        report['targets'][key] = {
+            'cv_r2': round(float(folds[:, 0].mean()), 4), 'cv_r2_std': round(float(folds[:, 0].std()), 4),
+            'cv_mae': round(float(folds[:, 1].mean()), 4), 'cv_rmse': round(float(folds[:, 2].mean()), 4),
+            'in_sample_r2': round(float(r2_score(y, models[key].predict(X))), 4),
+        }
+    report['fit_s'] = round(fit_s, 3)
+    return city, family, report, models
+
+
+def measure(models, n_single=300, batch=100, seed=0):
+    """
+    Latency of one (temp, aqi) prediction through every target model, batch cost per row, and pickled size.
+    Predictions go through the path the servers use (random_forest_model.predict_raw: the flat engine for forests).
+    """
+    rng = np.random.default_rng(seed)
+    rows = np.column_stack([rng.uniform(-5, 50, n_single), rng.uniform(1, 400, n_single)])
+    served = rfm.model.from_models("measure", models)
+    for key in models:
+        served.predict_raw(key, rows[:1])   # warm-up
+    lat = []
+    for row in rows:
+        inp = row.reshape(1, -1)
+        start = time.perf_counter()
+        for key in models:
+            served.predict_raw(key, inp)
+        lat.append(time.perf_counter() - start)
+    start = time.perf_counter()
+    for key in models:
+        served.predict_raw(key, rows[:batch])
+    per_row = (time.perf_counter() - start) / min(batch, n_single)
+    ms_ = np.array(lat) * 1e3
+    return {'p50_ms': round(float(np.percentile(ms_, 50)), 4), 'p99_ms': round(float(np.percentile(ms_, 99)), 4),
+            'batch_us_per_row': round(per_row * 1e6, 3),
+            'size_kb': round(sum(len(pickle.dumps(est, protocol=pickle.HIGHEST_PROTOCOL)) for est in models.values()) / 1e3, 1)}
+
+
+def _fastest_within(scored, tolerance):
+    best = max(r['cv_r2'] for r in scored.values())
+    ok = [f for f, r in scored.items() if r['cv_r2'] >= best - tolerance]
+    return min(ok, key=lambda f: scored[f]['latency']['p99_ms']), best
+
+
+def pick(results, tolerance=DEFAULT_TOLERANCE):
+    """
+    Per city: the fastest (p99) family whose mean cross-validated R^2 is within tolerance of the best, and
+    the same pick among the servable families ('backend': its model_backends name, or None if none was scored).
+    """
+    picks = {}
+    for city, families in results.items():
+        scored = {f: r for f, r in families.items() if r['targets']}
+        if not scored:
+            continue
+        choice, best = _fastest_within(scored, tolerance)
+        picks[city] = {'family': choice, 'cv_r2': scored[choice]['cv_r2'], 'best_cv_r2': best,
+                       'p99_ms': scored[choice]['latency']['p99_ms'], 'backend': None}
+        servable = {f: r for f, r in scored.items() if f in BACKENDS}
+        if servable:
+            family, _ = _fastest_within(servable, tolerance)
+            picks[city].update(backend=BACKENDS[family], backend_family=family, backend_cv_r2=servable[family]['cv_r2'])
+    return picks
+
+
+def apply(picks):
+    """Serve each city's servable pick: record it in model_backends.json and retrain the city with it."""
+    for city, p in picks.items():
+        if p['backend'] is None:
+            print(f"{city}: none of the evaluated families can be served; model_backends.json unchanged")
+            continue
+        mb.save_config(city, p['backend'], {}, report={'model_families': p})
+        rfm.model(city, retrain=True)
+        print(f"{city} now serves {p['backend']} (saved in {mb.CONFIG_PATH})")
+
+
+def run(cities=None, families=None, splits=DEFAULT_SPLITS, cores=None, tolerance=DEFAULT_TOLERANCE):
+    cities = cities or list(rfm.CITIES_FILES)
+    families = families or list(FAMILIES)
+    for city in cities:
+        rfm.prepare_training_data(city, rfm.source_fingerprint(city))   # fill the prepared-data cache once
+    tasks = [(city, family) for city in cities for family in families]
+
+    results = {city: {} for city in cities}
+    wall = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=max(1, min(cores or len(tasks), len(tasks)))) as pool:
+        futures = [pool.submit(evaluate, city, family, splits) for city, family in tasks]
+        for fut in futures:
+            city, family, report, models = fut.result()
+            results[city][family] = report
+            if report['targets']:
+                report['cv_r2'] = round(float(np.mean([t['cv_r2'] for t in report['targets'].values()])), 4)
+                report['latency'] = measure(models)
+    return {'splits': splits, 'tolerance': tolerance, 'wall_s': round(time.perf_counter() - wall, 2),
+            'results': results, 'picks': pick(results, tolerance)}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Cross-validate every model family per city and pick one for serving")
+    parser.add_argument("cities", nargs="*", help="cities to evaluate (default: all configured cities)")
+    parser.add_argument("--families", nargs="+", choices=list(FAMILIES), default=None)
+    parser.add_argument("--splits", type=int, default=DEFAULT_SPLITS, help="TimeSeriesSplit folds")
+    parser.add_argument("--cores", type=int, default=None, help="worker processes (default: one per task)")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE,
+                        help="R^2 a faster family may lose against the most accurate one")
+    parser.add_argument("--out", default=str(DEFAULT_SELECTION), help="where to write the report and picks")
+    parser.add_argument("--apply", action="store_true", help="serve each city's servable pick (model_backends.json) and retrain")
+    args = parser.parse_args()
+
+    report = run(args.cities or None, args.families, args.splits, args.cores, args.tolerance)
+    for city, families in report['results'].items():
+        for family, r in families.items():
+            if not r['targets']:
+                print(f"{city:<10} {family:<18} skipped (not enough rows)")
+                continue
+            t = r['targets']
+            print(f"{city:<10} {family:<18} cv R^2={r['cv_r2']:.3f} "
+                  f"(weather {t['weather']['cv_r2']:.3f}, air quality {t['air_quality']['cv_r2']:.3f})  "
+                  f"fit={r['fit_s']:.2f}s  p99={r['latency']['p99_ms']:.3f} ms  size={r['latency']['size_kb']:.0f} kB")
+    for city, p in report['picks'].items():
+        print(f"{city}: serve {p['family']} (cv R^2 {p['cv_r2']:.3f}, best {p['best_cv_r2']:.3f}, p99 {p['p99_ms']:.3f} ms)")
+        if p['backend'] is not None and p['backend_family'] != p['family']:
+            print(f"{city}: best servable family {p['backend_family']} (backend {p['backend']}, cv R^2 {p['backend_cv_r2']:.3f})")
+    with open(args.out, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(f"wrote {args.out} ({report['wall_s']}s)")
+    if args.apply:
+        apply(report['picks'])
@@ -0,0 +1,211 @@
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+from pathlib import Path
+
+import joblib
+import sklearn
+
+import forest_engine as fe
+import model_backends as mb
+
+# ---------------------------
+# Model store: versioned, on-disk city model artifacts
+# ---------------------------
+# Layout (<slot> = <fingerprint[:16]>-<backend>-<hash of the feature columns and backend params>):
+#   <store>/<city>/<slot>/current                  name of the version being served
+#   <store>/<city>/<slot>/<version>/meta.json
+#   <store>/<city>/<slot>/<version>/weather.joblib
+#   <store>/<city>/<slot>/<version>/air_quality.joblib
+#   <store>/<city>/<slot>/<version>/{weather,air_quality}.flat/*.npy   (flattened trees for forest_engine)
+# An artifact is only reused when the fingerprint of the source CSVs, the feature
+# schema, the backend, the artifact format and the scikit-learn version all match.
+# Models of other feature sets or backends for the same data live in their own slots, so
+# switching back and forth (MODEL_FEATURES, model_backends.json) does not retrain.
+# The .npy tree arrays are opened with mmap_mode='r', so every process serving the
+# same artifact shares one copy of them through the OS page cache.
+# A save writes a new version directory and then switches `current` with os.replace, so a loader
+# always finds a complete version. Replaced versions stay on disk for RETAIN_SECONDS (processes may
+# still be loading or mapping them) and are removed by a later save.
+
+ARTIFACT_FORMAT = 2
+FEATURES = ['temp', 'aqi']
+DEFAULT_BACKEND = {'name': 'forest', 'params': {}}
+TARGETS = {'weather': 'weather_satisfaction', 'air_quality': 'air_quality_satisfaction'}
+
+DEFAULT_STORE_DIR = Path(os.environ.get("MODEL_STORE_DIR", Path(__file__).resolve().parent / "artifacts"))
+CURRENT = "current"
+RETAIN_SECONDS = 600
+
+
+def fingerprint_files(files, chunk_size=1 << 20):
+    """sha256 over the role, name and contents of every source file (missing files hash as such)."""
+    h = hashlib.sha256()
+    for role in sorted(files):
+        path = Path(files[role])
+        h.update(f"{role}:{path.name}\n".encode("utf-8"))
+        if not path.exists():
+            h.update(b"<missing>\n")
+            continue
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(chunk_size), b""):
+                h.update(chunk)
+    return h.hexdigest()
+
+
+def _slot_dir(city, fingerprint, store_dir=None, features=None, backend=None):
+    backend = backend or DEFAULT_BACKEND
+    variant = json.dumps({'features': features or FEATURES, 'params': backend.get('params', {})}, sort_keys=True)
+    name = f"{fingerprint[:16]}-{backend['name']}-{hashlib.sha256(variant.encode('utf-8')).hexdigest()[:8]}"
+    return Path(store_dir or DEFAULT_STORE_DIR) / city / name
+
+
+def _artifact_dir(city, fingerprint, store_dir=None, features=None, backend=None):
+    """Directory of the version currently published for these source files, features and backend (may not exist)."""
+    slot = _slot_dir(city, fingerprint, store_dir, features, backend)
+    try:
+        with open(slot / CURRENT, encoding="utf-8") as f:
+            return slot / f.read().strip()
+    except OSError:
+        return slot / CURRENT
+
+
+def _remove_old_versions(slot, keep):
+    """Delete versions other than keep that were replaced more than RETAIN_SECONDS ago."""
+    cutoff = time.time() - RETAIN_SECONDS
+    for child in slot.iterdir():
+        if child.is_dir() and child.name != keep:
+            try:
+                replaced = child.stat().st_mtime
+            except OSError:
+                continue
+            if replaced < cutoff:
+                shutil.rmtree(child, ignore_errors=True)   # retried by the next save if still in use
+
+
+def _compatible(meta, fingerprint, features=None, backend=None):
+    return (meta.get('format') == ARTIFACT_FORMAT
+            and meta.get('fingerprint') == fingerprint
+            and meta.get('features') == (features or FEATURES)
+            and meta.get('backend', DEFAULT_BACKEND) == (backend or DEFAULT_BACKEND)
+            and meta.get('sklearn_version') == sklearn.__version__)
+
+
+def save_artifact(city, models, fingerprint, n_rows=None, store_dir=None, watermark=None, backend=None, features=None):
+    """
+    Write the fitted models of one city plus their metadata (watermark: last training date; backend: the
+    model_backends name and params they were fitted with; features: their input columns, default FEATURES)
+    as a new version and publish it; returns the version directory.
+    """
+    slot = _slot_dir(city, fingerprint, store_dir, features, backend)
+    previous = _artifact_dir(city, fingerprint, store_dir, features, backend)
+    now = time.time()
+    # per process and thread: concurrent saves of one slot (e.g. a retrain and an incremental update in one
+    # server) never share a version or temporary name
+    saver = f"{os.getpid()}-{threading.get_native_id()}"
+    version = time.strftime("%Y%m%dT%H%M%S", time.gmtime(now)) + f"{int(now % 1 * 1e6):06d}-{saver}"
+    final_dir = slot / version
+    tmp_dir = slot / f".tmp{saver}"
+    if tmp_dir.exists():
+        shutil.rmtree(tmp_dir)
+    tmp_dir.mkdir(parents=True)
+
+    estimators = {}
+    flat = {}
+    for key in TARGETS:
+        est = models.get(key)
+        if est is None:
+            continue
+        # uncompressed dumps so the numpy buffers can be memory-mapped on load
+        joblib.dump(est, tmp_dir / f"{key}.joblib")
+        estimators[key] = f"{key}.joblib"
+        if mb.is_forest(est):
+            fe.flat_forest.from_sklearn(est).save(tmp_dir / f"{key}.flat")
+            flat[key] = f"{key}.flat"
+
+    meta = {
+        'format': ARTIFACT_FORMAT,
+        'city': city,
+        'fingerprint': fingerprint,
+        'features': features or FEATURES,
+        'targets': {k: v for k, v in TARGETS.items() if k in estimators},
+        'estimators': estimators,
+        'flat': flat,
+        'scores': models.get('scores', {}),
+        'n_rows': n_rows,
+        'watermark': watermark,
+        'backend': backend or DEFAULT_BACKEND,
+        'sklearn_version': sklearn.__version__,
+        'created': time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(now)) + f".{int(now % 1 * 1e6):06d}Z",
+    }
+    with open(tmp_dir / "meta.json", "w", encoding="utf-8") as f:
+        json.dump(meta, f, indent=2)
+
+    # publish atomically: the version directory is complete before `current` names it
+    os.replace(tmp_dir, final_dir)
+    pointer = slot / f"{CURRENT}.tmp{saver}"
+    with open(pointer, "w", encoding="utf-8") as f:
+        f.write(version)
+    os.replace(pointer, slot / CURRENT)
+    if previous.is_dir():
+        os.utime(previous)   # replaced now: kept for RETAIN_SECONDS from here
+    _remove_old_versions(slot, version)
+    return final_dir
+
+
+def artifact_meta(city, fingerprint, store_dir=None, features=None, backend=None):
+    """Metadata of the usable stored artifact for these source files, features and backend, or None."""
+    meta_path = _artifact_dir(city, fingerprint, store_dir, features, backend) / "meta.json"
+    try:
+        with open(meta_path, encoding="utf-8") as f:
+            meta = json.load(f)
+    except (OSError, ValueError):
+        return None
+    return meta if _compatible(meta, fingerprint, features, backend) else None
+
+
+def artifact_version(meta):
+    """Short identifier of a stored artifact: '<fingerprint[:16]>@<created>'."""
+    return f"{meta['fingerprint'][:16]}@{meta['created']}"
+
+
+def load_artifact(city, fingerprint, store_dir=None, mmap_mode='r', estimators=True, features=None, backend=None):
+    """
+    Return the stored models dict for a city (trained on `features` with `backend`, default FEATURES and the
+    forest) or None. It holds the sklearn forests under 'weather' and 'air_quality' (skipped when
+    estimators=False), the memory-mapped flat forests under 'flat', and 'scores'.
+    """
+    art_dir = _artifact_dir(city, fingerprint, store_dir, features, backend)
+    meta_path = art_dir / "meta.json"
+    if not meta_path.exists():
+        return None
+    try:
+        with open(meta_path, encoding="utf-8") as f:
+            meta = json.load(f)
+        if not _compatible(meta, fingerprint, features, backend):
+            return None
+        models = {}
+        if estimators:
+            for key, fname in meta['estimators'].items():
+                models[key] = joblib.load(art_dir / fname, mmap_mode=mmap_mode)
+        models['flat'] = {key: fe.flat_forest.load(art_dir / dname, mmap_mode=mmap_mode)
+                          for key, dname in meta.get('flat', {}).items()}
+        models['scores'] = meta.get('scores', {})
+        models['meta'] = meta
+        return models
+    except Exception as e:
+        print(f"Ignoring unreadable model artifact {art_dir}: {e}")
+        return None
+
+
+def prune(city, keep_fingerprint, store_dir=None):
+    """Delete every stored artifact of a city other than those (of any features and backend) for keep_fingerprint."""
+    city_dir = Path(store_dir or DEFAULT_STORE_DIR) / city
+    if not city_dir.exists():
+        return
+    for child in city_dir.iterdir():
+        if child.is_dir() and not child.name.startswith(keep_fingerprint[:16] + "-"):
+            shutil.rmtree(child, ignore_errors=True)
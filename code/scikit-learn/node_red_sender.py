@@ -0,0 +1,287 @@
+import asyncio
+import atexit
+import http.client
+import json
+import logging
+import os
+import queue
+import random
+import threading
+import time
+from urllib.parse import urlsplit
+
+import service_metrics as sm
+
+# try to import requests; if unavailable, we'll fallback to http.client (stdlib)
+try:
+    import requests
+    from requests.adapters import HTTPAdapter
+except Exception:
+    requests = None
+
+# httpx is only needed by async_node_red_sender (ASGI serving mode)
+try:
+    import httpx
+except Exception:
+    httpx = None
+
+# ---------------------------
+# Background delivery of prediction results to Node-RED
+# ---------------------------
+# submit() only enqueues, so the request thread never waits on Node-RED.
+# A single worker thread drains the bounded queue, groups up to batch_size
+# payloads per POST (a JSON array; a lone payload is sent as a plain object),
+# reuses one keep-alive connection and retries failures with exponential backoff.
+
+
+class node_red_sender():
+    target = "Node-RED"   # used in log messages
+    content_type = "application/json"
+
+    def __init__(self, url, max_queue=1000, batch_size=20, flush_interval=0.2,
+                 max_retries=5, backoff=0.5, max_backoff=10.0, timeout=10):
+        self.url = url
+        self.batch_size = max(1, int(batch_size))
+        self.flush_interval = flush_interval
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.timeout = timeout
+        self.max_queue = max_queue
+        self._start()
+        atexit.register(self.close)
+        if hasattr(os, "register_at_fork"):
+            # threads do not survive fork (e.g. gunicorn --preload): give each worker its own sender
+            os.register_at_fork(after_in_child=self._start)
+
+    def _start(self):
+        self.queue = queue.Queue(maxsize=self.max_queue)
+        self.stats = {'queued': 0, 'dropped': 0, 'sent': 0, 'failed': 0, 'posts': 0, 'retries': 0}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._session = None
+        self._conn = None
+        if requests is not None:
+            self._session = requests.Session()
+            self._session.mount("http://", HTTPAdapter(pool_connections=1, pool_maxsize=2))
+            self._session.mount("https://", HTTPAdapter(pool_connections=1, pool_maxsize=2))
+        self._thread = threading.Thread(target=self._run, name="node-red-sender", daemon=True)
+        self._thread.start()
+
+    def _count(self, key, n=1):
+        with self._lock:
+            self.stats[key] += n
+
+    def submit(self, payload):
+        """Queue one result payload for delivery; returns False if the queue is full and it was dropped."""
+        try:
+            self.queue.put_nowait(payload)
+        except queue.Full:
+            self._count('dropped')
+            return False
+        self._count('queued')
+        return True
+
+    def status(self):
+        with self._lock:
+            out = dict(self.stats)
+        out['pending'] = self.queue.qsize()
+        return out
+
+    def _next_batch(self):
+        try:
+            batch = [self.queue.get(timeout=0.5)]
+        except queue.Empty:
+            return []
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                batch.append(self.queue.get(timeout=remaining) if remaining > 0 else self.queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while not (self._stop.is_set() and self.queue.empty()):
+            batch = self._next_batch()
+            if not batch:
+                continue
+            if self._send_batch(batch):
+                self._count('sent', len(batch))
+            else:
+                self._count('failed', len(batch))
+            for _ in batch:
+                self.queue.task_done()
+
+    def _send_batch(self, batch):
+        body = batch[0] if len(batch) == 1 else batch
+        return self._deliver(json.dumps(body).encode("utf-8"))
+
+    def _headers(self):
+        return {"Content-Type": self.content_type}
+
+    def _deliver(self, data, url=None):
+        url = url or self.url
+        for attempt in range(self.max_retries + 1):
+            if attempt:
+                self._count('retries')
+                delay = min(self.max_backoff, self.backoff * 2 ** (attempt - 1))
+                if self._stop.wait(delay * random.uniform(0.5, 1.0)) and attempt > 1:
+                    break  # shutting down: one retry, then give up
+            start = time.perf_counter()
+            try:
+                status = self._post(data, url)
+                self._count('posts')
+            except Exception as e:
+                sm.outbound(self.target, "error", time.perf_counter() - start)
+                logging.warning(f"POST to {self.target} at {url} failed (attempt {attempt + 1}): {e}")
+                continue
+            sm.outbound(self.target, "ok" if status < 400 else f"status_{status}", time.perf_counter() - start)
+            if status < 400:
+                return True
+            if status != 429 and status < 500:
+                logging.warning(f"{self.target} rejected results with status {status}; dropping")
+                return False
+            logging.warning(f"{self.target} returned status {status} (attempt {attempt + 1})")
+        logging.error(f"Giving up on POST to {self.target} at {url}")
+        return False
+
+    def _post(self, data, url):
+        headers = self._headers()
+        if self._session is not None:
+            r = self._session.post(url, data=data, headers=headers, timeout=self.timeout)
+            r.close()
+            return r.status_code
+
+        # fallback using http.client, keeping one persistent connection
+        parts = urlsplit(url)
+        if self._conn is None:
+            conn_cls = http.client.HTTPSConnection if parts.scheme == "https" else http.client.HTTPConnection
+            self._conn = conn_cls(parts.netloc, timeout=self.timeout)
+        path = parts.path or "/"
+        if parts.query:
+            path += "?" + parts.query
+        try:
+            self._conn.request("POST", path, body=data, headers=headers)
+            resp = self._conn.getresponse()
+            resp.read()
+            if resp.will_close:
+                self._conn.close()
+                self._conn = None
+            return resp.status
+        except Exception:
+            self._conn.close()
+            self._conn = None
+            raise
+
+    def flush(self, timeout=None):
+        """Wait until everything queued so far has been delivered or given up on."""
+        end = None if timeout is None else time.monotonic() + timeout
+        while self.queue.unfinished_tasks:
+            if end is not None and time.monotonic() >= end:
+                return False
+            time.sleep(0.01)
+        return True
+
+    def close(self, timeout=5):
+        self._stop.set()
+        self._thread.join(timeout)
+        if self._session is not None:
+            self._session.close()
+        if self._conn is not None:
+            self._conn.close()
+
+
+class async_node_red_sender():
+    """asyncio counterpart of node_red_sender for asgi_app.py (needs httpx); same queueing, batching and retries."""
+
+    def __init__(self, url, max_queue=1000, batch_size=20, flush_interval=0.2,
+                 max_retries=5, backoff=0.5, max_backoff=10.0, timeout=10):
+        if httpx is None:
+            raise ImportError("async_node_red_sender needs httpx: pip install httpx")
+        self.url = url
+        self.batch_size = max(1, int(batch_size))
+        self.flush_interval = flush_interval
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.timeout = timeout
+        self.stats = {'queued': 0, 'dropped': 0, 'sent': 0, 'failed': 0, 'posts': 0, 'retries': 0}
+        self._max_queue = max_queue
+        self.queue = None
+        self._client = None
+        self._task = None
+
+    async def start(self):
+        self.queue = asyncio.Queue(maxsize=self._max_queue)
+        self._client = httpx.AsyncClient(timeout=self.timeout,
+                                         limits=httpx.Limits(max_connections=2, max_keepalive_connections=2))
+        self._task = asyncio.get_running_loop().create_task(self._run())
+
+    def submit(self, payload):
+        try:
+            self.queue.put_nowait(payload)
+        except Exception:
+            self.stats['dropped'] += 1
+            return False
+        self.stats['queued'] += 1
+        return True
+
+    def status(self):
+        out = dict(self.stats)
+        out['pending'] = self.queue.qsize() if self.queue is not None else 0
+        return out
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self.queue.get()]
+            deadline = loop.time() + self.flush_interval
+            while len(batch) < self.batch_size:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self.queue.get(), remaining))
+                except asyncio.TimeoutError:
+                    break
+            body = batch[0] if len(batch) == 1 else batch
+            ok = await self._deliver(json.dumps(body).encode("utf-8"))
+            self.stats['sent' if ok else 'failed'] += len(batch)
+            for _ in batch:
+                self.queue.task_done()
+
+    async def _deliver(self, data):
+        for attempt in range(self.max_retries + 1):
+            if attempt:
+                self.stats['retries'] += 1
+                delay = min(self.max_backoff, self.backoff * 2 ** (attempt - 1))
+                await asyncio.sleep(delay * random.uniform(0.5, 1.0))
+            start = time.perf_counter()
+            try:
+                r = await self._client.post(self.url, content=data, headers={"Content-Type": "application/json"})
+                self.stats['posts'] += 1
+            except Exception as e:
+                sm.outbound("Node-RED", "error", time.perf_counter() - start)
+                logging.warning(f"POST to Node-RED at {self.url} failed (attempt {attempt + 1}): {e}")
+                continue
+            sm.outbound("Node-RED", "ok" if r.status_code < 400 else f"status_{r.status_code}", time.perf_counter() - start)
+            if r.status_code < 400:
+                return True
+            if r.status_code != 429 and r.status_code < 500:
+                logging.warning(f"Node-RED rejected results with status {r.status_code}; dropping")
+                return False
+            logging.warning(f"Node-RED returned status {r.status_code} (attempt {attempt + 1})")
+        logging.error(f"Giving up on POST to Node-RED at {self.url}")
+        return False
+
+    async def close(self, timeout=5):
+        if self._task is None:
+            return
+        try:
+            await asyncio.wait_for(self.queue.join(), timeout)
+        except asyncio.TimeoutError:
+            logging.warning(f"{self.queue.qsize()} Node-RED results not delivered at shutdown")
+        self._task.cancel()
+        await self._client.aclose()
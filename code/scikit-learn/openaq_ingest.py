@@ -0,0 +1,488 @@
+# Daily PM2.5 from OpenAQ (v3 API) into the AQI files the models train on (replaces deprecated/aqiDataPull.py).
+#
+#   OPENAQ_API_KEY=... python openaq_ingest.py                    # every city, only the days after the last stored one
+#   OPENAQ_API_KEY=... python openaq_ingest.py Lahore --full      # whole history of one city
+#   python openaq_ingest.py --mock                                # run against a local mock of the API and check the result
+#
+# For each city the PM2.5 locations around its center are listed, then their sensors, then the daily averages
+# of every sensor, page by page. Requests run concurrently (at most `concurrency` at a time) behind a rate
+# limiter, and every response is cached on disk with its ETag: the locations and sensors are reused for a
+# day, and later requests are sent with If-None-Match so unchanged pages come back as an empty 304.
+# The daily sensor averages of a city are averaged per day, converted to US AQI and merged into the city's
+# AQI file from cities.json (date, aqi, pm25), from the last stored day on; when any location or sensor of
+# a city cannot be fetched, its file is left as it is for that run. The prepared-data cache and the model
+# store notice the changed file through its fingerprint.
+import argparse
+import asyncio
+import email.utils
+import hashlib
+import http.server
+import json
+import os
+import random
+import threading
+import time
+from pathlib import Path
+from urllib.parse import parse_qs, urlsplit
+
+import pandas as pd
+
+import city_registry as cr
+import us_aqi
+
+# httpx is only needed when actually fetching
+try:
+    import httpx
+except Exception:
+    httpx = None
+
+BASE = "https://api.openaq.org/v3"
+PM25 = 2                 # OpenAQ parameter id of PM2.5 (µg/m³)
+RADIUS_M = 25000         # search radius around the city center (the v3 maximum)
+PAGE_LIMIT = 1000
+META_MAX_AGE = 24 * 3600  # locations and sensors are reused from the cache for a day
+
+# City centers (lat, lon)
+CITY_CENTERS = {
+    "Lahore": (31.5204, 74.3587),
+    "Karachi": (24.8607, 67.0011),
+    "Islamabad": (33.6844, 73.0479),
+}
+
+DEFAULT_CACHE_DIR = Path(os.environ.get("OPENAQ_CACHE_DIR", Path(__file__).resolve().parent / "openaq_cache"))
+
+# ---------------------------
+# Rate limiting and the on-disk response cache
+# ---------------------------
+class rate_limiter():
+    """Token bucket for asyncio: at most `rate` requests per second on average, bursts of up to `burst`."""
+
+    def __init__(self, rate, burst=1):
+        self.rate = rate
+        self.burst = max(1, burst)
+        self._tokens = self.burst
+        self._last = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        if not self.rate:
+            return
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self._tokens = min(self.burst, self._tokens + (now - self._last) * self.rate)
+                self._last = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+    def pause(self, seconds):
+        """Hold every request back for `seconds` (the server said 429)."""
+        self._tokens = min(self._tokens, 0) - seconds * self.rate
+
+
+def retry_after(headers, default):
+    """Seconds to wait after a 429: Retry-After (seconds or an HTTP date), else X-Ratelimit-Reset, else default."""
+    value = headers.get("Retry-After")
+    if value:
+        try:
+            return max(0.0, float(value))
+        except ValueError:
+            pass
+        try:
+            when = email.utils.parsedate_to_datetime(value)
+            return max(0.0, when.timestamp() - time.time())
+        except (TypeError, ValueError):
+            pass
+    try:
+        return max(0.0, float(headers.get("X-Ratelimit-Reset")))
+    except (TypeError, ValueError):
+        return default
+
+
+class response_cache():
+    """One JSON file per request (path + params): ETag, fetch time and body."""
+
+    def __init__(self, directory):
+        self.directory = Path(directory)
+
+    def _path(self, path, params):
+        key = json.dumps([path, sorted((params or {}).items())], default=str)
+        return self.directory / f"{hashlib.sha256(key.encode('utf-8')).hexdigest()[:24]}.json"
+
+    def get(self, path, params):
+        p = self._path(path, params)
+        if not p.exists():
+            return None
+        try:
+            with open(p, encoding="utf-8") as f:
+                return json.load(f)
+        except Exception:
+            return None
+
+    def put(self, path, params, etag, body):
+        p = self._path(path, params)
+        p.parent.mkdir(parents=True, exist_ok=True)
+        tmp = p.with_name(p.name + f".tmp{os.getpid()}")
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({'path': path, 'params': params, 'etag': etag, 'fetched': time.time(), 'body': body}, f)
+        os.replace(tmp, p)
+
+    def touch(self, path, params, entry):
+        self.put(path, params, entry.get('etag'), entry['body'])
+
+
+# ---------------------------
+# OpenAQ client
+# ---------------------------
+class openaq_client():
+    def __init__(self, api_key=None, base=BASE, cache_dir=None, concurrency=4, rate=1.0, burst=1,
+                 max_retries=5, backoff=1.0, max_backoff=60.0, timeout=60):
+        if httpx is None:
+            raise ImportError("openaq_ingest needs httpx: pip install httpx")
+        self.api_key = api_key
+        self.base = base.rstrip("/")
+        self.cache = response_cache(cache_dir or DEFAULT_CACHE_DIR)
+        self.concurrency = concurrency
+        self.rate = rate
+        self.burst = burst
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.timeout = timeout
+        self.stats = {'requests': 0, 'not_modified': 0, 'cached': 0, 'retries': 0, 'rate_limited': 0}
+
+    async def __aenter__(self):
+        headers = {"X-API-Key": self.api_key} if self.api_key else {}
+        self._client = httpx.AsyncClient(base_url=self.base, headers=headers, timeout=self.timeout,
+                                         limits=httpx.Limits(max_connections=self.concurrency,
+                                                             max_keepalive_connections=self.concurrency))
+        self._slots = asyncio.Semaphore(self.concurrency)
+        self._limiter = rate_limiter(self.rate, self.burst)
+        return self
+
+    async def __aexit__(self, *exc):
+        await self._client.aclose()
+
+    async def get(self, path, params=None, max_age=0):
+        """JSON body of GET path, from the cache when younger than max_age or unchanged (304); None on 404."""
+        params = {k: v for k, v in (params or {}).items() if v is not None}
+        entry = self.cache.get(path, params)
+        if entry is not None and time.time() - entry['fetched'] < max_age:
+            self.stats['cached'] += 1
+            return entry['body']
+        headers = {"If-None-Match": entry['etag']} if entry and entry.get('etag') else {}
+
+        for attempt in range(self.max_retries + 1):
+            if attempt:
+                self.stats['retries'] += 1
+                await asyncio.sleep(min(self.max_backoff, self.backoff * 2 ** (attempt - 1)) * random.uniform(0.5, 1.0))
+            await self._limiter.acquire()
+            try:
+                async with self._slots:
+                    r = await self._client.get(path, params=params, headers=headers)
+                self.stats['requests'] += 1
+            except httpx.HTTPError as e:
+                print(f"GET {path} failed (attempt {attempt + 1}): {e}")
+                continue
+            if r.status_code == 304 and entry is not None:
+                self.stats['not_modified'] += 1
+                self.cache.touch(path, params, entry)
+                return entry['body']
+            if r.status_code == 404:
+                return None
+            if r.status_code == 429:
+                self.stats['rate_limited'] += 1
+                self._limiter.pause(retry_after(r.headers, self.backoff))
+                continue
+            if r.status_code >= 500:
+                continue
+            r.raise_for_status()
+            body = r.json()
+            self.cache.put(path, params, r.headers.get("ETag"), body)
+            return body
+        raise RuntimeError(f"Giving up on GET {path} after {self.max_retries + 1} attempts")
+
+    async def locations(self, lat, lon, radius_m=RADIUS_M):
+        body = await self.get("/locations", {"coordinates": f"{lat},{lon}", "radius": radius_m,
+                                             "parameters_id": PM25, "limit": PAGE_LIMIT}, max_age=META_MAX_AGE)
+        return (body or {}).get("results", [])
+
+    async def sensors(self, location_id):
+        body = await self.get(f"/locations/{location_id}/sensors", max_age=META_MAX_AGE)
+        return [s for s in (body or {}).get("results", [])
+                if (s.get("parameter") or {}).get("id", s.get("parameters_id")) == PM25]
+
+    async def sensor_days(self, sensor_id, date_from=None, date_to=None):
+        """[(YYYY-MM-DD, daily mean)] of one sensor, every page."""
+        out = []
+        page = 1
+        while True:
+            body = await self.get(f"/sensors/{sensor_id}/days", {"limit": PAGE_LIMIT, "page": page,
+                                                                 "date_from": date_from, "date_to": date_to})
+            rows = (body or {}).get("results", [])
+            for row in rows:
+                day = row.get("date") or ((row.get("period") or {}).get("datetimeFrom") or {}).get("local")
+                value = row.get("value", row.get("average"))
+                if day and value is not None:
+                    out.append((day[:10], value))
+            if len(rows) < PAGE_LIMIT:
+                return out
+            page += 1
+
+
+# ---------------------------
+# Per-city ingestion
+# ---------------------------
+async def fetch_city(client, city, date_from=None, date_to=None):
+    """
+    Daily PM2.5 of every sensor around a city as a frame (date, sensor, pm25), and the number of locations and
+    sensors that could not be fetched (their days are missing from the frame).
+    """
+    lat, lon = CITY_CENTERS[city]
+    locations = await client.locations(lat, lon)
+    sensor_lists = await asyncio.gather(*[client.sensors(loc["id"]) for loc in locations], return_exceptions=True)
+    failed = 0
+    for loc, sensors in zip(locations, sensor_lists):
+        if isinstance(sensors, Exception):
+            print(f"{city} - sensors of location {loc['id']} skipped: {sensors}")
+            failed += 1
+    sensor_ids = sorted({s["id"] for sensors in sensor_lists if not isinstance(sensors, Exception) for s in sensors})
+    series = await asyncio.gather(*[client.sensor_days(sid, date_from, date_to) for sid in sensor_ids],
+                                  return_exceptions=True)
+    rows = []
+    for sid, days in zip(sensor_ids, series):
+        if isinstance(days, Exception):
+            print(f"{city} - sensor {sid} skipped: {days}")
+            failed += 1
+            continue
+        rows.extend((day, sid, value) for day, value in days)
+    print(f"{city} - {len(locations)} locations, {len(sensor_ids)} PM2.5 sensors, {len(rows)} sensor days")
+    return pd.DataFrame(rows, columns=['date', 'sensor', 'pm25']), failed
+
+
+def daily_aqi(readings):
+    """Per-day mean over the sensors and its US AQI: frame (date, aqi, pm25)."""
+    days, pm25, _ = us_aqi.daily_mean(readings['date'].to_numpy(), readings['pm25'].to_numpy(dtype=float))
+    return pd.DataFrame({'date': days.astype('datetime64[ns]'), 'aqi': us_aqi.us_aqi(pm25, 'pm25'),
+                         'pm25': pm25.round(2)})
+
+
+def last_stored_day(path):
+    """Last date in an AQI file, or None when there is none."""
+    path = Path(path)
+    if not path.exists():
+        return None
+    dates = pd.to_datetime(pd.read_csv(path, usecols=['date'])['date'], errors='coerce').dropna()
+    return dates.max().normalize() if len(dates) else None
+
+
+def store(path, daily, date_from=None):
+    """Merge new days into an AQI file: rows from date_from on are replaced, older ones kept. Returns the row count."""
+    path = Path(path)
+    if path.exists():
+        old = pd.read_csv(path)
+        old['date'] = pd.to_datetime(old['date'], errors='coerce')
+        if date_from is not None:
+            old = old[old['date'] < pd.Timestamp(date_from)]
+        old = old[~old['date'].isin(daily['date'])]
+        merged = pd.concat([old, daily], ignore_index=True)
+    else:
+        merged = daily
+    merged = merged.sort_values('date', ignore_index=True)
+    merged['date'] = merged['date'].dt.strftime("%Y-%m-%d")
+    if 'aqi' in merged.columns:
+        merged['aqi'] = merged['aqi'].astype('Int64')
+    tmp = path.with_name(path.name + f".tmp{os.getpid()}")
+    merged.to_csv(tmp, index=False)
+    os.replace(tmp, path)
+    return len(merged)
+
+
+async def ingest(cities, client, targets, full=False, date_to=None):
+    """Fetch every city concurrently and merge the new days into its target file; returns {city: new days}."""
+    async def one(city):
+        date_from = None if full else last_stored_day(targets[city])
+        readings, failed = await fetch_city(client, city, None if date_from is None else date_from.strftime("%Y-%m-%d"),
+                                            date_to)
+        if failed:
+            # the stored days average every sensor: averages of the rest would replace them, so keep them
+            print(f"{city} - {failed} locations or sensors could not be fetched; {targets[city]} left unchanged")
+            return city, 0
+        daily = daily_aqi(readings)
+        if daily.empty:
+            print(f"{city} - no daily data found")
+            return city, 0
+        n = store(targets[city], daily, date_from)
+        print(f"{city} - {len(daily)} days from {daily['date'].min().date()} written to {targets[city]} ({n} rows)")
+        return city, len(daily)
+
+    return dict(await asyncio.gather(*[one(city) for city in cities]))
+
+
+def run(cities=None, targets=None, full=False, date_to=None, **client_kw):
+    """Synchronous entry point: ingest cities (default: every registry city with a known center)."""
+    registry = cr.load_registry()
+    cities = cities or [c for c in registry if c in CITY_CENTERS]
+    targets = targets or {city: registry[city]['aqi'] for city in cities}
+    client_kw.setdefault('api_key', os.environ.get("OPENAQ_API_KEY"))
+    client_kw.setdefault('base', os.environ.get("OPENAQ_URL", BASE))
+
+    async def main():
+        async with openaq_client(**client_kw) as client:
+            result = await ingest(cities, client, targets, full=full, date_to=date_to)
+        print(f"requests={client.stats['requests']} not_modified={client.stats['not_modified']} "
+              f"cached={client.stats['cached']} retries={client.stats['retries']} rate_limited={client.stats['rate_limited']}")
+        return result, dict(client.stats)
+
+    return asyncio.run(main())
+
+
+# ---------------------------
+# Local mock of the OpenAQ v3 endpoints used above
+# ---------------------------
+class http_handler(http.server.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def reply(self, status, data, headers=None):
+        self.send_response(status)
+        for k, v in (headers or {}).items():
+            self.send_header(k, v)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):
+        pass
+
+
+class mock_openaq():
+    """
+    HTTP server on 127.0.0.1 with /v3/locations, /v3/locations/{id}/sensors and /v3/sensors/{id}/days.
+    Every city gets `locations` locations with two PM2.5 sensors each and deterministic daily values from
+    `start` to `stop`; responses carry ETags and honour If-None-Match, and every `rate_limit_every`-th
+    request is answered with 429. The days of the sensors in `failing` are answered with 500.
+    """
+
+    def __init__(self, start="2024-01-01", stop="2024-12-31", locations=3, rate_limit_every=0, failing=()):
+        self.days = pd.date_range(start, stop, freq='D').strftime("%Y-%m-%d").tolist()
+        self.requests = 0
+        self.rate_limit_every = rate_limit_every
+        self.failing = set(failing)
+        self.locations = {}     # id -> (lat, lon)
+        self.sensors = {}       # location id -> [sensor ids]
+        for n, (lat, lon) in enumerate(CITY_CENTERS.values()):
+            for k in range(locations):
+                loc_id = 100 * (n + 1) + k
+                self.locations[loc_id] = (lat + 0.01 * k, lon)
+                self.sensors[loc_id] = [10 * loc_id, 10 * loc_id + 1]
+        self._lock = threading.Lock()
+        owner = self
+
+        class handler(http_handler):
+            def do_GET(self):
+                owner._handle(self)
+
+        self.server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), handler)
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}/v3"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def value(self, sensor_id, day):
+        """Daily PM2.5 of a sensor, the same on every call."""
+        h = int(hashlib.sha256(f"{sensor_id}{day}".encode()).hexdigest()[:8], 16)
+        return round(5 + (h % 3000) / 10, 2)
+
+    def _body(self, path, query):
+        parts = path.strip("/").split("/")[1:]   # drop "v3"
+        limit = int(query.get("limit", [100])[0])
+        page = int(query.get("page", [1])[0])
+        if parts == ["locations"]:
+            lat, lon = (float(x) for x in query["coordinates"][0].split(","))
+            results = [{"id": i, "coordinates": {"latitude": la, "longitude": lo}}
+                       for i, (la, lo) in self.locations.items() if abs(la - lat) < 0.25 and abs(lo - lon) < 0.25]
+        elif len(parts) == 3 and parts[0] == "locations" and parts[2] == "sensors" and int(parts[1]) in self.sensors:
+            results = [{"id": sid, "parameter": {"id": PM25, "name": "pm25", "units": "µg/m³"}}
+                       for sid in self.sensors[int(parts[1])]]
+            results.append({"id": int(parts[1]) * 10 + 9, "parameter": {"id": 1, "name": "pm10", "units": "µg/m³"}})
+        elif len(parts) == 3 and parts[0] == "sensors" and parts[2] == "days":
+            lo = query.get("date_from", [self.days[0]])[0][:10]
+            hi = query.get("date_to", [self.days[-1]])[0][:10]
+            days = [d for d in self.days if lo <= d <= hi]
+            results = [{"value": self.value(int(parts[1]), d),
+                        "period": {"datetimeFrom": {"utc": f"{d}T00:00:00Z", "local": f"{d}T00:00:00+05:00"}}}
+                       for d in days[(page - 1) * limit:page * limit]]
+        else:
+            return None
+        return {"meta": {"page": page, "limit": limit, "found": len(results)}, "results": results}
+
+    def _handle(self, h):
+        with self._lock:
+            self.requests += 1
+            limited = self.rate_limit_every and self.requests % self.rate_limit_every == 0
+        if limited:
+            return h.reply(429, b"", {"Retry-After": "0.05"})
+        parts = urlsplit(h.path)
+        body = self._body(parts.path, parse_qs(parts.query))
+        if self.failing and any(parts.path.endswith(f"/sensors/{sid}/days") for sid in self.failing):
+            return h.reply(500, b'{"detail": "internal error"}')
+        if body is None:
+            return h.reply(404, b'{"detail": "not found"}')
+        data = json.dumps(body).encode("utf-8")
+        etag = '"' + hashlib.sha256(data).hexdigest()[:16] + '"'
+        if h.headers.get("If-None-Match") == etag:
+            return h.reply(304, b"", {"ETag": etag})
+        h.reply(200, data, {"ETag": etag, "Content-Type": "application/json"})
+
+    def close(self):
+        self.server.shutdown()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Pull daily PM2.5 from OpenAQ into the cities' AQI files")
+    parser.add_argument("cities", nargs="*", help="cities to update (default: every city with a known center)")
+    parser.add_argument("--full", action="store_true", help="fetch the whole history instead of resuming")
+    parser.add_argument("--to", default=None, help="last day to fetch (YYYY-MM-DD)")
+    parser.add_argument("--concurrency", type=int, default=4, help="requests in flight at once")
+    parser.add_argument("--rate", type=float, default=1.0, help="requests per second (OpenAQ allows 60 per minute)")
+    parser.add_argument("--mock", action="store_true", help="run against a local mock of the API, into a temporary folder")
+    args = parser.parse_args()
+
+    if not args.mock:
+        run(args.cities or None, full=args.full, date_to=args.to, concurrency=args.concurrency, rate=args.rate)
+    else:
+        import tempfile
+
+        cities = args.cities or list(CITY_CENTERS)
+        with tempfile.TemporaryDirectory() as tmp:
+            targets = {city: Path(tmp) / f"{city.lower()}_openaq_AQI.csv" for city in cities}
+            kw = dict(targets=targets, concurrency=args.concurrency, rate=0, cache_dir=Path(tmp) / "cache", backoff=0.01)
+
+            api = mock_openaq(stop="2024-06-30", rate_limit_every=25)
+            start = time.perf_counter()
+            run(cities, base=api.url, **kw)
+            print(f"first pull: {time.perf_counter() - start:.2f}s, {api.requests} requests")
+            api.close()
+
+            # a month later: only the new days are fetched, the rest comes from the file and the cache
+            api = mock_openaq(stop="2024-07-31")
+            requests_before = api.requests
+            _, stats = run(cities, base=api.url, **kw)
+            for city in cities:
+                got = pd.read_csv(targets[city])
+                sensors = [sid for loc, (lat, _) in api.locations.items() if abs(lat - CITY_CENTERS[city][0]) < 0.25
+                           for sid in api.sensors[loc]]
+                expected = daily_aqi(pd.DataFrame([(d, s, api.value(s, d)) for s in sensors for d in api.days],
+                                                  columns=['date', 'sensor', 'pm25']))
+                if got['date'].tolist() != api.days or got['aqi'].tolist() != expected['aqi'].tolist():
+                    raise AssertionError(f"{city}: stored AQI differs from the mock's")
+            print(f"second pull: {api.requests - requests_before} requests, {stats['cached']} answered from the cache; "
+                  f"stored days match the mock")
+
+            # rerunning the same day: unchanged pages come back as 304 Not Modified
+            run(cities, base=api.url, **kw)
+            _, stats = run(cities, base=api.url, **kw)
+            if stats['not_modified'] != stats['requests']:
+                raise AssertionError(f"expected every request of the rerun to be answered with 304: {stats}")
+            print(f"rerun: {stats['not_modified']} of {stats['requests']} requests answered with 304 Not Modified")
+            api.close()
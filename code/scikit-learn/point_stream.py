@@ -0,0 +1,438 @@
+import json
+import math
+import re
+import time
+import tracemalloc
+from array import array
+
+import numpy as np
+
+# ---------------------------
+# Streaming extraction and aggregation of /postData points
+# ---------------------------
+# A /postData body from Node-RED is {"city": ..., "temperature": [{"_time": ..., "_value": x}, ...], "aqi": [...]}.
+# Instead of building a dict per point with json.loads and walking them in Python, point_scanner is fed
+# the raw body chunk by chunk. It follows the top-level object key by key (string-aware, so brackets and
+# quotes inside strings do not confuse it) and reads the field arrays in runs: one possessive regex pass
+# accepts a run of flat points whose strings hold no escapes or brackets, a second pulls their "value" /
+# "_value" tokens, and the numbers go straight into a compact float array. Any other element (nested
+# objects, escaped strings) is cut out string-aware and decoded with json.loads on its own. Each point
+# gives the number safe_mean would take from it (point_value). Only the numbers are kept, never the document.
+# aggregate() then reduces them with NumPy (mean, median or trimmed mean, optionally over the last points).
+
+AGGREGATES = ('mean', 'median', 'trimmed')
+CHUNK_SIZE = 1 << 16
+SMALL = 64   # below this many points a plain Python mean beats the NumPy call overhead
+
+_STRING = re.compile(rb'"(?:[^"\\]++|\\.)*+"')      # a whole string literal (no match if it is cut off)
+_IN_STRING = re.compile(rb'(?:[^"\\]++|\\.)*+')     # the rest of a string, up to its closing quote
+_PLAIN = re.compile(rb'[^"\[\]{}]*+')               # outside strings: anything but quotes and brackets
+_WS = re.compile(rb'\s*+')
+_ATOM = re.compile(rb'[^\s,}\]]*+')                 # a number or literal, up to its delimiter
+# "simple" values: strings without escapes or brackets, numbers (and the NaN / Infinity literals json.loads
+# takes), true / false / null
+_SCALAR = rb'(?:"[^"\\\[\]{}]*+"|-?\d++(?:\.\d++)?+(?:[eE][-+]?\d++)?+|-?Infinity|NaN|true|false|null)'
+_MEMBER = rb'"[^"\\\[\]{}]*+"\s*+:\s*+' + _SCALAR
+# a flat point: an object of simple members
+_ITEM = rb'(?:\{\s*+(?:' + _MEMBER + rb'(?:\s*+,\s*+' + _MEMBER + rb')*+)?+\s*+\}|' + _SCALAR + rb'(?=[\s,\]]))'
+# a run of simple elements: the first of an array, then each after its comma
+_RUN = {False: re.compile(rb'(?:\s*+' + _ITEM + rb'(?:\s*+,\s*+' + _ITEM + rb')*+)?+'),
+        True: re.compile(rb'(?:\s*+,\s*+' + _ITEM + rb')*+')}
+# value tokens of the flat points of a run: (value, _value) per point; each member is followed by a comma and
+# the next key or by the closing brace, so each key has one group (a repeated key keeps its last value)
+_BOTH = re.compile(rb'\{\s*+(?:(?:"value"\s*+:\s*+(' + _SCALAR + rb')|"_value"\s*+:\s*+(' + _SCALAR + rb')|' + _MEMBER
+                   + rb')\s*+(?:,\s*+(?=")|(?=\})))*+\}')
+# or of the one key when the run only has that one
+_KEYS = {b'"value"': re.compile(rb'"value"\s*+:\s*+(' + _SCALAR + rb')'),
+         b'"_value"': re.compile(rb'"_value"\s*+:\s*+(' + _SCALAR + rb')')}
+_QUOTE, _BACKSLASH = ord('"'), ord('\\')
+_OPEN = (ord('['), ord('{'))
+
+
+def point_value(item, key_candidates=("value", "_value")):
+    """The number a point contributes: its first non-null value key as a float, None if there is none or it is not numeric."""
+    if not isinstance(item, dict):
+        return None
+    for k in key_candidates:
+        if k in item and item[k] is not None:
+            try:
+                return float(item[k])
+            except Exception:
+                return None
+    return None
+
+
+def _number(raw):
+    # point_value of a raw JSON token from a simple point (b'' when the point has no value key)
+    if raw[:1] == b'"':
+        try:
+            return float(raw[1:-1].decode("utf-8"))
+        except ValueError:
+            return None
+    if raw in (b'true', b'false'):
+        return float(raw == b'true')
+    try:
+        return float(raw)
+    except ValueError:
+        return None   # null or absent
+
+
+def _string(token):
+    # a whole string literal; only one with escapes needs the JSON decoder
+    return json.loads(token) if b'\\' in token else token[1:-1].decode("utf-8")
+
+
+def _to_floats(raws):
+    try:
+        return list(map(float, raws))
+    except ValueError:
+        return [v for v in map(_number, raws) if v is not None]
+
+
+def _container_end(buf, pos):
+    """End of the array or object starting at pos (strings skipped whole), or None if it is not complete in buf."""
+    depth = 0
+    n = len(buf)
+    while True:
+        pos = _PLAIN.match(buf, pos).end()
+        if pos >= n:
+            return None
+        if buf[pos] == _QUOTE:
+            m = _STRING.match(buf, pos)
+            if m is None:
+                return None
+            pos = m.end()
+            continue
+        depth += 1 if buf[pos] in _OPEN else -1
+        pos += 1
+        if depth == 0:
+            return pos
+
+
+class point_scanner():
+    """
+    Incremental parser for a /postData body: feed() raw chunks, then close(); values are array('d') per field.
+    city is the top-level "city" value; error is set (and parsing stops) when the body is not valid JSON or
+    not an object, as json.loads would reject it.
+    """
+
+    def __init__(self, fields=('temperature', 'aqi')):
+        self.values = {field: array('d') for field in fields}
+        self.city = None
+        self.error = None
+        self.bytes = 0
+        self._state = 'start'   # start, key, colon, value, field, skip, end
+        self._key = None
+        self._after = None       # what the last top-level token was: '{', ',' or a value
+        self._seen = False       # the field array being read has an element already
+        self._depth = 0          # containers open in the value being skipped
+        self._in_string = False  # inside a string of the value being skipped
+        self._carry = b''
+        self._base = 0
+
+    def feed(self, chunk):
+        self.bytes += len(chunk)
+        if self.error is not None:
+            return   # the rest of a rejected body is only counted
+        buf = self._carry + chunk if self._carry else chunk
+        self._carry = buf[self._parse(buf, False):]
+
+    def close(self):
+        self._parse(self._carry, True)
+        if self.error is None and self._state != 'end':
+            self.error = "invalid json body: truncated"
+        self._carry = b''
+        return self
+
+    def _fail(self, message, pos):
+        self.error = f"invalid json body: {message} at byte {self._base + pos}"
+        return pos
+
+    def _parse(self, buf, final):
+        """Parse as far as buf allows; returns the position where the next chunk continues."""
+        pos, n = 0, len(buf)
+        self._base = self.bytes - n   # offset of buf in the body
+        while self.error is None:
+            if self._state == 'field':
+                pos, done = self._items(buf, pos, final)
+                if not done:
+                    return pos
+                self._state, self._after = 'key', 'value'
+                continue
+            if self._state == 'skip':
+                pos, done = self._skip(buf, pos, final)
+                if not done:
+                    return pos
+                self._state, self._after = 'key', 'value'
+                continue
+            pos = _WS.match(buf, pos).end()
+            if pos >= n:
+                return pos
+            c = buf[pos:pos + 1]
+            if self._state == 'start':
+                if c != b'{':
+                    self.error = "json body must be an object"
+                    return pos
+                self._state, self._after = 'key', '{'
+                pos += 1
+            elif self._state == 'key':
+                if c == b',' and self._after == 'value':
+                    self._after = ','
+                    pos += 1
+                elif c == b'}' and self._after != ',':
+                    self._state = 'end'
+                    pos += 1
+                elif c == b'"' and self._after != 'value':
+                    m = _STRING.match(buf, pos)
+                    if m is None:
+                        return pos
+                    try:
+                        self._key = _string(m.group())
+                    except ValueError:
+                        return self._fail("bad key", pos)
+                    self._state = 'colon'
+                    pos = m.end()
+                else:
+                    return self._fail("expected a key" if self._after != 'value' else "expected ',' or '}'", pos)
+            elif self._state == 'colon':
+                if c != b':':
+                    return self._fail("expected ':'", pos)
+                self._state = 'value'
+                pos += 1
+            elif self._state == 'value':
+                if self._key in self.values:
+                    if c != b'[':
+                        self.error = "temperature and aqi must be arrays"
+                        return pos
+                    del self.values[self._key][:]   # a repeated key replaces the earlier one, as in json.loads
+                    self._state, self._seen = 'field', False
+                    pos += 1
+                elif self._key == 'city' and c not in (b'[', b'{'):
+                    m = _STRING.match(buf, pos) if c == b'"' else _ATOM.match(buf, pos)
+                    if m is None or (m.end() >= n and not final):
+                        return pos
+                    try:
+                        self.city = _string(m.group()) if c == b'"' else json.loads(m.group())
+                    except ValueError:
+                        return self._fail("bad city value", pos)
+                    self._state, self._after = 'key', 'value'
+                    pos = m.end()
+                elif self._key == 'city':
+                    close = _container_end(buf, pos)   # not a name; kept so it is rejected like any non-string city
+                    if close is None:
+                        return pos
+                    try:
+                        self.city = json.loads(buf[pos:close])
+                    except ValueError:
+                        return self._fail("bad city value", pos)
+                    self._state, self._after = 'key', 'value'
+                    pos = close
+                else:
+                    self._depth, self._in_string = 0, False
+                    self._state = 'skip'
+            else:   # 'end'
+                return self._fail("extra data", pos)
+        return pos
+
+    def _items(self, buf, pos, final):
+        """Read elements of the field array; (position, True once its closing bracket is passed)."""
+        n = len(buf)
+        values = self.values[self._key]
+        while True:
+            end = _RUN[self._seen].match(buf, pos).end()
+            if end > pos:
+                values.extend(self._take(buf, pos, end))
+                self._seen = True
+            pos = _WS.match(buf, end).end()
+            if pos >= n:
+                return pos, False
+            if buf[pos] == ord(']'):
+                return pos + 1, True
+            start = pos
+            if self._seen:
+                if buf[pos] != ord(','):
+                    self._fail("expected ',' or ']'", pos)
+                    return pos, False
+                pos = _WS.match(buf, pos + 1).end()
+                if pos >= n:
+                    return start, False
+            c = buf[pos]
+            if c in _OPEN:
+                close = _container_end(buf, pos)
+                if close is None:
+                    return start, False
+                try:
+                    item = json.loads(buf[pos:close])
+                except ValueError:
+                    self._fail("bad point", pos)
+                    return pos, False
+                v = point_value(item)
+                if v is not None:
+                    values.append(v)
+                pos = close
+                self._seen = True
+            elif c == _QUOTE:
+                m = _STRING.match(buf, pos)   # a bare string is no point
+                if m is None:
+                    return start, False
+                pos = m.end()
+                self._seen = True
+            else:
+                # simple values are taken by the run unless the chunk cuts them off; anything else is not JSON
+                if _ATOM.match(buf, pos).end() >= n and not final:
+                    return start, False
+                self._fail("unexpected value", pos)
+                return pos, False
+
+    def _take(self, buf, start, end):
+        # numbers of the simple points in buf[start:end]: "value" if a point has it (and it is not null), else "_value"
+        has_value = buf.find(b'"value"', start, end) >= 0
+        has_underscore = buf.find(b'"_value"', start, end) >= 0
+        if has_value and has_underscore:
+            raws = [a if a and a != b'null' else b for a, b in _BOTH.findall(buf, start, end)]
+        elif has_value or has_underscore:
+            raws = _KEYS[b'"value"' if has_value else b'"_value"'].findall(buf, start, end)
+            if len(raws) != buf.count(b'{', start, end):
+                # some point lacks the key or repeats it: one (value, _value) pair per point instead
+                raws = [a if a and a != b'null' else b for a, b in _BOTH.findall(buf, start, end)]
+        else:
+            return []
+        return _to_floats(raws)
+
+    def _skip(self, buf, pos, final):
+        """Pass over the value of a key that is not read; (position, True once it ends). Resumes across chunks."""
+        n = len(buf)
+        while pos < n:
+            if self._in_string:
+                pos = _IN_STRING.match(buf, pos).end()
+                if pos >= n or buf[pos] == _BACKSLASH:
+                    return pos, False
+                self._in_string = False
+                pos += 1
+                if self._depth == 0:
+                    return pos, True
+            elif self._depth == 0:
+                pos = _WS.match(buf, pos).end()
+                if pos >= n:
+                    break
+                if buf[pos] == _QUOTE:
+                    self._in_string = True
+                    pos += 1
+                elif buf[pos] in _OPEN:
+                    self._depth = 1
+                    pos += 1
+                else:
+                    end = _ATOM.match(buf, pos).end()
+                    if end >= n and not final:
+                        return pos, False
+                    try:
+                        json.loads(buf[pos:end])
+                    except ValueError:
+                        self._fail("expected a value", pos)
+                        return pos, False
+                    return end, True
+            else:
+                pos = _PLAIN.match(buf, pos).end()
+                if pos >= n:
+                    break
+                c = buf[pos]
+                pos += 1
+                if c == _QUOTE:
+                    self._in_string = True
+                else:
+                    self._depth += 1 if c in _OPEN else -1
+                    if self._depth == 0:
+                        return pos, True
+        return pos, False
+
+
+def scan(body, chunk_size=CHUNK_SIZE, fields=('temperature', 'aqi')):
+    """Run a point_scanner over a bytes body or a file-like object with read()."""
+    scanner = point_scanner(fields)
+    if isinstance(body, (bytes, bytearray)):
+        for i in range(0, len(body), chunk_size):
+            scanner.feed(bytes(body[i:i + chunk_size]))
+    else:
+        for chunk in iter(lambda: body.read(chunk_size), b""):
+            scanner.feed(chunk)
+    return scanner.close()
+
+
+def all_finite(values):
+    """True when no point value is NaN or infinite (e.g. a 1e999 literal)."""
+    if isinstance(values, array):
+        return bool(np.isfinite(np.frombuffer(values, dtype=np.float64)).all())
+    return all(math.isfinite(x) for x in values)
+
+
+def aggregate(values, how='mean', window=None, trim=0.1):
+    """
+    Reduce point values to one model input: 'mean', 'median' or 'trimmed' (mean without the lowest and
+    highest trim fraction), over the last `window` points if given. Returns None when there are no values.
+    """
+    if how not in AGGREGATES:
+        raise ValueError(f"Unknown aggregate '{how}', expected one of {AGGREGATES}")
+    if how == 'mean' and len(values) < SMALL:
+        vals = [x for x in (values[-int(window):] if window else values) if math.isfinite(x)]
+        return sum(vals) / len(vals) if vals else None
+    v = np.frombuffer(values, dtype=np.float64) if isinstance(values, array) else np.asarray(values, dtype=float)
+    if window:
+        v = v[-int(window):]
+    v = v[np.isfinite(v)]
+    if len(v) == 0:
+        return None
+    if how == 'mean':
+        return float(v.mean())
+    if how == 'median':
+        return float(np.median(v))
+    k = int(len(v) * trim)
+    if 2 * k >= len(v):
+        return float(np.median(v))
+    return float(np.partition(v, (k, len(v) - k - 1))[k:len(v) - k].mean())
+
+
+def benchmark(sizes=(10, 10_000, 1_000_000), repeat=3):
+    """Points per second of json.loads + safe_mean against point_scanner + aggregate for several payload sizes."""
+    import random
+    import prediction_service as svc
+
+    results = []
+    for n in sizes:
+        def points(lo, hi):
+            return [{"_time": "2025-09-01T10:00:00Z", "_value": round(random.uniform(lo, hi), 2)} for _ in range(n)]
+        body = json.dumps({"city": "Lahore", "temperature": points(5, 45), "aqi": points(20, 300)}).encode("utf-8")
+        reps = max(1, repeat * (100_000 // n if n < 100_000 else 1))
+
+        start = time.perf_counter()
+        for _ in range(reps):
+            data = json.loads(body)
+            expected = (svc.safe_mean(data["temperature"]), svc.safe_mean(data["aqi"]))
+        t_json = (time.perf_counter() - start) / reps
+
+        start = time.perf_counter()
+        for _ in range(reps):
+            s = scan(body)
+            got = (aggregate(s.values["temperature"]), aggregate(s.values["aqi"]))
+        t_stream = (time.perf_counter() - start) / reps
+
+        if not np.allclose(expected, got):
+            raise AssertionError(f"streamed means {got} differ from safe_mean {expected}")
+
+        # peak Python heap while parsing (the body itself excluded)
+        peaks = []
+        for parse in (lambda: json.loads(body), lambda: scan(body)):
+            tracemalloc.start()
+            parse()
+            peaks.append(tracemalloc.get_traced_memory()[1] / 1e6)
+            tracemalloc.stop()
+        results.append({'points': n, 'mb': len(body) / 1e6,
+                        'json_points_per_s': 2 * n / t_json, 'stream_points_per_s': 2 * n / t_stream,
+                        'speedup': t_json / t_stream, 'json_peak_mb': peaks[0], 'stream_peak_mb': peaks[1]})
+    return results
+
+
+if __name__ == "__main__":
+    for row in benchmark():
+        print(f"points={row['points']:>8}  body={row['mb']:>7.2f} MB  json+safe_mean={row['json_points_per_s']:>12,.0f} pts/s  "
+              f"stream={row['stream_points_per_s']:>12,.0f} pts/s  speedup={row['speedup']:.1f}x  "
+              f"peak heap json={row['json_peak_mb']:.1f} MB stream={row['stream_peak_mb']:.1f} MB")
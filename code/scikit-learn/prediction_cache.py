@@ -0,0 +1,89 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+
+# ---------------------------
+# Cache of /postData predictions keyed by (city, quantized temp, quantized aqi)
+# ---------------------------
+# Node-RED posts the same or nearly the same averages many times a minute. Readings are
+# snapped to a grid of temp_step x aqi_step, the model is run on the snapped values, and
+# the answer is reused for every reading in that cell until it expires (ttl), is pushed
+# out by newer entries (LRU beyond max_entries) or the city's model object changes
+# (each model carries a serial that changes whenever its serving state is rebuilt).
+# Snapping changes the answers slightly, so the cache is off unless PREDICTION_CACHE=1; when it
+# is on, /postData reports the snapped inputs it answered for (prediction_service.predict_averages).
+
+
+class prediction_cache():
+    def __init__(self, max_entries=10000, ttl=300.0, temp_step=0.1, aqi_step=1.0, enabled=True):
+        self.enabled = enabled and max_entries > 0
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.temp_step = temp_step
+        self.aqi_step = aqi_step
+        self.stats = {'hits': 0, 'misses': 0, 'expired': 0, 'invalidated': 0, 'evictions': 0}
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls):
+        """
+        PREDICTION_CACHE=1 turns the cache on (off by default); PREDICTION_CACHE_SIZE (0 disables), PREDICTION_CACHE_TTL,
+        PREDICTION_CACHE_TEMP_STEP, PREDICTION_CACHE_AQI_STEP.
+        """
+        return cls(max_entries=int(os.environ.get("PREDICTION_CACHE_SIZE", "10000")),
+                   ttl=float(os.environ.get("PREDICTION_CACHE_TTL", "300")),
+                   temp_step=float(os.environ.get("PREDICTION_CACHE_TEMP_STEP", "0.1")),
+                   aqi_step=float(os.environ.get("PREDICTION_CACHE_AQI_STEP", "1")),
+                   enabled=os.environ.get("PREDICTION_CACHE", "0") == "1")
+
+    def quantize(self, temp, aqi):
+        """Grid cell of a reading and the snapped (temp, aqi) the model is run on."""
+        i = round(float(temp) / self.temp_step)
+        j = round(float(aqi) / self.aqi_step)
+        return (i, j), (round(i * self.temp_step, 10), round(j * self.aqi_step, 10))
+
+    def run(self, model, temp, aqi, runner=None):
+        """model.run(temp, aqi) through the cache; runner(model, temp, aqi) replaces model.run on a miss."""
+        if not self.enabled:
+            return model.run(temp, aqi) if runner is None else runner(model, temp, aqi)
+        cell, (q_temp, q_aqi) = self.quantize(temp, aqi)
+        key = (model.city,) + cell
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                serial, expires, result = entry
+                if serial == model.serial and now < expires:
+                    self._entries.move_to_end(key)
+                    self.stats['hits'] += 1
+                    return result
+                del self._entries[key]
+                self.stats['invalidated' if serial != model.serial else 'expired'] += 1
+            self.stats['misses'] += 1
+
+        result = model.run(q_temp, q_aqi) if runner is None else runner(model, q_temp, q_aqi)
+        if result is not None:
+            with self._lock:
+                self._entries[key] = (model.serial, now + self.ttl, result)
+                self._entries.move_to_end(key)
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+                    self.stats['evictions'] += 1
+        return result
+
+    def invalidate(self, city=None):
+        """Drop the cached predictions of one city (or all)."""
+        with self._lock:
+            keys = [k for k in self._entries if city is None or k[0] == city]
+            for k in keys:
+                del self._entries[k]
+            self.stats['invalidated'] += len(keys)
+
+    def status(self):
+        with self._lock:
+            out = dict(self.stats, entries=len(self._entries), enabled=self.enabled)
+        lookups = out['hits'] + out['misses']
+        out['hit_rate'] = round(out['hits'] / lookups, 4) if lookups else None
+        return out
@@ -0,0 +1,142 @@
+import math
+import sys
+
+import numpy as np
+
+# ---------------------------
+# Precomputed (temp, aqi) -> satisfaction lookup tables
+# ---------------------------
+# The model only has two bounded inputs, so each city's forests can be evaluated
+# once over a dense grid; predictions inside the grid then become a table lookup
+# (nearest cell or bilinear), and anything outside falls back to the forest.
+
+DEFAULT_TEMP = (-5.0, 60.0, 0.5)   # (start, stop, step) in degrees C, matches the old test sweep
+DEFAULT_AQI = (1.0, 325.0, 1.0)    # (start, stop, step) in US AQI
+TARGETS = (('weather', 'weather_satisfaction'), ('air_quality', 'air_quality_satisfaction'))
+
+
+def _axis(spec):
+    start, stop, step = (float(v) for v in spec)
+    if step <= 0 or stop <= start:
+        raise ValueError(f"invalid grid axis {spec}: need start < stop and step > 0")
+    n = int(math.floor((stop - start) / step + 1e-9)) + 1
+    return start + step * np.arange(n)
+
+
+def forest_predictions(city_model, temps, aqis):
+    """Clipped predictions of the forests themselves, never through a grid the model may already serve from."""
+    inp = np.column_stack([np.asarray(temps, dtype=float).ravel(), np.asarray(aqis, dtype=float).ravel()])
+    out = {}
+    for key, name in TARGETS:
+        raw = city_model.predict_raw(key, inp) if len(inp) else None
+        out[name] = np.clip(raw, 1.0, 10.0) if raw is not None else None
+    return out
+
+
+class prediction_grid():
+    def __init__(self, city_model, temp=DEFAULT_TEMP, aqi=DEFAULT_AQI, interpolate=False):
+        self.interpolate = interpolate
+        self.temps = _axis(temp)
+        self.aqis = _axis(aqi)
+        self.t0, self.dt = self.temps[0], float(temp[2])
+        self.a0, self.da = self.aqis[0], float(aqi[2])
+        self.t_max, self.a_max = self.temps[-1], self.aqis[-1]
+
+        tt, aa = np.meshgrid(self.temps, self.aqis, indexing='ij')
+        preds = forest_predictions(city_model, tt.ravel(), aa.ravel())
+        self.tables = {}
+        for _, name in TARGETS:
+            if preds[name] is not None:
+                self.tables[name] = np.ascontiguousarray(preds[name].reshape(tt.shape))
+
+    def contains(self, temp, aqi):
+        return self.t0 <= temp <= self.t_max and self.a0 <= aqi <= self.a_max
+
+    def lookup(self, temp, aqi):
+        """Grid answer {name: value} for one reading, or None if it lies outside the grid."""
+        temp = float(temp)
+        aqi = float(aqi)
+        if not self.contains(temp, aqi):
+            return None
+        x = (temp - self.t0) / self.dt
+        y = (aqi - self.a0) / self.da
+        out = {}
+        if not self.interpolate:
+            i = min(int(x + 0.5), len(self.temps) - 1)
+            j = min(int(y + 0.5), len(self.aqis) - 1)
+            for name, table in self.tables.items():
+                out[name] = float(table[i, j])
+            return out
+
+        i = min(int(x), len(self.temps) - 2)
+        j = min(int(y), len(self.aqis) - 2)
+        fx = x - i
+        fy = y - j
+        for name, table in self.tables.items():
+            top = table[i, j] * (1 - fy) + table[i, j + 1] * fy
+            bottom = table[i + 1, j] * (1 - fy) + table[i + 1, j + 1] * fy
+            out[name] = float(top * (1 - fx) + bottom * fx)
+        return out
+
+    def lookup_batch(self, temps, aqis):
+        """Vectorized lookup; returns ({name: values}, inside_mask). Values outside the grid are NaN."""
+        x = (np.asarray(temps, dtype=float) - self.t0) / self.dt
+        y = (np.asarray(aqis, dtype=float) - self.a0) / self.da
+        inside = (x >= 0) & (y >= 0) & (x <= len(self.temps) - 1) & (y <= len(self.aqis) - 1)
+        xs = np.where(inside, x, 0.0)
+        ys = np.where(inside, y, 0.0)
+        out = {}
+        if not self.interpolate:
+            i = np.minimum((xs + 0.5).astype(int), len(self.temps) - 1)
+            j = np.minimum((ys + 0.5).astype(int), len(self.aqis) - 1)
+            for name, table in self.tables.items():
+                out[name] = np.where(inside, table[i, j], np.nan)
+            return out, inside
+
+        i = np.minimum(xs.astype(int), len(self.temps) - 2)
+        j = np.minimum(ys.astype(int), len(self.aqis) - 2)
+        fx = xs - i
+        fy = ys - j
+        for name, table in self.tables.items():
+            top = table[i, j] * (1 - fy) + table[i, j + 1] * fy
+            bottom = table[i + 1, j] * (1 - fy) + table[i + 1, j + 1] * fy
+            out[name] = np.where(inside, top * (1 - fx) + bottom * fx, np.nan)
+        return out, inside
+
+    def error_report(self, city_model, n_samples=20000, seed=0):
+        """Max and mean absolute error of the grid against the forests on random in-grid readings."""
+        rng = np.random.default_rng(seed)
+        temps = rng.uniform(self.t0, self.t_max, n_samples)
+        aqis = rng.uniform(self.a0, self.a_max, n_samples)
+        exact = forest_predictions(city_model, temps, aqis)
+        approx, _ = self.lookup_batch(temps, aqis)
+        report = {'cells': int(len(self.temps) * len(self.aqis)), 'temp_step': self.dt, 'aqi_step': self.da,
+                  'interpolate': self.interpolate}
+        for name in self.tables:
+            err = np.abs(approx[name] - exact[name])
+            report[name] = {'max_abs_error': float(err.max()), 'mean_abs_error': float(err.mean())}
+        return report
+
+
+def resolution_sweep(city_model, steps=((2.0, 10.0), (1.0, 5.0), (0.5, 1.0), (0.25, 0.5)), n_samples=20000):
+    """Error reports for several (temp_step, aqi_step) resolutions, with and without interpolation."""
+    reports = []
+    for t_step, a_step in steps:
+        for interpolate in (False, True):
+            grid = prediction_grid(city_model, temp=(DEFAULT_TEMP[0], DEFAULT_TEMP[1], t_step),
+                                   aqi=(DEFAULT_AQI[0], DEFAULT_AQI[1], a_step), interpolate=interpolate)
+            reports.append(grid.error_report(city_model, n_samples=n_samples))
+    return reports
+
+
+if __name__ == "__main__":
+    # Usage: python prediction_grid.py [City ...]  -> grid error per resolution
+    import random_forest_model as rfm
+
+    for city in sys.argv[1:] or ["Lahore", "Islamabad", "Karachi"]:
+        city_model = rfm.model(city)
+        for r in resolution_sweep(city_model):
+            print(f"{city}: temp_step={r['temp_step']} aqi_step={r['aqi_step']} cells={r['cells']} "
+                  f"interpolate={r['interpolate']} "
+                  f"weather max={r['weather_satisfaction']['max_abs_error']:.3f} "
+                  f"air_quality max={r['air_quality_satisfaction']['max_abs_error']:.3f}")
@@ -0,0 +1,570 @@
+# Request handling shared by the Flask (flask_post_data2.py) and ASGI (asgi_app.py) servers.
+#
+# Each handler takes the parsed JSON body and the {city: model} map and returns
+# (response_dict, status_code); the servers only add transport-specific parts.
+import logging
+import math
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import incremental_training as it
+import model_store as ms
+import point_stream as ps
+import random_forest_model as rfm
+import rolling_features as rf
+import service_metrics as sm
+from prediction_cache import prediction_cache
+from request_coalescing import coalescer
+
+# /postData answers for (nearly) repeated readings; see prediction_cache.py (off unless PREDICTION_CACHE=1)
+predictions = prediction_cache.from_env()
+# concurrent cache misses for the same city scored in one batch; see request_coalescing.py (off unless COALESCE_WINDOW_MS is set)
+coalescing = coalescer.from_env()
+# per-city rolling features from the readings posted so far, for models trained with MODEL_FEATURES=rolling
+rolling = rf.rolling_states()
+
+
+def model_options():
+    """
+    Model options set through the environment:
+    MODEL_ENGINE=auto|flat|sklearn selects the inference engine,
+    SHARED_WEIGHTS=1 serves from memory-mapped tree arrays shared by all worker processes.
+    """
+    opts = {}
+    if os.environ.get("MODEL_ENGINE"):
+        opts['engine'] = os.environ["MODEL_ENGINE"]
+    if os.environ.get("SHARED_WEIGHTS", "0") == "1":
+        opts['shared_weights'] = True
+    return opts
+
+
+class model_cache():
+    """
+    {city: model} mapping over the city registry that builds each model on first use.
+    With max_models and/or max_memory_mb set, the least recently used models are evicted beyond the cap
+    (requests already holding an evicted model finish with it).
+    A city's model can be replaced while serving (reload, update, watch): the new one is loaded and warmed up
+    next to the old one and then swapped in; requests that already hold the old one finish with it.
+    """
+
+    def __init__(self, cities=None, max_models=None, max_memory_mb=None, **model_kwargs):
+        self.cities = list(cities) if cities is not None else list(rfm.CITIES_FILES)
+        self.max_models = max_models
+        self.max_bytes = max_memory_mb * 1024 * 1024 if max_memory_mb else None
+        self.model_kwargs = model_kwargs
+        self.stats = {'loads': 0, 'hits': 0, 'evictions': 0, 'reloads': 0, 'reload_errors': 0}
+        # per city: generation (bumped on every swap), artifact version served and requests per generation
+        self.versions = {city: {'generation': 0, 'version': None, 'requests': {}} for city in self.cities}
+        self._models = OrderedDict()
+        self._sizes = {}
+        self._lock = threading.Lock()
+        self._city_locks = {city: threading.RLock() for city in self.cities}
+        self._watch_interval = None
+
+    def __contains__(self, city):
+        return city in self._city_locks
+
+    def __iter__(self):
+        return iter(self.cities)
+
+    def __len__(self):
+        return len(self.cities)
+
+    def keys(self):
+        return list(self.cities)
+
+    def loaded(self):
+        with self._lock:
+            return list(self._models)
+
+    def __getitem__(self, city):
+        if city not in self._city_locks:
+            raise KeyError(city)
+        with self._lock:
+            m = self._models.get(city)
+            if m is not None:
+                self._models.move_to_end(city)
+                self.stats['hits'] += 1
+                self._count(city)
+                return m
+        # one loader per city; other requests for the same city wait for it
+        with self._city_locks[city]:
+            with self._lock:
+                m = self._models.get(city)
+                if m is not None:
+                    self._models.move_to_end(city)
+                    self._count(city)
+                    return m
+            m = rfm.model(city, **self.model_kwargs)
+            with self._lock:
+                self.stats['loads'] += 1
+                self._install(city, m)
+                self._count(city)
+            return m
+
+    def get(self, city, default=None):
+        return self[city] if city in self else default
+
+    def items(self):
+        return [(city, self[city]) for city in self.cities]
+
+    def _count(self, city):
+        info = self.versions[city]
+        info['requests'][info['generation']] = info['requests'].get(info['generation'], 0) + 1
+
+    def _install(self, city, m):
+        # caller holds self._lock
+        self._models[city] = m
+        self._models.move_to_end(city)
+        self._sizes[city] = m.memory_bytes()
+        info = self.versions[city]
+        info['generation'] += 1
+        info['version'] = m.version()
+        info['backend'] = m.backend['name'] if getattr(m, 'backend', None) else None
+        self._evict()
+
+    def replace(self, city, new_model):
+        """Swap in a new model object for a city; requests already holding the old one finish with it."""
+        with self._lock:
+            self._install(city, new_model)
+        predictions.invalidate(city)
+        logging.info(f"Serving {city} models {new_model.version()} (generation {self.versions[city]['generation']})")
+
+    def reload(self, city):
+        """Load a city's current stored models, warm them up and swap them in; returns the new version."""
+        with self._city_locks[city]:
+            try:
+                m = rfm.model(city, **self.model_kwargs)
+                warm_up(m)
+            except Exception:
+                self.stats['reload_errors'] += 1
+                logging.exception(f"Reloading {city} models failed; still serving the previous version")
+                raise
+            self.replace(city, m)
+            self.stats['reloads'] += 1
+            return m.version()
+
+    def reload_in_background(self, cities=None):
+        """Start reload() for the given cities (default: the loaded ones) on a background thread."""
+        cities = [c for c in (cities or self.loaded()) if c in self]
+
+        def run():
+            for city in cities:
+                try:
+                    self.reload(city)
+                except Exception:
+                    pass  # logged by reload()
+
+        threading.Thread(target=run, name="model-reload", daemon=True).start()
+        return cities
+
+    def update(self, city, rows, **kwargs):
+        """Fold new feelings into a city's models (incremental_training.update_city) and swap the result in."""
+        kwargs.setdefault('store_dir', self.model_kwargs.get('store_dir'))
+        with self._city_locks[city]:
+            new_model, n_new = it.update_city(self[city], rows, **kwargs)
+            if n_new:
+                warm_up(new_model)
+                self.replace(city, new_model)
+        return n_new
+
+    def stale(self):
+        """Loaded cities whose stored artifact (for the current source files) differs from the one being served."""
+        out = []
+        for city in self.loaded():
+            with self._lock:
+                m = self._models.get(city)
+            if m is None:
+                continue
+            meta = ms.artifact_meta(city, rfm.source_fingerprint(city, m.source), features=m.features, backend=m.backend)
+            if meta is not None and ms.artifact_version(meta) != m.version():
+                out.append(city)
+        return out
+
+    def watch(self, interval):
+        """Poll the model store every interval seconds and reload cities whose artifact changed."""
+        self._watch_interval = interval
+        self._start_watch()
+        if hasattr(os, "register_at_fork"):
+            # threads do not survive fork (e.g. gunicorn --preload): each worker watches for itself
+            os.register_at_fork(after_in_child=self._start_watch)
+
+    def _start_watch(self):
+        def run():
+            while True:
+                time.sleep(self._watch_interval)
+                try:
+                    for city in self.stale():
+                        logging.info(f"Stored models for {city} changed; reloading")
+                        self.reload(city)
+                except Exception:
+                    logging.exception("Model store watch failed (will retry)")
+
+        threading.Thread(target=run, name="model-watch", daemon=True).start()
+
+    def _evict(self):
+        while len(self._models) > 1 and (
+                (self.max_models and len(self._models) > self.max_models)
+                or (self.max_bytes and sum(self._sizes.values()) > self.max_bytes)):
+            city, _ = self._models.popitem(last=False)
+            self._sizes.pop(city, None)
+            self.stats['evictions'] += 1
+            logging.info(f"Evicted model for {city} from memory")
+
+    def status(self):
+        with self._lock:
+            return dict(self.stats, loaded=list(self._models),
+                        memory_mb=round(sum(self._sizes.values()) / 1024 / 1024, 1),
+                        versions={city: dict(info, requests=dict(info['requests']))
+                                  for city, info in self.versions.items() if info['generation']})
+
+
+WARMUP_TEMPS = [0.0, 10.0, 20.0, 30.0, 40.0]
+WARMUP_AQIS = [25.0, 75.0, 150.0, 250.0, 300.0]
+
+
+def warm_up(m):
+    """Run a few predictions through a freshly loaded model so its first real request is not the slow one."""
+    m.predict_batch(WARMUP_TEMPS, WARMUP_AQIS)
+    for temp, aqi in zip(WARMUP_TEMPS, WARMUP_AQIS):
+        m.predict_feelings(temp, aqi)
+
+
+def load_models(cities=None, preload=None, max_models=None, max_memory_mb=None, **model_kwargs):
+    """
+    City models for the servers, built lazily through a model_cache. Environment:
+    PRELOAD_MODELS=1 loads every city at start-up, MAX_MODELS / MODEL_MEMORY_MB cap the models kept in memory,
+    MODEL_WATCH_INTERVAL=<seconds> reloads a city when its stored artifact changes.
+    """
+    opts = model_options()
+    opts.update(model_kwargs)
+    if max_models is None and os.environ.get("MAX_MODELS"):
+        max_models = int(os.environ["MAX_MODELS"])
+    if max_memory_mb is None and os.environ.get("MODEL_MEMORY_MB"):
+        max_memory_mb = float(os.environ["MODEL_MEMORY_MB"])
+    models = model_cache(cities, max_models=max_models, max_memory_mb=max_memory_mb, **opts)
+    if preload is None:
+        preload = os.environ.get("PRELOAD_MODELS", "0") == "1"
+    if preload:
+        for city in models.keys():
+            models[city]
+    if os.environ.get("MODEL_WATCH_INTERVAL"):
+        models.watch(float(os.environ["MODEL_WATCH_INTERVAL"]))
+    return models
+
+
+def admin_authorized(headers):
+    """Admin endpoints are open unless ADMIN_TOKEN is set; then the X-Admin-Token header must match it."""
+    token = os.environ.get("ADMIN_TOKEN")
+    return not token or headers.get("X-Admin-Token") == token
+
+
+def admin_reload(data, models):
+    """
+    /admin/reload: reload cities from the model store in the background and swap them in when warmed up.
+    Body (optional): {"city": ...} or {"cities": [...]}; default is every loaded city.
+    """
+    data = data or {}
+    cities = data.get("cities") or ([data["city"]] if data.get("city") else None)
+    unknown = [c for c in cities or [] if c not in models]
+    if unknown:
+        return {"error": f"unknown cities: {unknown}"}, 400
+    return {"reloading": models.reload_in_background(cities)}, 202
+
+
+def admin_feelings(data, models):
+    """
+    /admin/feelings: fold newly recorded feelings into a city's models (incremental_training) and serve the result.
+    Body: {"city": ..., "rows": [{"date", "weather_satisfaction", "air_quality_satisfaction"[, "temp", "aqi"]}, ...],
+    "mode": "grow" (default) or "window"}. Answers once the updated models are swapped in.
+    """
+    if not isinstance(data, dict):
+        return {"error": "json body must be an object"}, 400
+    city = data.get("city")
+    if not isinstance(city, str) or city not in models:
+        return {"error": f"unknown or missing city {city!r}"}, 400
+    rows = data.get("rows")
+    if not isinstance(rows, list) or not rows or not all(isinstance(r, dict) for r in rows):
+        return {"error": "rows must be a non-empty array of objects"}, 400
+    mode = data.get("mode", "grow")
+    if mode not in ("grow", "window"):
+        return {"error": "mode must be 'grow' or 'window'"}, 400
+    try:
+        n_new = models.update(city, rows, mode=mode)
+    except (KeyError, ValueError, TypeError) as e:
+        return {"error": str(e)}, 400
+    return {"city": city, "new_rows": n_new, "version": models[city].version()}, 200
+
+
+def safe_mean(arr, key_candidates=("value", "_value")):
+    """Compute mean of numeric values in array of dicts, checking several possible field names."""
+    vals = [v for v in (ps.point_value(item, key_candidates) for item in arr) if v is not None]
+    if not vals:
+        return None
+    return sum(vals) / len(vals)
+
+
+def safe_round(v):
+    try:
+        return round(float(v), 3)
+    except Exception:
+        return None
+
+
+def predict_post_data(data, models):
+    """/postData: average the posted temperature and aqi points and predict once for the city."""
+    if not data:
+        return {"error": "invalid or missing json body"}, 400
+    if not isinstance(data, dict):
+        return {"error": "json body must be an object"}, 400
+
+    city = data.get("city")
+    temps = data.get("temperature", [])
+    aqis = data.get("aqi", [])
+
+    if not city:
+        return {"error": "missing city"}, 400
+    if not isinstance(city, str):
+        return {"error": "city must be a string"}, 400
+
+    if not isinstance(temps, list) or not isinstance(aqis, list):
+        return {"error": "temperature and aqi must be arrays"}, 400
+
+    if len(temps) == 0 and len(aqis) == 0:
+        return {"error": "both temperature and aqi arrays are empty"}, 400
+
+    # compute averages (try both 'value' and '_value' field names)
+    with sm.stage('aggregate'):
+        avg_temp = safe_mean(temps, key_candidates=("value", "_value"))
+        avg_aqi = safe_mean(aqis, key_candidates=("value", "_value"))
+
+    if avg_temp is None and avg_aqi is None:
+        return {"error": "no numeric values found in temperature or aqi arrays"}, 400
+    if not all(v is None or math.isfinite(v) for v in (avg_temp, avg_aqi)):
+        # NaN / Infinity points (or values overflowing the mean) cannot be answered in valid JSON
+        return {"error": "temperature and aqi values must be finite numbers"}, 400
+
+    # If one of them is missing, set to 0 (or you can choose to return error)
+    if avg_temp is None:
+        avg_temp = 0.0
+    if avg_aqi is None:
+        avg_aqi = 0.0
+
+    return predict_averages(city, avg_temp, avg_aqi, models, readings=(temps, aqis))
+
+
+def stream_options(args):
+    """Aggregation options of a streaming /postData request from its query string: agg, window, trim."""
+    try:
+        window = int(args["window"]) if args.get("window") else None
+        trim = float(args.get("trim", 0.1))
+    except ValueError:
+        raise ValueError("window must be an integer and trim a number")
+    if window is not None and window <= 0:
+        raise ValueError("window must be a positive integer")
+    if not math.isfinite(trim) or trim < 0:
+        raise ValueError("trim must be a finite non-negative number")
+    return {"how": args.get("agg", "mean"), "window": window, "trim": trim}
+
+
+def predict_post_stream(scanner, models, how="mean", window=None, trim=0.1):
+    """
+    /postData in streaming mode: predict from a closed point_stream.point_scanner instead of a parsed body.
+    The temperature and aqi points are reduced with point_stream.aggregate (mean, median or trimmed).
+    """
+    if scanner.error is not None:
+        return {"error": scanner.error}, 400
+    if not scanner.city:
+        return {"error": "missing city"}, 400
+    if not isinstance(scanner.city, str):
+        return {"error": "city must be a string"}, 400
+    if scanner.city not in models:
+        return {"error": f"unknown city {scanner.city!r}"}, 400
+    temps = scanner.values.get("temperature", ())
+    aqis = scanner.values.get("aqi", ())
+    if len(temps) == 0 and len(aqis) == 0:
+        return {"error": "no numeric values found in temperature or aqi arrays"}, 400
+    if not (ps.all_finite(temps) and ps.all_finite(aqis)):
+        return {"error": "temperature and aqi values must be finite numbers"}, 400
+    try:
+        with sm.stage('aggregate'):
+            avg_temp = ps.aggregate(temps, how, window, trim)
+            avg_aqi = ps.aggregate(aqis, how, window, trim)
+    except ValueError as e:
+        return {"error": str(e)}, 400
+    body, status = predict_averages(scanner.city, 0.0 if avg_temp is None else avg_temp,
+                                    0.0 if avg_aqi is None else avg_aqi, models, readings=(temps, aqis))
+    if status == 200:
+        body["result"]["aggregate"] = {"method": how, "window": window, "points": [len(temps), len(aqis)]}
+    return body, status
+
+
+def predict_averages(city, avg_temp, avg_aqi, models, readings=None):
+    """
+    Predict once for a city from its aggregated temperature and aqi; the /postData result payload.
+    readings: the posted (temperature, aqi) points, which feed the rolling features of models that use them.
+    """
+    logging.info(f"Received city={city}, avg_temp={avg_temp}, avg_aqi={avg_aqi}")
+    if city not in models:
+        return {"error": f"unknown city {city!r}"}, 400
+
+    # run predictions
+    model = models[city]
+
+    try:
+        with sm.stage('predict'):
+            if getattr(model, 'rolling', False):
+                # the answer depends on the city's history, so neither cached nor coalesced
+                temps, aqis = readings or ((), ())
+                try:
+                    extra = rolling.update(city, point_readings(temps), point_readings(aqis), avg_temp, avg_aqi)
+                except ValueError as e:
+                    return {"error": str(e)}, 400
+                raw_result = model.run(avg_temp, avg_aqi, extra)
+            else:
+                raw_result = predictions.run(model, avg_temp, avg_aqi, runner=coalescing.run if coalescing.enabled else None)
+    except Exception as e:
+        logging.exception("Failed to run model")
+        return {"error": f"model run error: {e}"}, 500
+
+    # raw_result expected to be like: { "<city_key>": { "weather_satisfaction": float, "air_quality_satisfaction": float } }
+    # Extract the predictions dict (first value)
+    preds_dict = None
+    if isinstance(raw_result, dict) and len(raw_result) > 0:
+        # pick either the entry matching incoming city (if exists), else first key
+        if city in raw_result:
+            preds_dict = raw_result[city]
+        else:
+            # take first value
+            preds_dict = next(iter(raw_result.values()))
+    else:
+        preds_dict = raw_result  # fallback if model returns a simple dict
+
+    if not isinstance(preds_dict, dict):
+        logging.error(f"Unexpected model output format: {raw_result}")
+        return {"error": "unexpected model output format"}, 500
+
+    # Extract floats and round them (nearest integer). Change rounding precision here if you prefer decimals.
+    raw_weather = preds_dict.get("weather_satisfaction")
+    raw_air = preds_dict.get("air_quality_satisfaction")
+
+    weather_rounded = safe_round(raw_weather)
+    air_rounded = safe_round(raw_air)
+
+    result_payload = {
+        "city": city,
+        "avg_temperature": avg_temp,
+        "avg_aqi": avg_aqi,
+        "predictions": {
+            "weather_satisfaction": weather_rounded,
+            "air_quality_satisfaction": air_rounded
+        },
+        # include raw_model_output for debugging
+        "raw_model_output": raw_result
+    }
+    if predictions.enabled and not getattr(model, 'rolling', False):
+        # the cache answers for the reading snapped to its cell
+        _, (q_temp, q_aqi) = predictions.quantize(avg_temp, avg_aqi)
+        result_payload["model_inputs"] = {"temperature": q_temp, "aqi": q_aqi}
+
+    return {"result": result_payload}, 200
+
+
+def point_values(arr, key_candidates=("value", "_value")):
+    """Return the numeric value of every point (plain numbers or dicts), or None if any point has none."""
+    vals = []
+    for item in arr:
+        if isinstance(item, dict):
+            item = next((item[k] for k in key_candidates if item.get(k) is not None), None)
+        try:
+            vals.append(float(item))
+        except Exception:
+            return None
+    return vals
+
+
+def point_times(arr, key_candidates=("time", "_time")):
+    """Return the timestamps carried by the points (None where absent)."""
+    return [next((item[k] for k in key_candidates if k in item), None) if isinstance(item, dict) else None
+            for item in arr]
+
+
+def point_readings(arr, key_candidates=("value", "_value")):
+    """(time, value) of every point with a numeric value; plain numbers have no time."""
+    out = []
+    for t, item in zip(point_times(arr), arr):
+        if isinstance(item, dict):
+            item = next((item[k] for k in key_candidates if item.get(k) is not None), None)
+        try:
+            out.append((t, float(item)))
+        except (TypeError, ValueError):
+            pass
+    return out
+
+
+def predict_batch_request(data, models):
+    """
+    /predictBatch: score many (temperature, aqi) pairs in one request, for one or more cities.
+    Body: {"city": ..., "temperature": [...], "aqi": [...]} or {"batches": [<that object>, ...]}.
+    temperature[i] is paired with aqi[i]; a single-element array is applied to every point.
+    """
+    if not data:
+        return {"error": "invalid or missing json body"}, 400
+    if not isinstance(data, dict):
+        return {"error": "json body must be an object (use {\"batches\": [...]} for several batches)"}, 400
+
+    batches = data.get("batches", [data])
+    if not isinstance(batches, list) or len(batches) == 0:
+        return {"error": "batches must be a non-empty array"}, 400
+
+    results = {}
+    for i, batch in enumerate(batches):
+        if not isinstance(batch, dict):
+            return {"error": f"batch {i} must be an object"}, 400
+        city = batch.get("city")
+        temps = batch.get("temperature", [])
+        aqis = batch.get("aqi", [])
+
+        if not isinstance(city, str) or city not in models:
+            return {"error": f"batch {i}: unknown or missing city {city!r}"}, 400
+        if not isinstance(temps, list) or not isinstance(aqis, list):
+            return {"error": f"batch {i}: temperature and aqi must be arrays"}, 400
+        if len(temps) == 0 or len(aqis) == 0:
+            return {"error": f"batch {i}: temperature and aqi arrays must not be empty"}, 400
+        if len(temps) != len(aqis) and 1 not in (len(temps), len(aqis)):
+            return {"error": f"batch {i}: temperature and aqi arrays differ in length"}, 400
+
+        temp_vals = point_values(temps)
+        aqi_vals = point_values(aqis)
+        if temp_vals is None or aqi_vals is None:
+            return {"error": f"batch {i}: every point needs a numeric value"}, 400
+        if not all(math.isfinite(v) for v in temp_vals + aqi_vals):
+            return {"error": f"batch {i}: temperature and aqi values must be finite numbers"}, 400
+
+        try:
+            preds = models[city].predict_batch(temp_vals, aqi_vals)
+        except Exception as e:
+            logging.exception("Failed to run batch prediction")
+            return {"error": f"model run error: {e}"}, 500
+
+        n = max(len(temp_vals), len(aqi_vals))
+        times = point_times(temps if len(temps) == n else aqis)
+        weather = preds["weather_satisfaction"]
+        air = preds["air_quality_satisfaction"]
+        weather = weather.round(3).tolist() if weather is not None else [None] * n
+        air = air.round(3).tolist() if air is not None else [None] * n
+
+        rows = results.setdefault(city, [])
+        for j in range(n):
+            rows.append({
+                "time": times[j],
+                "temperature": temp_vals[j if len(temp_vals) == n else 0],
+                "aqi": aqi_vals[j if len(aqi_vals) == n else 0],
+                "weather_satisfaction": weather[j],
+                "air_quality_satisfaction": air[j]
+            })
+
+    logging.info("Scored batch: " + ", ".join(f"{c}={len(r)}" for c, r in results.items()))
+    return {"results": results}, 200
@@ -0,0 +1,213 @@
+import json
+import os
+import shutil
+import time
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+import model_store as ms
+import rolling_features as rf
+
+# ---------------------------
+# Columnar cache of the daily-aligned training frame of each city
+# ---------------------------
+# load_and_prepare_city() parses three CSVs, groups hourly weather by day and
+# interpolates AQI every time it runs. prepare() runs it once per version of the
+# source files and stores each resulting column as a typed .npy file:
+#   <cache>/<city>/<fingerprint[:16]>/meta.json
+#   <cache>/<city>/<fingerprint[:16]>/<column>.npy
+# Later runs memory-map those arrays instead of touching the CSVs.
+# Feelings recorded after the CSVs (incremental_training.py) are kept separately in
+#   <cache>/<city>/appended/<column>.npy
+# and added to the prepared frame when they are newer than its last date.
+
+PREP_FORMAT = 2   # 2: rolling feature columns (rolling_features.py)
+APPENDED = "appended"
+COLUMNS = ['date', 'weather_satisfaction', 'air_quality_satisfaction', 'temp', 'aqi'] + rf.ROLLING
+
+DEFAULT_CACHE_DIR = Path(os.environ.get("PREPARED_DATA_DIR", Path(__file__).resolve().parent / "prepared"))
+
+
+def _cache_dir(city, fingerprint, cache_dir=None):
+    return Path(cache_dir or DEFAULT_CACHE_DIR) / city / fingerprint[:16]
+
+
+def save_prepared(city, df, fingerprint, cache_dir=None):
+    """Write the columns of a prepared frame as .npy files; returns the cache directory."""
+    final_dir = _cache_dir(city, fingerprint, cache_dir)
+    tmp_dir = final_dir.with_name(final_dir.name + f".tmp{os.getpid()}")
+    if tmp_dir.exists():
+        shutil.rmtree(tmp_dir)
+    tmp_dir.mkdir(parents=True)
+
+    columns = []
+    for col in df.columns:
+        values = df[col].to_numpy()
+        if values.dtype.kind not in 'biufM':
+            raise TypeError(f"Column '{col}' of {city} has dtype {values.dtype}; only numeric and datetime columns are cached")
+        np.save(tmp_dir / f"{col}.npy", values)
+        columns.append(col)
+
+    meta = {
+        'format': PREP_FORMAT,
+        'city': city,
+        'fingerprint': fingerprint,
+        'columns': columns,
+        'n_rows': len(df),
+        'created': time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+    }
+    with open(tmp_dir / "meta.json", "w", encoding="utf-8") as f:
+        json.dump(meta, f, indent=2)
+
+    if final_dir.exists():
+        shutil.rmtree(final_dir)
+    os.replace(tmp_dir, final_dir)
+    return final_dir
+
+
+def load_prepared(city, fingerprint, cache_dir=None, mmap_mode='r'):
+    """Return the cached prepared frame of a city for these source files, or None."""
+    path = _cache_dir(city, fingerprint, cache_dir)
+    meta_path = path / "meta.json"
+    if not meta_path.exists():
+        return None
+    try:
+        with open(meta_path, encoding="utf-8") as f:
+            meta = json.load(f)
+        if meta.get('format') != PREP_FORMAT or meta.get('fingerprint') != fingerprint:
+            return None
+        return pd.DataFrame({col: np.load(path / f"{col}.npy", mmap_mode=mmap_mode) for col in meta['columns']})
+    except Exception as e:
+        print(f"Ignoring unreadable prepared data {path}: {e}")
+        return None
+
+
+def prune(city, keep_fingerprint, cache_dir=None):
+    """Delete every cached frame of a city other than the one for keep_fingerprint."""
+    city_dir = Path(cache_dir or DEFAULT_CACHE_DIR) / city
+    if not city_dir.exists():
+        return
+    for child in city_dir.iterdir():
+        if child.is_dir() and child.name not in (keep_fingerprint[:16], APPENDED):
+            shutil.rmtree(child, ignore_errors=True)
+
+
+def load_appended(city, cache_dir=None):
+    """Feelings appended after the source CSVs, as a frame with COLUMNS (empty if there are none)."""
+    path = Path(cache_dir or DEFAULT_CACHE_DIR) / city / APPENDED
+    if not (path / "date.npy").exists():
+        return pd.DataFrame({col: np.array([], dtype='datetime64[ns]' if col == 'date' else float) for col in COLUMNS})
+    n = len(np.load(path / "date.npy", mmap_mode='r'))
+    # appended data written before a column existed reads it as NaN
+    return pd.DataFrame({col: np.load(path / f"{col}.npy") if (path / f"{col}.npy").exists() else np.full(n, np.nan)
+                         for col in COLUMNS})
+
+
+def append_rows(city, rows, cache_dir=None):
+    """
+    Add new feeling rows (a frame with COLUMNS; the feature columns may be NaN) to a city's appended data,
+    replacing earlier rows of the same date. Returns the number of rows written.
+    """
+    rows = rows[COLUMNS].copy()
+    rows['date'] = pd.to_datetime(rows['date']).dt.normalize().astype('datetime64[ns]')
+    merged = pd.concat([load_appended(city, cache_dir), rows], ignore_index=True)
+    merged = merged.drop_duplicates(subset='date', keep='last').sort_values('date', ignore_index=True)
+
+    final_dir = Path(cache_dir or DEFAULT_CACHE_DIR) / city / APPENDED
+    tmp_dir = final_dir.with_name(final_dir.name + f".tmp{os.getpid()}")
+    if tmp_dir.exists():
+        shutil.rmtree(tmp_dir)
+    tmp_dir.mkdir(parents=True)
+    for col in COLUMNS:
+        np.save(tmp_dir / f"{col}.npy", merged[col].to_numpy(dtype='datetime64[ns]' if col == 'date' else float))
+    if final_dir.exists():
+        shutil.rmtree(final_dir)
+    os.replace(tmp_dir, final_dir)
+    return len(rows)
+
+
+def _with_appended(city, df, cache_dir=None):
+    extra = load_appended(city, cache_dir)
+    if df.empty or extra.empty:
+        return df if extra.empty else extra
+    extra = extra[extra['date'] > df['date'].max()]
+    if extra.empty:
+        return df
+    combined = pd.concat([df, extra[list(df.columns)]], ignore_index=True)
+    # appended rows carry their day's readings (incremental_training.attach_readings); gaps left in
+    # appended data written before that take the last known features, as in load_and_prepare_city
+    for col in COLUMNS[3:]:
+        combined[col] = combined[col].interpolate(method='linear').ffill().bfill()
+    return combined
+
+
+def prepare(city, files=None, fingerprint=None, cache_dir=None, rebuild=False, build=None):
+    """
+    Daily-aligned frame of a city (same columns as load_and_prepare_city) plus any appended feelings,
+    read from the cache when the source data is unchanged and built from the CSVs (then cached) otherwise.
+    Other sources pass their own fingerprint and a build() returning the frame (e.g. influx_source.py).
+    """
+    import random_forest_model as rfm
+
+    if fingerprint is None:
+        fingerprint = ms.fingerprint_files(files)
+    df = None if rebuild else load_prepared(city, fingerprint, cache_dir)
+    if df is None:
+        df = build() if build is not None else rfm.load_and_prepare_city(files)
+        try:
+            save_prepared(city, df, fingerprint, cache_dir)
+            prune(city, fingerprint, cache_dir)
+        except Exception as e:
+            print(f"Could not cache prepared data for {city}: {e}")
+    return _with_appended(city, df, cache_dir)
+
+
+def benchmark(cities=None, cache_dir=None, repeat=5):
+    """Time the pandas CSV path against a cache build and a cache read per city; raises if the frames differ."""
+    import random_forest_model as rfm
+
+    results = []
+    for city in cities or list(rfm.CITIES_FILES):
+        files = rfm.CITIES_FILES[city]
+        fingerprint = ms.fingerprint_files(files)
+
+        start = time.perf_counter()
+        for _ in range(repeat):
+            expected = rfm.load_and_prepare_city(files)
+        t_csv = (time.perf_counter() - start) / repeat
+
+        start = time.perf_counter()
+        prepare(city, files, fingerprint, cache_dir, rebuild=True)
+        t_build = time.perf_counter() - start
+
+        start = time.perf_counter()
+        for _ in range(repeat):
+            got = load_prepared(city, fingerprint, cache_dir)
+        t_cache = (time.perf_counter() - start) / repeat
+
+        start = time.perf_counter()
+        for _ in range(repeat):
+            load_prepared(city, ms.fingerprint_files(files), cache_dir)
+        t_cache_fp = (time.perf_counter() - start) / repeat
+
+        pd.testing.assert_frame_equal(expected, got)
+        results.append({'city': city, 'rows': len(got), 'csv_ms': t_csv * 1e3, 'build_ms': t_build * 1e3,
+                        'cache_ms': t_cache * 1e3, 'cache_with_fingerprint_ms': t_cache_fp * 1e3,
+                        'speedup': t_csv / t_cache_fp})
+    return results
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Build the prepared-data cache and compare it with the pandas CSV path")
+    parser.add_argument("cities", nargs="*", help="cities to benchmark (default: every city in the registry)")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    for row in benchmark(args.cities or None, repeat=args.repeat):
+        print(f"{row['city']:<10} rows={row['rows']:>6}  csv={row['csv_ms']:>8.1f} ms  build={row['build_ms']:>8.1f} ms  "
+              f"cache={row['cache_ms']:>6.2f} ms  cache+fingerprint={row['cache_with_fingerprint_ms']:>6.2f} ms  "
+              f"speedup={row['speedup']:.1f}x")
@@ -0,0 +1,58 @@
+import os
+import sys
+
+# ---------------------------
+# Per-process memory figures for the multi-process serving modes
+# ---------------------------
+# RSS counts shared pages once per process; PSS splits each shared page between
+# the processes mapping it, so the PSS of all workers adds up to the real RAM used.
+
+
+def memory_usage(pid="self"):
+    """{'rss_mb', 'pss_mb', 'shared_mb', 'private_mb'} from /proc (Linux); only rss_mb elsewhere."""
+    fields = {'Rss': 'rss_mb', 'Pss': 'pss_mb', 'Shared_Clean': 'shared_mb', 'Shared_Dirty': 'shared_mb',
+              'Private_Clean': 'private_mb', 'Private_Dirty': 'private_mb'}
+    out = {}
+    try:
+        with open(f"/proc/{pid}/smaps_rollup") as f:
+            for line in f:
+                key, _, rest = line.partition(":")
+                if key in fields:
+                    out[fields[key]] = out.get(fields[key], 0.0) + int(rest.split()[0]) / 1024.0
+        return out
+    except OSError:
+        pass
+    try:
+        import resource
+        scale = 1 if sys.platform == "darwin" else 1024
+        return {'rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale / 1024.0 / 1024.0}
+    except Exception:
+        return {}
+
+
+def format_usage(usage):
+    return ", ".join(f"{k}={v:.1f}" for k, v in usage.items()) or "n/a"
+
+
+def children(pid):
+    try:
+        with open(f"/proc/{pid}/task/{pid}/children") as f:
+            return [int(p) for p in f.read().split()]
+    except OSError:
+        return []
+
+
+def report(master_pid):
+    """Memory of a pre-fork master and its workers, with totals."""
+    rows = [("master", master_pid, memory_usage(master_pid))]
+    rows += [("worker", pid, memory_usage(pid)) for pid in children(master_pid)]
+    for role, pid, usage in rows:
+        print(f"{role:<7} pid={pid:<8} {format_usage(usage)}")
+    total_rss = sum(u.get('rss_mb', 0.0) for _, _, u in rows)
+    total_pss = sum(u.get('pss_mb', 0.0) for _, _, u in rows)
+    print(f"total   processes={len(rows)} rss_mb={total_rss:.1f} pss_mb={total_pss:.1f} (pss = actual RAM used)")
+
+
+if __name__ == "__main__":
+    # Usage: python process_memory.py <master pid>
+    report(int(sys.argv[1]) if len(sys.argv) > 1 else os.getpid())
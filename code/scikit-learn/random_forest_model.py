@@ -1,117 +1,236 @@
+import copy
+import itertools
+import os
 import pandas as pd
 import numpy as np
 from pathlib import Path
 from sklearn.linear_model import LinearRegression
 from sklearn.metrics import r2_score
-from sklearn.ensemble import RandomForestRegressor
+import model_store as ms
+import forest_engine as fe
+import prediction_grid as pg
+import city_registry as cr
+import prepared_data as pdc
+import model_backends as mb
+import rolling_features as rf
+
+# Identifies each built serving state, so caches can tell when a city's model was replaced
+_SERIALS = itertools.count(1)
+
+# Batches up to this size are scored by the flat engine in 'auto' mode; larger ones by sklearn
+FLAT_MAX_BATCH = 128
+
 # ---------------------------
-# Configuration: file paths
+# Configuration: file paths (see cities.json)
 # ---------------------------
+CITIES_FILES = cr.load_registry()
+
+# Where training data comes from: 'csv' (the files above) or 'influx' (InfluxDB buckets, see influx_source.py)
+TRAINING_SOURCE = os.environ.get("TRAINING_SOURCE", "csv")
+
+# Forest settings shared by model() and the parallel trainer (train_cities.py)
+FOREST_PARAMS = {'n_estimators': 100, 'random_state': 42}
+MIN_ROWS = 5
+
+# ---------------------------
+# Helper funcs
+# ---------------------------
+def to_date_only(df, date_col='date'):
+    """Ensure the date column is datetime and normalized to date-only (midnight)."""
+    df = df.copy()
+    df[date_col] = pd.to_datetime(df[date_col], errors='coerce')
+    df = df.dropna(subset=[date_col])
+    df[date_col] = df[date_col].dt.normalize()
+    return df
+
+
+def load_and_prepare_city(files):
+    """
+    Load weather, aqi and feeling files for a city and return a daily-aligned dataframe with columns:
+    date, temp (daily mean), aqi (daily interpolated), weather_satisfaction, air_quality_satisfaction,
+    and the rolling features of rolling_features.py (temp_min, temp_max, aqi_mean_3d, aqi_mean_7d, aqi_trend)
+    """
+    weather_path = Path(files['weather'])
+    aqi_path = Path(files['aqi'])
+    feeling_path = Path(files['feeling'])
+    return prepare_frames(pd.read_csv(weather_path, parse_dates=['date']),
+                          pd.read_csv(aqi_path, parse_dates=['date']),
+                          pd.read_csv(feeling_path, parse_dates=['date']),
+                          sources=(weather_path, aqi_path, feeling_path))
+
+
+def prepare_frames(w_df, aqi_df, f_df, sources=('weather data', 'AQI data', 'feeling data')):
+    """
+    Align raw weather (date, temp), AQI (date, aqi) and feeling (date, weather_satisfaction,
+    air_quality_satisfaction) frames into the daily training frame of load_and_prepare_city.
+    """
+    weather_path, aqi_path, feeling_path = sources
+
+    # --- Weather: hourly -> daily mean ---
+    w_df = to_date_only(w_df, 'date')
+    if 'temp' not in w_df.columns:
+        raise KeyError(f"'temp' column not found in weather file: {weather_path}")
+    daily_temp = w_df.groupby('date', as_index=False)['temp'].mean().rename(columns={'temp': 'temp'})
+
+    # --- AQI: likely weekly -> create daily index and interpolate ---
+    aqi_daily = daily_aqi(to_date_only(aqi_df, 'date'), aqi_path)
+
+    # --- Rolling features from the raw readings (before they are collapsed to one row per feeling date) ---
+    rolling = rf.daily_features(w_df[[c for c in ('date', 'temp', 'temp_min', 'temp_max') if c in w_df.columns]], aqi_daily)
+
+    # --- Feelings: parse expected columns ---
+    f_df = to_date_only(f_df, 'date')
+    required_cols = ['weather_satisfaction', 'air_quality_satisfaction']
+    for col in required_cols:
+        if col not in f_df.columns:
+            raise KeyError(f"'{col}' not found in feeling file: {feeling_path}")
+
+    # --- Merge: keep only dates where feelings were recorded (left join on feelings) ---
+    merged = pd.merge(f_df[['date'] + required_cols], daily_temp, on='date', how='left')
+    if not aqi_daily.empty:
+        merged = pd.merge(merged, aqi_daily[['date', 'aqi']], on='date', how='left')
+    else:
+        # if aqi data missing, add NaN column to keep pipeline consistent
+        merged['aqi'] = np.nan
+
+    # --- Handle missing temp/aqi for feeling dates ---
+    merged['temp'] = pd.to_numeric(merged['temp'], errors='coerce')
+    merged['aqi']  = pd.to_numeric(merged['aqi'], errors='coerce')
+
+    # Interpolate small gaps in temp and aqi (linear) and then forward/back-fill extremes
+    merged['temp'] = merged['temp'].interpolate(method='linear').ffill().bfill()
+    merged['aqi']  = merged['aqi'].interpolate(method='linear').ffill().bfill()
+
+    merged = pd.merge(merged, rolling, on='date', how='left')
+    for col in rf.ROLLING:
+        merged[col] = pd.to_numeric(merged[col], errors='coerce').interpolate(method='linear').ffill().bfill()
+
+    return merged
+
+
+def daily_aqi(aqi_df, aqi_path='AQI data'):
+    """AQI rows (date-only) -> one interpolated value per day between the first and the last row."""
+    if aqi_df.empty:
+        # no AQI rows: create empty DataFrame with date, aqi
+        return pd.DataFrame(columns=['date', 'aqi'])
+    if 'aqi' not in aqi_df.columns:
+        raise KeyError(f"'aqi' column not found in AQI file: {aqi_path}")
+    aqi_df = aqi_df.set_index('date').sort_index()
+
+    # Create continuous daily index from min to max of aqi file
+    daily_idx = pd.date_range(start=aqi_df.index.min(), end=aqi_df.index.max(), freq='D')
+
+    # Reindex to daily index (this yields a DataFrame with a DatetimeIndex)
+    aqi_daily_df = aqi_df.reindex(daily_idx)
+
+    # IMPORTANT FIX: interpolate with method='time' while the index is a DatetimeIndex
+    aqi_daily_df['aqi'] = aqi_daily_df['aqi'].interpolate(method='time').ffill().bfill()
+
+    # Reset index to have 'date' as a column (after interpolation)
+    return aqi_daily_df.reset_index().rename(columns={'index': 'date'})
+
+
+def _source(source):
+    source = source or TRAINING_SOURCE
+    if source not in ('csv', 'influx'):
+        raise ValueError(f"Unknown training source '{source}', expected 'csv' or 'influx'")
+    return source
+
+
+def source_fingerprint(city, source=None):
+    """Version of a city's training data: hash of its CSV files, or of the InfluxDB query for source='influx'."""
+    if _source(source) == 'influx':
+        import influx_source
+        return influx_source.shared().fingerprint(city)
+    return ms.fingerprint_files(CITIES_FILES[city])
+
+
+def prepare_training_data(city, fingerprint, source=None, cache_dir=None):
+    """Daily-aligned training frame of a city, through the prepared-data cache."""
+    if _source(source) == 'influx':
+        import influx_source
+        src = influx_source.shared()
+        return pdc.prepare(city, fingerprint=fingerprint, cache_dir=cache_dir, build=lambda: src.load_city(city))
+    return pdc.prepare(city, CITIES_FILES[city], fingerprint, cache_dir)
+
+
+def raw_readings(city, source=None):
+    """Raw (weather, aqi) frames of a city from its training source, before alignment to the feeling dates."""
+    if _source(source) == 'influx':
+        import influx_source
+        return influx_source.shared().readings(city)
+    files = CITIES_FILES[city]
+    return pd.read_csv(files['weather'], parse_dates=['date']), pd.read_csv(files['aqi'], parse_dates=['date'])
+
+
+def fit_target(X, y, n_jobs=None, backend=None):
+    """Fit one satisfaction model on (temp, aqi) rows (default: the forest); returns (model, in-sample R^2)."""
+    backend = backend or {'name': 'forest', 'params': {}}
+    est = mb.make(backend['name'], backend['params'], n_jobs=n_jobs).fit(X, y)
+    r2 = r2_score(y, est.predict(X))
+    if 'n_jobs' in est.get_params():
+        # fitted in parallel, served one request at a time: no thread pool per predict, trees summed in order
+        est.set_params(n_jobs=None)
+    return est, r2
+
+
+def _backend(city, backend=None):
+    """{'name', 'params'} from a backend name, a config dict, or model_backends.json for the city."""
+    if backend is None:
+        return mb.config_for(city)
+    if isinstance(backend, str):
+        if backend not in mb.BACKENDS:
+            raise ValueError(f"Unknown backend '{backend}', expected one of {mb.BACKENDS}")
+        return {'name': backend, 'params': {}}
+    return {'name': backend['name'], 'params': dict(backend.get('params', {}))}
+
+
 class model():
-    def __init__(self, current_city):
-        cities_files = {
-            'Islamabad': {
-                'weather': r"M:\Arbeit\Schule\internship\python\data\islamabad_weather.csv",
-                'aqi':     r"M:\Arbeit\Schule\internship\python\data\islamabad_mock_AQI.csv",
-                'feeling': r"M:\Arbeit\Schule\internship\python\data\islamabad_local_satisfaction_1980_2025.csv"
-            },
-            'Karachi': {
-                'weather': r"M:\Arbeit\Schule\internship\python\data\karachi_weather.csv",
-                'aqi':     r"M:\Arbeit\Schule\internship\python\data\karachi_mock_AQI.csv",
-                'feeling': r"M:\Arbeit\Schule\internship\python\data\karachi_local_satisfaction_1980_2025.csv"
-            },
-            'Lahore': {
-                'weather': r"M:\Arbeit\Schule\internship\python\data\lahore_weather.csv",
-                'aqi':     r"M:\Arbeit\Schule\internship\python\data\lahore_mock_AQI.csv",
-                'feeling': r"M:\Arbeit\Schule\internship\python\data\lahore_local_satisfaction_1980_2025.csv"
-            }
-        }
+    def __init__(self, current_city, use_store=True, store_dir=None, retrain=False, engine='auto', grid=None, shared_weights=False, n_jobs=None, source=None, backend=None, features=None):
+        if engine not in ('auto', 'flat', 'sklearn'):
+            raise ValueError(f"Unknown engine '{engine}', expected 'auto', 'flat' or 'sklearn'")
+        # which kind of model serves this city (see model_backends.py)
+        self.backend = _backend(current_city, backend)
+        # model input columns (see rolling_features.py); the base set is (temp, aqi)
+        self.features = rf.feature_columns(features)
+        self.rolling = self.features != ms.FEATURES
+        if shared_weights and self.backend['name'] == 'hist_gb':
+            print(f"{current_city} - shared_weights needs a forest backend; keeping the hist_gb models in memory")
+            shared_weights = False
+        if shared_weights:
+            # serve only from the memory-mapped flat arrays in the store; sklearn forests are not kept in memory
+            if not use_store:
+                raise ValueError("shared_weights=True needs the model store (use_store=True)")
+            engine = 'flat'
         self.city = current_city
-        current_files = cities_files[self.city]
+        self.engine = engine
+        self.shared_weights = shared_weights
+        self.source = _source(source)
+        self.flat = {}
+        self.grid = None
+        if self.city not in CITIES_FILES:
+            raise KeyError(f"Unknown city '{self.city}'; add it to the city registry ({cr.DEFAULT_REGISTRY.name})")
+        current_files = CITIES_FILES[self.city]
 
         # ---------------------------
-        # Helper funcs
+        # Reuse a stored artifact when the source CSVs are unchanged
         # ---------------------------
-        def to_date_only(df, date_col='date'):
-            """Ensure the date column is datetime and normalized to date-only (midnight)."""
-            df = df.copy()
-            df[date_col] = pd.to_datetime(df[date_col], errors='coerce')
-            df = df.dropna(subset=[date_col])
-            df[date_col] = df[date_col].dt.normalize()
-            return df
-
-        def load_and_prepare_city(files):
-            """
-            Load weather, aqi and feeling files for a city and return a daily-aligned dataframe with columns:
-            date, temp (daily mean), aqi (daily interpolated), weather_satisfaction, air_quality_satisfaction
-            """
-            weather_path = Path(files['weather'])
-            aqi_path = Path(files['aqi'])
-            feeling_path = Path(files['feeling'])
-
-            # --- Weather: hourly -> daily mean ---
-            w_df = pd.read_csv(weather_path, parse_dates=['date'])
-            w_df = to_date_only(w_df, 'date')
-            if 'temp' not in w_df.columns:
-                raise KeyError(f"'temp' column not found in weather file: {weather_path}")
-            daily_temp = w_df.groupby('date', as_index=False)['temp'].mean().rename(columns={'temp': 'temp'})
-
-            # --- AQI: likely weekly -> create daily index and interpolate (KEEP datetime index while interpolating) ---
-            aqi_df = pd.read_csv(aqi_path, parse_dates=['date'])
-            aqi_df = to_date_only(aqi_df, 'date')
-            if aqi_df.empty:
-                # no AQI rows: create empty DataFrame with date, aqi
-                aqi_daily = pd.DataFrame(columns=['date', 'aqi'])
-            else:
-                if 'aqi' not in aqi_df.columns:
-                    raise KeyError(f"'aqi' column not found in AQI file: {aqi_path}")
-                aqi_df = aqi_df.set_index('date').sort_index()
-
-                # Create continuous daily index from min to max of aqi file
-                daily_idx = pd.date_range(start=aqi_df.index.min(), end=aqi_df.index.max(), freq='D')
-
-                # Reindex to daily index (this yields a DataFrame with a DatetimeIndex)
-                aqi_daily_df = aqi_df.reindex(daily_idx)
-
-                # IMPORTANT FIX: interpolate with method='time' while the index is a DatetimeIndex
-                aqi_daily_df['aqi'] = aqi_daily_df['aqi'].interpolate(method='time').ffill().bfill()
-
-                # Reset index to have 'date' as a column (after interpolation)
-                aqi_daily = aqi_daily_df.reset_index().rename(columns={'index': 'date'})
-
-            # --- Feelings: parse expected columns ---
-            f_df = pd.read_csv(feeling_path, parse_dates=['date'])
-            f_df = to_date_only(f_df, 'date')
-            required_cols = ['weather_satisfaction', 'air_quality_satisfaction']
-            for col in required_cols:
-                if col not in f_df.columns:
-                    raise KeyError(f"'{col}' not found in feeling file: {feeling_path}")
-
-            # --- Merge: keep only dates where feelings were recorded (left join on feelings) ---
-            merged = pd.merge(f_df[['date'] + required_cols], daily_temp, on='date', how='left')
-            if not aqi_daily.empty:
-                merged = pd.merge(merged, aqi_daily[['date', 'aqi']], on='date', how='left')
-            else:
-                # if aqi data missing, add NaN column to keep pipeline consistent
-                merged['aqi'] = np.nan
-
-            # --- Handle missing temp/aqi for feeling dates ---
-            merged['temp'] = pd.to_numeric(merged['temp'], errors='coerce')
-            merged['aqi']  = pd.to_numeric(merged['aqi'], errors='coerce')
-
-            # Interpolate small gaps in temp and aqi (linear) and then forward/back-fill extremes
-            merged['temp'] = merged['temp'].interpolate(method='linear').ffill().bfill()
-            merged['aqi']  = merged['aqi'].interpolate(method='linear').ffill().bfill()
+        self.fingerprint = source_fingerprint(self.city, self.source)
+        if use_store and not retrain:
+            stored = ms.load_artifact(self.city, self.fingerprint, store_dir=store_dir, estimators=not shared_weights,
+                                      features=self.features, backend=self.backend)
+            if stored is not None:
+                self.models = stored
+                print(f"Loaded {self.city} models from store ({self.fingerprint[:16]})")
+                self.setup_serving(grid)
+                return
 
-            return merged
-
-            # ---------------------------
-            # Load, prepare all cities
-            # ---------------------------
-            
+        # ---------------------------
+        # Load, prepare city
+        # ---------------------------
         city_data = {}
         try:
-            df_city = load_and_prepare_city(current_files)
+            df_city = prepare_training_data(self.city, self.fingerprint, self.source)
             if df_city.empty:
                 print(f"Loaded {self.city} but resulting dataframe is empty; skipping.")
             else:
@@ -127,16 +246,15 @@ class model():
         self.models = {}
         df_city = df_city.dropna(subset=['weather_satisfaction', 'air_quality_satisfaction'])
         self.models = {}
-        X = df_city[['temp', 'aqi']].values
+        X = df_city[self.features].values
 
 
 
         # Weather satisfaction model
         
         y_weather = df_city['weather_satisfaction'].values
-        if len(y_weather) >= 5:
-            model_w = RandomForestRegressor(n_estimators=100, random_state=42).fit(X, y_weather)
-            r2_w = r2_score(y_weather, model_w.predict(X))
+        if len(y_weather) >= MIN_ROWS:
+            model_w, r2_w = fit_target(X, y_weather, n_jobs=n_jobs, backend=self.backend)
             self.models['weather'] = model_w
             self.models.setdefault('scores', {})['weather_r2'] = r2_w
             print(f"{self.city} - weather model trained on {len(y_weather)} rows, R^2 = {r2_w:.3f}")
@@ -145,29 +263,162 @@ class model():
 
         # Air quality satisfaction model
         y_aq = df_city['air_quality_satisfaction'].values
-        if len(y_aq) >= 5:
-            model_aq = RandomForestRegressor(n_estimators=100, random_state=42).fit(X, y_aq)
-            r2_aq = r2_score(y_aq, model_aq.predict(X))
+        if len(y_aq) >= MIN_ROWS:
+            model_aq, r2_aq = fit_target(X, y_aq, n_jobs=n_jobs, backend=self.backend)
             self.models['air_quality'] = model_aq
             self.models.setdefault('scores', {})['air_quality_r2'] = r2_aq
             print(f"{self.city} - air quality model trained on {len(y_aq)} rows, R^2 = {r2_aq:.3f}")
         else:
             print(f"{self.city} - not enough samples for air quality model ({len(y_aq)} rows).")
 
+        if use_store and ('weather' in self.models or 'air_quality' in self.models):
+            try:
+                path = ms.save_artifact(self.city, self.models, self.fingerprint, n_rows=len(df_city), store_dir=store_dir,
+                                        watermark=str(df_city['date'].max().date()), backend=self.backend,
+                                        features=self.features)
+                ms.prune(self.city, self.fingerprint, store_dir=store_dir)
+                print(f"Saved {self.city} models to {path}")
+                self.models['meta'] = ms.artifact_meta(self.city, self.fingerprint, store_dir=store_dir, features=self.features,
+                                                       backend=self.backend)
+            except Exception as e:
+                print(f"Could not save {self.city} models to store: {e}")
+            if shared_weights:
+                # swap the freshly fitted forests for the shared memory-mapped copy
+                stored = ms.load_artifact(self.city, self.fingerprint, store_dir=store_dir, estimators=False,
+                                          features=self.features, backend=self.backend)
+                if stored is not None:
+                    self.models = stored
+
+        self.setup_serving(grid)
+
         # ---------------------------
         # Prediction function
         # ---------------------------
     def clip_1_10(self, x):
         return float(max(1.0, min(10.0, x)))
 
-    def predict_feelings(self, forecast_temp = 0, forecast_aqi = 0):
-        inp = np.array([[float(forecast_temp), float(forecast_aqi)]])
+    def setup_serving(self, grid=None):
+        """Prepare the inference engine and, if requested, the lookup grid (True or prediction_grid kwargs)."""
+        self.compile_engine()
+        self.serial = next(_SERIALS)
+        self.grid_options = grid
+        self.grid = None
+        if grid and self.rolling:
+            # a (temp, aqi) table cannot hold the other features
+            print(f"{self.city} - rolling features: serving without a prediction grid")
+        elif grid:
+            self.grid = pg.prediction_grid(self, **(grid if isinstance(grid, dict) else {}))
+            print(f"{self.city} - prediction grid {len(self.grid.temps)}x{len(self.grid.aqis)} ready")
+
+    def version(self):
+        """Which stored artifact these models come from ('<fingerprint[:16]>@<created>'), or 'unsaved'."""
+        meta = self.models.get('meta')
+        return ms.artifact_version(meta) if meta else 'unsaved'
+
+    @classmethod
+    def from_models(cls, city, models, backend=None, features=None, engine='auto'):
+        """
+        Serve already-fitted target models ({'weather': est, 'air_quality': est}) without the store or training,
+        e.g. to time candidate models on the serving path (model_families.measure, model_backends.tune).
+        """
+        self = cls.__new__(cls)
+        self.city = city
+        self.backend = _backend(city, backend or ms.DEFAULT_BACKEND)
+        self.features = rf.feature_columns(features or ms.FEATURES)
+        self.rolling = self.features != ms.FEATURES
+        self.engine = engine
+        self.shared_weights = False
+        self.source = _source(None)
+        self.fingerprint = None
+        self.flat = {}
+        self.grid = None
+        self.models = dict(models)
+        self.setup_serving()
+        return self
+
+    def with_models(self, models):
+        """A new model object for this city serving `models`; this one is left untouched (swap the reference to switch)."""
+        new = copy.copy(self)
+        new.models = models
+        new.setup_serving(self.grid_options)
+        return new
+
+    def compile_engine(self):
+        """Flatten the fitted forests for the array-based engine, reusing flat arrays from the store if present."""
+        stored = self.models.pop('flat', None)
+        if self.engine == 'sklearn':
+            self.flat = {}
+        else:
+            self.flat = stored if stored else fe.compile_models(self.models)
+
+    def memory_bytes(self):
+        """Approximate RAM held by this city's models, flat arrays and grid tables."""
+        total = 0
+        for key in ('weather', 'air_quality'):
+            est = self.models.get(key)
+            if est is not None:
+                total += mb.estimator_bytes(est)
+        for flat in self.flat.values():
+            total += sum(getattr(flat, name).nbytes for name in fe.ARRAYS)
+        if self.grid is not None:
+            total += sum(t.nbytes for t in self.grid.tables.values())
+        return total
+
+    def has_model(self, key):
+        return self.models.get(key) is not None or key in self.flat
+
+    def predict_raw(self, key, inp):
+        """
+        Unclipped predictions of one forest ('weather' or 'air_quality') for rows of inp, or None.
+        (temp, aqi) rows given to a rolling-feature model are scored as a steady day (rolling_features.neutral).
+        """
+        if self.rolling and np.shape(inp)[1] < len(self.features):
+            inp = rf.neutral(inp, self.features)
+        est = self.models.get(key)
+        flat = self.flat.get(key)
+        if flat is not None and (est is None or self.engine == 'flat' or len(inp) <= FLAT_MAX_BATCH):
+            return flat.predict(inp)
+        return est.predict(inp) if est is not None else None
+
+    def predict_feelings(self, forecast_temp = 0, forecast_aqi = 0, extra=None):
+        """Clipped predictions for one reading; extra holds the rolling features ({name: value}) if the model uses them."""
+        if self.grid is not None and extra is None:
+            hit = self.grid.lookup(forecast_temp, forecast_aqi)
+            if hit is not None:
+                return {'weather_satisfaction': hit.get('weather_satisfaction'),
+                        'air_quality_satisfaction': hit.get('air_quality_satisfaction')}
+        if self.rolling and extra is not None:
+            row = dict(extra, temp=forecast_temp, aqi=forecast_aqi)
+            inp = np.array([[float(row[c]) for c in self.features]])
+        else:
+            inp = np.array([[float(forecast_temp), float(forecast_aqi)]])
         out = {}
-        modelW = self.models.get('weather')
-        out['weather_satisfaction'] = self.clip_1_10(modelW.predict(inp)[0]) if modelW is not None else None
+        predW = self.predict_raw('weather', inp)
+        out['weather_satisfaction'] = self.clip_1_10(predW[0]) if predW is not None else None
+
+        predA = self.predict_raw('air_quality', inp)
+        out['air_quality_satisfaction'] = self.clip_1_10(predA[0]) if predA is not None else None
+        return out
 
-        modelA = self.models.get('air_quality')
-        out['air_quality_satisfaction'] = self.clip_1_10(modelA.predict(inp)[0]) if modelA is not None else None
+    def predict_batch(self, temps, aqis):
+        """Score arrays of (temp, aqi) readings with one predict call per forest; returns clipped arrays."""
+        t, a = np.broadcast_arrays(np.asarray(temps, dtype=float).ravel(), np.asarray(aqis, dtype=float).ravel())
+        inp = np.column_stack([t, a])
+        hits, inside = self.grid.lookup_batch(t, a) if self.grid is not None else ({}, None)
+        out = {}
+        for key, name in (('weather', 'weather_satisfaction'), ('air_quality', 'air_quality_satisfaction')):
+            if not self.has_model(key):
+                out[name] = None
+            elif len(inp) == 0:
+                out[name] = np.empty(0)
+            elif name in hits:
+                # grid answers inside its range, the forest fills in the rest
+                vals = hits[name]
+                if not inside.all():
+                    vals[~inside] = np.clip(self.predict_raw(key, inp[~inside]), 1.0, 10.0)
+                out[name] = vals
+            else:
+                out[name] = np.clip(self.predict_raw(key, inp), 1.0, 10.0)
         return out
 
     def runExample(self):
@@ -175,9 +426,9 @@ class model():
             print(self.predict_feelings(forecast_temp=1.0, forecast_aqi=1.0))
         except Exception as e:
             print(f"Prediction error for {self.city}: {e}")
-    def run(self, forecast_temp, forecast_aqi):
+    def run(self, forecast_temp, forecast_aqi, extra=None):
         try:
-            return {self.city: self.predict_feelings(forecast_temp = forecast_temp, forecast_aqi=forecast_aqi)}
+            return {self.city: self.predict_feelings(forecast_temp = forecast_temp, forecast_aqi=forecast_aqi, extra=extra)}
         except Exception as e:
             print(f"Prediction error for {self.city}: {e}")
 '''
@@ -200,3 +451,8 @@ print(df)
 df.to_csv("M:/Arbeit/Schule/internship/python/tests/forest_model_testA.csv")
 '''
 
+
+if __name__ == "__main__":
+    # Offline training: refit every city of the registry and refresh its stored artifact
+    for city in cr.load_registry():
+        model(city, retrain=True)
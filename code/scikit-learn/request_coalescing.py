@@ -0,0 +1,178 @@
+# Micro-batching of concurrent single predictions for the same city model.
+#
+#   COALESCE_WINDOW_MS=2 COALESCE_MAX_BATCH=32 gunicorn flask_post_data2:app ...   # on in the servers
+#   python request_coalescing.py Lahore                                             # trade-off curve
+#   python request_coalescing.py Lahore --threads 1 8 32 --windows 0 0.5 2 5 --out coalescing.json
+#
+# The first request for a model opens a batch and waits up to window_ms for others; every request
+# for the same model arriving meanwhile joins it. The batch closes when the window ends or it reaches
+# max_batch, and the opener scores it with one model.predict_batch call (one vectorized predict per
+# forest); each waiting caller then takes its own row. There is no extra thread: the first caller
+# does the work, so a lone request pays at most window_ms on top of its prediction.
+# Models with a prediction grid are not coalesced (a grid lookup is already cheaper than a batch).
+import argparse
+import json
+import logging
+import os
+import threading
+import time
+
+import numpy as np
+
+
+class _batch():
+    __slots__ = ('temps', 'aqis', 'full', 'done', 'result', 'error')
+
+    def __init__(self):
+        self.temps = []
+        self.aqis = []
+        self.full = threading.Event()   # set when max_batch is reached, so the opener need not wait out the window
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class coalescer():
+    def __init__(self, window_ms=2.0, max_batch=32):
+        self.window = max(0.0, float(window_ms)) / 1e3
+        self.max_batch = max(1, int(max_batch))
+        self.enabled = self.window > 0 and self.max_batch > 1
+        self.stats = {'requests': 0, 'batches': 0, 'full_batches': 0, 'largest_batch': 0, 'errors': 0}
+        self._open = {}   # id(model) -> batch still accepting requests
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls):
+        """COALESCE_WINDOW_MS (0, the default, turns coalescing off) and COALESCE_MAX_BATCH."""
+        return cls(window_ms=float(os.environ.get("COALESCE_WINDOW_MS", "0")),
+                   max_batch=int(os.environ.get("COALESCE_MAX_BATCH", "32")))
+
+    def predict(self, model, temp, aqi):
+        """model.predict_feelings(temp, aqi), scored together with concurrent calls for the same model."""
+        if not self.enabled or getattr(model, 'grid', None) is not None:
+            return model.predict_feelings(temp, aqi)
+        key = id(model)
+        with self._lock:
+            self.stats['requests'] += 1
+            batch = self._open.get(key)
+            opener = batch is None
+            if opener:
+                batch = self._open[key] = _batch()
+            row = len(batch.temps)
+            batch.temps.append(float(temp))
+            batch.aqis.append(float(aqi))
+            if len(batch.temps) >= self.max_batch:
+                del self._open[key]   # later requests open the next batch
+                batch.full.set()
+
+        if opener:
+            full = batch.full.wait(self.window)
+            with self._lock:
+                if self._open.get(key) is batch:
+                    del self._open[key]
+                self.stats['batches'] += 1
+                self.stats['full_batches'] += full
+                self.stats['largest_batch'] = max(self.stats['largest_batch'], len(batch.temps))
+            try:
+                batch.result = model.predict_batch(batch.temps, batch.aqis)
+            except Exception as e:
+                batch.error = e
+                with self._lock:
+                    self.stats['errors'] += 1
+            finally:
+                batch.done.set()
+        else:
+            batch.done.wait()
+
+        if batch.error is not None:
+            raise batch.error
+        return {name: (float(values[row]) if values is not None else None) for name, values in batch.result.items()}
+
+    def run(self, model, temp, aqi):
+        """Coalesced counterpart of model.run: {city: predictions}, or None if the prediction failed."""
+        try:
+            return {model.city: self.predict(model, temp, aqi)}
+        except Exception as e:
+            logging.error(f"Prediction error for {model.city}: {e}")
+
+    def status(self):
+        with self._lock:
+            out = dict(self.stats, enabled=self.enabled, window_ms=self.window * 1e3, max_batch=self.max_batch)
+        out['mean_batch'] = round(out['requests'] / out['batches'], 2) if out['batches'] else None
+        return out
+
+
+# ---------------------------
+# Trade-off benchmark: throughput and latency against window size under concurrent load
+# ---------------------------
+def _load(m, c, threads, per_thread, seed=0):
+    """Run `threads` callers doing `per_thread` predictions each; returns (wall seconds, latencies, results)."""
+    rng = np.random.default_rng(seed)
+    inputs = [list(zip(rng.uniform(-5, 50, per_thread).tolist(), rng.uniform(1, 400, per_thread).tolist()))
+              for _ in range(threads)]
+    lat = [[] for _ in range(threads)]
+    results = [[] for _ in range(threads)]
+    start_gate = threading.Barrier(threads + 1)
+
+    def caller(i):
+        start_gate.wait()
+        for temp, aqi in inputs[i]:
+            start = time.perf_counter()
+            results[i].append(c.predict(m, temp, aqi))
+            lat[i].append(time.perf_counter() - start)
+
+    workers = [threading.Thread(target=caller, args=(i,)) for i in range(threads)]
+    for w in workers:
+        w.start()
+    start_gate.wait()
+    wall = time.perf_counter()
+    for w in workers:
+        w.join()
+    wall = time.perf_counter() - wall
+    return wall, np.concatenate([np.array(x) for x in lat]), inputs, results
+
+
+def benchmark(m, threads=(1, 4, 16, 64), windows=(0, 0.5, 1, 2, 5), max_batch=32, requests=2000):
+    """
+    Predictions per second and p50/p99 latency for each (concurrent callers, window) pair on model m
+    (window 0: every call runs its own predict). Raises if a coalesced answer differs from predict_feelings.
+    """
+    rows = []
+    for n in threads:
+        per_thread = max(1, requests // n)
+        for window in windows:
+            c = coalescer(window, max_batch)
+            c.predict(m, 20.0, 100.0)   # warm-up
+            wall, lat, inputs, results = _load(m, c, n, per_thread)
+            st = c.status()
+            for (temp, aqi), got in zip(inputs[0][:50], results[0][:50]):
+                want = m.predict_feelings(temp, aqi)
+                if any(abs(got[k] - want[k]) > 1e-9 for k in want if want[k] is not None):
+                    raise AssertionError(f"coalesced prediction differs for ({temp}, {aqi}): {got} != {want}")
+            rows.append({'threads': n, 'window_ms': window, 'predictions_per_s': round(n * per_thread / wall, 1),
+                         'p50_ms': round(float(np.percentile(lat, 50)) * 1e3, 3),
+                         'p99_ms': round(float(np.percentile(lat, 99)) * 1e3, 3),
+                         'mean_batch': st['mean_batch'] if c.enabled else 1.0})
+    return rows
+
+
+if __name__ == "__main__":
+    import random_forest_model as rfm
+
+    parser = argparse.ArgumentParser(description="Throughput/latency trade-off of request coalescing")
+    parser.add_argument("city")
+    parser.add_argument("--threads", nargs="+", type=int, default=[1, 4, 16, 64], help="concurrent callers")
+    parser.add_argument("--windows", nargs="+", type=float, default=[0, 0.5, 1, 2, 5], help="coalescing windows (ms)")
+    parser.add_argument("--max-batch", type=int, default=32)
+    parser.add_argument("--requests", type=int, default=2000, help="predictions per (threads, window) run")
+    parser.add_argument("--out", default=None, help="also write the rows as JSON")
+    args = parser.parse_args()
+
+    rows = benchmark(rfm.model(args.city), args.threads, args.windows, args.max_batch, args.requests)
+    print(f"{'threads':>7} {'window ms':>9} {'pred/s':>10} {'p50 ms':>8} {'p99 ms':>8} {'batch':>6}")
+    for r in rows:
+        print(f"{r['threads']:>7} {r['window_ms']:>9g} {r['predictions_per_s']:>10,.0f} {r['p50_ms']:>8.3f} "
+              f"{r['p99_ms']:>8.3f} {r['mean_batch']:>6}")
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(rows, f, indent=2)
@@ -0,0 +1,340 @@
+# Rolling (time-windowed) model features: the same definitions computed two ways.
+#
+#   python rolling_features.py Lahore --parity      # incremental updater == vectorized training features, exactly
+#   python rolling_features.py Lahore --evaluate    # cross-validated R^2 of the base and the rolling feature set
+#   MODEL_FEATURES=rolling python random_forest_model.py ...    # train and serve with them
+#
+# Features of a day d (besides the averaged temp and aqi the model always gets):
+#   temp_min, temp_max   lowest / highest temperature reading of day d
+#   aqi_mean_3d          mean of the daily AQI of days d-2..d (fewer at the start of the series)
+#   aqi_mean_7d          mean of the daily AQI of days d-6..d
+#   aqi_trend            aqi_mean_3d - aqi_mean_7d (positive when the air is getting worse)
+# The daily AQI is the mean of the day's readings; a day without readings repeats the previous day's.
+#
+# Training (daily_features, called by random_forest_model.prepare_frames) computes them over whole arrays:
+# groupby for the extremes, and for the means the window sums added oldest day first as shifted arrays.
+# Serving (rolling_state) keeps the running min/max of the current day, the running sum/count of its AQI
+# and the daily AQI of the previous six days, so each reading is O(1) and a prediction never scans history.
+# Both add the same numbers in the same order, so for the same readings the features are bitwise equal
+# (checked by --parity on a city's training data). At serving time "day d" is the day so far.
+# Limits of the serving side:
+#   - the state lives in each server process: with several gunicorn workers each one sees only the requests
+#     it answers, so workers can compute different features (serve rolling models with WEB_CONCURRENCY=1);
+#   - a day without posted AQI repeats the previous day's, while training interpolates the AQI file between
+#     its rows (random_forest_model.daily_aqi); the two agree as long as AQI is posted every day.
+import argparse
+import math
+import os
+import threading
+import time
+from collections import deque
+from datetime import datetime, timezone
+
+import numpy as np
+import pandas as pd
+
+import model_store as ms
+
+WINDOWS = {'aqi_mean_3d': 3, 'aqi_mean_7d': 7}
+ROLLING = ['temp_min', 'temp_max', 'aqi_mean_3d', 'aqi_mean_7d', 'aqi_trend']
+FEATURE_SETS = {'base': list(ms.FEATURES), 'rolling': list(ms.FEATURES) + ROLLING}
+DEFAULT_FEATURE_SET = os.environ.get("MODEL_FEATURES", "base")
+_HISTORY = max(WINDOWS.values()) - 1   # previous days kept by rolling_state
+
+
+def feature_columns(features=None):
+    """Model input columns for a feature set name (default MODEL_FEATURES) or an explicit list."""
+    features = features or DEFAULT_FEATURE_SET
+    if isinstance(features, str):
+        if features not in FEATURE_SETS:
+            raise ValueError(f"Unknown feature set '{features}', expected one of {sorted(FEATURE_SETS)}")
+        return list(FEATURE_SETS[features])
+    return list(features)
+
+
+# ---------------------------
+# Training: vectorized over the whole series
+# ---------------------------
+def trailing_mean(values, window):
+    """Mean of each value and the window-1 values before it, NaNs skipped; sums run oldest first."""
+    values = np.asarray(values, dtype=float)
+    n = len(values)
+    total = np.zeros(n)
+    count = np.zeros(n, dtype=int)
+    for lag in range(window - 1, -1, -1):
+        shifted = np.full(n, np.nan)
+        shifted[lag:] = values[:n - lag]
+        ok = ~np.isnan(shifted)
+        total = total + np.where(ok, shifted, 0.0)
+        count += ok
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.where(count > 0, total / count, np.nan)
+
+
+def daily_features(weather, aqi_daily):
+    """
+    Rolling features per day from raw weather readings (frame with a day-normalized 'date' and 'temp')
+    and the daily AQI (frame with 'date' and 'aqi'). Returns a frame with 'date' and ROLLING.
+    Sources that only have daily aggregates (influx_source.py) pass the extremes as 'temp_min' / 'temp_max'.
+    """
+    days = weather.groupby('date')
+    extremes = pd.DataFrame({'temp_min': days['temp_min' if 'temp_min' in weather.columns else 'temp'].min(),
+                             'temp_max': days['temp_max' if 'temp_max' in weather.columns else 'temp'].max()})
+    aqi = pd.Series(dtype=float)
+    if not aqi_daily.empty:
+        aqi = pd.to_numeric(aqi_daily.set_index('date')['aqi'], errors='coerce').sort_index()
+        aqi = aqi[~aqi.index.duplicated(keep='last')]
+        # one value per calendar day; a day without one repeats the previous day's (as rolling_state does)
+        aqi = aqi.reindex(pd.date_range(aqi.index.min(), aqi.index.max(), freq='D')).ffill()
+    means = {name: trailing_mean(aqi.to_numpy(), window) for name, window in WINDOWS.items()}
+    rolling = pd.DataFrame(dict(means, aqi_trend=means['aqi_mean_3d'] - means['aqi_mean_7d']), index=aqi.index)
+    out = extremes.join(rolling, how='outer')
+    out.index.name = 'date'
+    return out.reset_index()[['date'] + ROLLING]
+
+
+def neutral(inp, columns):
+    """
+    Expand (temp, aqi) rows to the given feature columns for callers without history (batch scoring, the
+    prediction grid, warm-up): a steady day, i.e. extremes equal to temp, AQI means equal to aqi, no trend.
+    """
+    inp = np.asarray(inp, dtype=float)
+    source = {'temp': inp[:, 0], 'aqi': inp[:, 1], 'temp_min': inp[:, 0], 'temp_max': inp[:, 0],
+              'aqi_mean_3d': inp[:, 1], 'aqi_mean_7d': inp[:, 1], 'aqi_trend': np.zeros(len(inp))}
+    return np.column_stack([source[c] for c in columns])
+
+
+# ---------------------------
+# Serving: O(1) per reading
+# ---------------------------
+def epoch_day(t=None):
+    """UTC day number (days since 1970-01-01) of an ISO timestamp, epoch seconds/ms, datetime or None (now)."""
+    if t is None:
+        return int(time.time() // 86400)
+    if isinstance(t, str):
+        t = datetime.fromisoformat(t.replace("Z", "+00:00"))
+    if isinstance(t, datetime):
+        if t.tzinfo is None:
+            t = t.replace(tzinfo=timezone.utc)
+        return int(t.timestamp() // 86400)
+    t = float(t)
+    return int((t / 1000 if t > 1e11 else t) // 86400)
+
+
+def _mean(previous, today):
+    total, n = 0.0, 0
+    for v in previous:
+        total += v
+        n += 1
+    total += today
+    return total / (n + 1)
+
+
+class rolling_state():
+    """Rolling features of one city from the readings seen so far (see the top of this file)."""
+
+    def __init__(self):
+        self.temp_day = None
+        self.temp_min = self.temp_max = None
+        self.aqi_day = None
+        self.aqi_sum = 0.0
+        self.aqi_count = 0
+        self.previous = deque(maxlen=_HISTORY)   # daily AQI of the days before aqi_day, oldest first
+        self.stats = {'readings': 0, 'skipped': 0}
+
+    def add_temp(self, day, value):
+        if self.temp_day is None or day > self.temp_day:
+            self.temp_day, self.temp_min, self.temp_max = day, value, value
+        elif day == self.temp_day:
+            self.temp_min = min(self.temp_min, value)
+            self.temp_max = max(self.temp_max, value)
+        else:
+            self.stats['skipped'] += 1
+            return
+        self.stats['readings'] += 1
+
+    def add_aqi(self, day, value):
+        if self.aqi_day is not None and day < self.aqi_day:
+            self.stats['skipped'] += 1
+            return
+        if self.aqi_day is not None and day > self.aqi_day:
+            self.previous.extend(self._gap(day))
+            self.aqi_sum, self.aqi_count = 0.0, 0
+        self.aqi_day = day
+        self.aqi_sum += value
+        self.aqi_count += 1
+        self.stats['readings'] += 1
+
+    def _gap(self, day):
+        """Daily AQI values that day's window adds after self.previous: aqi_day's mean, repeated over empty days."""
+        if self.aqi_day is None or not self.aqi_count or day <= self.aqi_day:
+            return []
+        return [self.aqi_sum / self.aqi_count] * min(day - self.aqi_day, _HISTORY)
+
+    def day(self):
+        """The latest day with a reading (today if there is none)."""
+        days = [d for d in (self.temp_day, self.aqi_day) if d is not None]
+        return max(days) if days else epoch_day()
+
+    def features(self, day=None, temp=None, aqi=None):
+        """
+        ROLLING features for `day` (default: the latest day with a reading). temp / aqi stand in for a
+        day without readings of their own: extremes equal to temp, today's AQI equal to aqi.
+        """
+        day = self.day() if day is None else day
+        if self.temp_day == day:
+            t_min, t_max = self.temp_min, self.temp_max
+        else:
+            t_min = t_max = (np.nan if temp is None else float(temp))
+        if self.aqi_day == day and self.aqi_count:
+            previous, today = list(self.previous), self.aqi_sum / self.aqi_count
+        else:
+            previous = (list(self.previous) + self._gap(day))[-_HISTORY:]
+            today = np.nan if aqi is None else float(aqi)
+        if today != today:   # no AQI at all: nothing to average
+            means = {name: np.nan for name in WINDOWS}
+        else:
+            means = {name: _mean(previous[-(w - 1):] if w > 1 else [], today) for name, w in WINDOWS.items()}
+        return dict(temp_min=t_min, temp_max=t_max, **means, aqi_trend=means['aqi_mean_3d'] - means['aqi_mean_7d'])
+
+
+class rolling_states():
+    """rolling_state per city for the servers; readings are deduplicated by time across requests."""
+
+    def __init__(self):
+        self._states = {}
+        self._last = {}   # (city, series) -> time of the newest reading taken
+        self._lock = threading.Lock()
+
+    def update(self, city, temps=(), aqis=(), temp=None, aqi=None):
+        """
+        Add (time, value) readings of a request and return the city's features for its latest day (temp / aqi
+        as in rolling_state.features). Node-RED posts overlapping windows of the same series, so readings not
+        newer than the last one taken are skipped; readings without a time count as now and are always taken.
+        """
+        # every time is checked before any reading is taken (ValueError for a malformed one)
+        parsed = [[(None if t is None else _reading_time(t), value) for t, value in readings] for readings in (temps, aqis)]
+        with self._lock:
+            state = self._states.setdefault(city, rolling_state())
+            for series, readings, add in zip(('temp', 'aqi'), parsed, (state.add_temp, state.add_aqi)):
+                last = self._last.get((city, series))
+                for when, value in readings:
+                    if value is None or value != value:
+                        continue
+                    if when is not None:
+                        key, day = when
+                        if last is not None and key <= last:
+                            continue
+                        last = key
+                    else:
+                        day = epoch_day()
+                    add(day, float(value))
+                self._last[(city, series)] = last
+            return state.features(None, temp, aqi)
+
+    def status(self):
+        with self._lock:
+            return {city: dict(s.stats, day=str(np.datetime64(s.day(), 'D'))) for city, s in self._states.items()}
+
+
+def _sort_key(t):
+    if isinstance(t, str):
+        t = datetime.fromisoformat(t.replace("Z", "+00:00"))
+    if isinstance(t, datetime):
+        return (t if t.tzinfo else t.replace(tzinfo=timezone.utc)).timestamp()
+    t = float(t)
+    return t / 1000 if t > 1e11 else t
+
+
+def _reading_time(t):
+    """(epoch seconds, UTC day number) of a reading's time; ValueError if it is not an ISO time or epoch number."""
+    try:
+        key = _sort_key(t)
+        if not math.isfinite(key):
+            raise ValueError
+    except (TypeError, ValueError, OverflowError):
+        raise ValueError(f"invalid reading time {t!r}") from None
+    return key, int(key // 86400)
+
+
+# ---------------------------
+# Checks on a city's training data
+# ---------------------------
+def _city_sources(city):
+    """A city's weather readings (date, temp and the reading's time) and daily AQI, as prepare_frames sees them."""
+    import random_forest_model as rfm
+
+    files = rfm.CITIES_FILES[city]
+    raw = pd.read_csv(files['weather'], parse_dates=['date'])
+    raw['time'] = pd.to_datetime(raw['date'], errors='coerce')
+    weather = rfm.to_date_only(raw, 'date')
+    aqi_daily = rfm.daily_aqi(rfm.to_date_only(pd.read_csv(files['aqi'], parse_dates=['date']), 'date'), files['aqi'])
+    return weather, aqi_daily
+
+
+def parity(city):
+    """Feed a city's readings day by day through rolling_state and compare with daily_features; returns days checked."""
+    weather, aqi_daily = _city_sources(city)
+    expected = daily_features(weather[['date', 'temp']], aqi_daily).set_index('date')
+    temps = weather.groupby('date')
+    aqis = aqi_daily.set_index('date')['aqi']
+    state = rolling_state()
+    got = []
+    for day in expected.index:
+        if day in temps.groups:
+            for t, v in zip(temps.get_group(day)['time'], temps.get_group(day)['temp']):
+                if v == v:
+                    state.add_temp(epoch_day(t.to_pydatetime()), float(v))
+        if day in aqis.index and aqis[day] == aqis[day]:
+            state.add_aqi(epoch_day(day.to_pydatetime()), float(aqis[day]))
+        f = state.features(epoch_day(day.to_pydatetime()))
+        got.append([f[c] for c in ROLLING])
+    got = np.array(got, dtype=float)
+    want = expected[ROLLING].to_numpy(dtype=float)
+    bad = ~((got == want) | (np.isnan(got) & np.isnan(want)))
+    if bad.any():
+        i, j = np.argwhere(bad)[0]
+        raise AssertionError(f"{city}: {ROLLING[j]} on {expected.index[i].date()} is {got[i, j]!r} incrementally, "
+                             f"{want[i, j]!r} vectorized ({int(bad.any(axis=1).sum())} days differ)")
+    return len(expected)
+
+
+def evaluate(city, splits=5):
+    """TimeSeriesSplit R^2 of the default forest on the base and the rolling feature set."""
+    from sklearn.metrics import r2_score
+    from sklearn.model_selection import TimeSeriesSplit
+
+    import model_backends as mb
+    import random_forest_model as rfm
+
+    df = rfm.prepare_training_data(city, rfm.source_fingerprint(city)).dropna(subset=list(ms.TARGETS.values()))
+    df = df.sort_values('date', kind='stable')
+    out = {}
+    for name, columns in FEATURE_SETS.items():
+        X = df[columns].to_numpy()
+        scores = {}
+        for key, col in ms.TARGETS.items():
+            y = df[col].to_numpy()
+            folds = [r2_score(y[test], np.clip(mb.make('forest').fit(X[train], y[train]).predict(X[test]), 1.0, 10.0))
+                     for train, test in TimeSeriesSplit(n_splits=splits).split(X)]
+            scores[key] = round(float(np.mean(folds)), 4)
+        out[name] = scores
+    return out
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Check and evaluate the rolling features of a city")
+    parser.add_argument("cities", nargs="+")
+    parser.add_argument("--parity", action="store_true", help="incremental vs vectorized features on the training data")
+    parser.add_argument("--evaluate", action="store_true", help="cross-validated R^2 with and without rolling features")
+    parser.add_argument("--splits", type=int, default=5)
+    args = parser.parse_args()
+
+    for city in args.cities:
+        if args.parity or not args.evaluate:
+            start = time.perf_counter()
+            n = parity(city)
+            print(f"{city}: rolling features identical on {n} days ({time.perf_counter() - start:.1f}s)")
+        if args.evaluate:
+            for name, scores in evaluate(city, args.splits).items():
+                print(f"{city} {name:<8} cv R^2 weather={scores['weather']:.3f}  air quality={scores['air_quality']:.3f}")
@@ -0,0 +1,376 @@
+import bisect
+import math
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from pathlib import Path
+
+# ---------------------------
+# Prometheus-style metrics and an on-demand sampling profiler for the prediction servers
+# ---------------------------
+# Counters and histograms live in this process and are rendered in the Prometheus text format by
+# /metrics; values that already exist elsewhere (model versions, sender counters) are read when
+# scraped through collectors instead of being counted twice. Every pre-forked worker (gunicorn) has
+# its own registry, so with several workers each scrape sees one worker's numbers; the pid label of
+# ess_process_start_time_seconds tells them apart.
+# METRICS=0 turns stage timing and request counting off (/metrics then only shows the collectors).
+
+ENABLED = os.environ.get("METRICS", "1") != "0"
+NAMESPACE = "ess"
+# seconds; the fast stages take microseconds, a cold model load or a slow Node-RED takes seconds
+LATENCY_BUCKETS = (0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25,
+                   0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names, values, extra=""):
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _number(v):
+    if v == float("inf"):
+        return "+Inf"
+    return repr(float(v)) if isinstance(v, float) else str(v)
+
+
+class counter():
+    def __init__(self, name, help, labels=()):
+        self.name, self.help, self.label_names = name, help, tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labels, n=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + n
+
+    def value(self, *labels):
+        return self._values.get(labels, 0)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            items = sorted(self._values.items())
+        lines += [f"{self.name}{_labels(self.label_names, k)} {_number(v)}" for k, v in items]
+        return lines
+
+
+class _timer():
+    __slots__ = ('hist', 'labels', 'start')
+
+    def __init__(self, hist, labels):
+        self.hist, self.labels = hist, labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.hist.observe(time.perf_counter() - self.start, *self.labels)
+        return False
+
+
+class _no_timer():
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NO_TIMER = _no_timer()
+
+
+class histogram():
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        self.name, self.help, self.label_names = name, help, tuple(labels)
+        self.buckets = tuple(sorted(buckets))
+        self._series = {}   # labels -> [per-bucket counts (+Inf last), sum]
+        self._lock = threading.Lock()
+
+    def observe(self, value, *labels):
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][i] += 1
+            series[1] += value
+
+    def time(self, *labels):
+        """Context manager observing the seconds spent in its block."""
+        return _timer(self, labels) if ENABLED else _NO_TIMER
+
+    def count(self, *labels):
+        series = self._series.get(labels)
+        return sum(series[0]) if series else 0
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            items = sorted((k, (list(s[0]), s[1])) for k, s in self._series.items())
+        for labels, (counts, total) in items:
+            cumulative = 0
+            for bound, n in zip(self.buckets + (float("inf"),), counts):
+                cumulative += n
+                le = 'le="%s"' % _number(bound)
+                lines.append(f"{self.name}_bucket{_labels(self.label_names, labels, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.label_names, labels)} {_number(total)}")
+            lines.append(f"{self.name}_count{_labels(self.label_names, labels)} {cumulative}")
+        return lines
+
+
+class registry():
+    """Named metrics plus collectors: callables returning (name, type, help, [(labels dict, value), ...]) tuples."""
+
+    def __init__(self):
+        self.metrics = []
+        self.collectors = []
+
+    def counter(self, name, help, labels=()):
+        self.metrics.append(counter(f"{NAMESPACE}_{name}", help, labels))
+        return self.metrics[-1]
+
+    def histogram(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        self.metrics.append(histogram(f"{NAMESPACE}_{name}", help, labels, buckets))
+        return self.metrics[-1]
+
+    def add_collector(self, fn):
+        self.collectors.append(fn)
+        return fn
+
+    def render(self):
+        """All metrics in the Prometheus text exposition format (version 0.0.4)."""
+        lines = []
+        for metric in self.metrics:
+            lines += metric.render()
+        for fn in self.collectors:
+            for name, kind, help, samples in fn():
+                name = f"{NAMESPACE}_{name}"
+                lines += [f"# HELP {name} {help}", f"# TYPE {name} {kind}"]
+                for labels, value in samples:
+                    lines.append(f"{name}{_labels(labels.keys(), labels.values())} {_number(value)}")
+        return "\n".join(lines) + "\n"
+
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+metrics = registry()
+REQUESTS = metrics.counter("requests_total", "HTTP requests by endpoint, city and status code.",
+                           ("endpoint", "city", "status"))
+REQUEST_SECONDS = metrics.histogram("request_seconds", "Time spent handling a request, by endpoint.", ("endpoint",))
+STAGE_SECONDS = metrics.histogram(
+    "postdata_stage_seconds",
+    "Time spent in each stage of /postData: parse, aggregate, predict, diagnostics, deliver, respond.", ("stage",))
+OUTBOUND = metrics.counter("outbound_requests_total",
+                           "POSTs to Node-RED / InfluxDB by outcome (ok, status_<code>, error); retries count again.",
+                           ("target", "outcome"))
+OUTBOUND_SECONDS = metrics.histogram("outbound_request_seconds", "Duration of one outbound POST.", ("target",))
+_STARTED = time.time()
+
+
+def stage(name):
+    """Time a /postData stage: `with service_metrics.stage('predict'): ...`."""
+    return STAGE_SECONDS.time(name)
+
+
+def city_label(city, models):
+    """The city as a label value; names that are not configured cities are folded into 'unknown'."""
+    return city if isinstance(city, str) and city in models else "unknown"
+
+
+def count_request(endpoint, city, status, seconds):
+    if ENABLED:
+        REQUESTS.inc(endpoint, city, str(status))
+        REQUEST_SECONDS.observe(seconds, endpoint)
+
+
+def outbound(target, outcome, seconds=None):
+    """Record one outbound POST attempt (node_red_sender / influx_writer)."""
+    if ENABLED:
+        OUTBOUND.inc(target, outcome)
+        if seconds is not None:
+            OUTBOUND_SECONDS.observe(seconds, target)
+
+
+# ---------------------------
+# Collectors for state kept by other objects
+# ---------------------------
+def process_collector():
+    yield ("process_start_time_seconds", "gauge", "Start time of this server process (unix seconds).",
+           [({'pid': os.getpid()}, _STARTED)])
+
+
+def model_collector(models):
+    """Model versions served per city (prediction_service.model_cache) and the cache counters."""
+    def collect():
+        status = models.status()
+        versions = status['versions']
+        yield ("model_info", "gauge", "Stored model version served per city (always 1).",
+               [({'city': c, 'version': v['version'] or 'unsaved', 'backend': v.get('backend') or ''}, 1)
+                for c, v in sorted(versions.items())])
+        yield ("model_generation", "gauge", "Times a city's model was (re)loaded and swapped in.",
+               [({'city': c}, v['generation']) for c, v in sorted(versions.items())])
+        yield ("models_loaded", "gauge", "City models held in memory.", [({}, len(status['loaded']))])
+        yield ("model_memory_bytes", "gauge", "Approximate memory of the loaded models.",
+               [({}, int(status['memory_mb'] * 1024 * 1024))])
+        yield ("model_cache_events_total", "counter", "Model cache loads, hits, evictions, reloads and reload errors.",
+               [({'event': k}, status[k]) for k in ('loads', 'hits', 'evictions', 'reloads', 'reload_errors')])
+    return collect
+
+
+def sender_collector(senders):
+    """Queue counters of the background senders: {target: sender or None}."""
+    def collect():
+        live = {t: s.status() for t, s in senders.items() if s is not None}
+        yield ("outbound_results_total", "counter",
+               "Results handed to a background sender, by what became of them (queued, dropped, sent, failed).",
+               [({'target': t, 'result': k}, st[k]) for t, st in live.items()
+                for k in ('queued', 'dropped', 'sent', 'failed') if k in st])
+        yield ("outbound_pending", "gauge", "Results waiting in a sender's queue.",
+               [({'target': t}, st.get('pending', 0)) for t, st in live.items()])
+    return collect
+
+
+def cache_collector(cache):
+    """Hit/miss counters of the /postData prediction cache (prediction_cache.py)."""
+    def collect():
+        st = cache.status()
+        yield ("prediction_cache_events_total", "counter",
+               "Prediction cache hits, misses, expired and invalidated entries, evictions.",
+               [({'event': k}, st[k]) for k in ('hits', 'misses', 'expired', 'invalidated', 'evictions')])
+        yield ("prediction_cache_entries", "gauge", "Entries in the prediction cache.", [({}, st['entries'])])
+    return collect
+
+
+def coalescing_collector(c):
+    """Requests and batches of the /postData request coalescer (request_coalescing.py)."""
+    def collect():
+        st = c.status()
+        yield ("coalesced_requests_total", "counter", "Predictions that went through the request coalescer.",
+               [({}, st['requests'])])
+        yield ("coalesced_batches_total", "counter", "Batches scored by the request coalescer, by how they closed.",
+               [({'closed': 'full'}, st['full_batches']), ({'closed': 'window'}, st['batches'] - st['full_batches'])])
+    return collect
+
+
+metrics.add_collector(process_collector)
+
+
+# ---------------------------
+# Sampling profiler (switched on at runtime through /admin/profile)
+# ---------------------------
+# A background thread wakes every interval, walks the stack of every other thread (sys._current_frames)
+# and counts each stack in the "folded" format of flamegraph.pl / speedscope / inferno:
+#   thread;module:function;module:function... <samples>
+# Threads parked in a queue, lock, sleep or socket wait are left out, so what remains is the work done
+# on the request path and in the background senders. The overhead is one stack walk per thread per
+# interval, and nothing at all while the profiler is off.
+
+IDLE_FILES = ('threading.py', 'queue.py', 'selectors.py', 'socketserver.py', 'socket.py', 'ssl.py',
+              'base_events.py', 'selector_events.py')
+MAX_PROFILE_SECONDS = 300
+
+
+class sampling_profiler():
+    def __init__(self):
+        self.stacks = Counter()
+        self.samples = 0
+        self.running = False
+        self.started = None
+        self.stopped = None
+        self.interval = None
+        self._stop = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def start(self, seconds=30.0, interval_ms=5.0):
+        """
+        Collect stacks for `seconds` (capped at MAX_PROFILE_SECONDS); a running profile is restarted.
+        Raises ValueError (leaving a running profile alone) unless both are positive numbers.
+        """
+        seconds, interval_ms = float(seconds), float(interval_ms)
+        if not (math.isfinite(seconds) and seconds > 0 and math.isfinite(interval_ms) and interval_ms > 0):
+            raise ValueError("seconds and interval_ms must be positive numbers")
+        self.stop()
+        seconds = min(seconds, MAX_PROFILE_SECONDS)
+        self.interval = max(interval_ms, 0.5) / 1e3
+        with self._lock:
+            self.stacks = Counter()
+            self.samples = 0
+        self._stop = threading.Event()
+        self.running = True
+        self.started, self.stopped = time.time(), None
+        self._thread = threading.Thread(target=self._run, args=(seconds, self._stop), name="sampling-profiler",
+                                        daemon=True)
+        self._thread.start()
+        return self.status()
+
+    def stop(self):
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
+        return self.status()
+
+    def _run(self, seconds, stop):
+        me = threading.get_ident()
+        end = time.monotonic() + seconds
+        while not stop.wait(self.interval) and time.monotonic() < end:
+            names = {t.ident: t.name for t in threading.enumerate()}
+            frames = sys._current_frames()
+            with self._lock:
+                self.samples += 1
+                for ident, frame in frames.items():
+                    if ident != me and Path(frame.f_code.co_filename).name not in IDLE_FILES:
+                        self.stacks[self._fold(names.get(ident, str(ident)), frame)] += 1
+        self.running = False
+        self.stopped = time.time()
+
+    @staticmethod
+    def _fold(thread_name, frame):
+        parts = []
+        while frame is not None:
+            code = frame.f_code
+            parts.append(f"{Path(code.co_filename).stem}:{code.co_name}")
+            frame = frame.f_back
+        parts.append(thread_name)
+        return ";".join(reversed(parts))
+
+    def folded(self):
+        """The collected stacks, one 'frame;frame;... count' line each (feed to flamegraph.pl or speedscope)."""
+        with self._lock:
+            items = self.stacks.most_common()
+        return "".join(f"{stack} {n}\n" for stack, n in items)
+
+    def status(self):
+        with self._lock:
+            return {'running': self.running, 'started': self.started, 'stopped': self.stopped,
+                    'interval_ms': self.interval * 1e3 if self.interval else None,
+                    'samples': self.samples, 'stacks': len(self.stacks)}
+
+
+profiler = sampling_profiler()
+
+
+def admin_profile(data):
+    """
+    POST /admin/profile: {"seconds": 30, "interval_ms": 5} starts a profile, {"action": "stop"} ends it early.
+    Returns (response_dict, status_code); GET /admin/profile serves profiler.folded().
+    """
+    data = data or {}
+    if not isinstance(data, dict):
+        return {"error": "expected a JSON object"}, 400
+    if data.get("action") == "stop":
+        return profiler.stop(), 200
+    try:
+        return profiler.start(data.get("seconds", 30), data.get("interval_ms", 5)), 202
+    except (TypeError, ValueError):
+        return {"error": "seconds and interval_ms must be positive numbers"}, 400
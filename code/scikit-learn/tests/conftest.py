@@ -0,0 +1,53 @@
+import sys
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pytest
+
+# the modules of code/scikit-learn are imported flat, as the servers and scripts do
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import model_backends as mb
+import model_store as ms
+import prepared_data as pdc
+import random_forest_model as rfm
+import rolling_features as rf
+
+CITY = "Testville"
+
+
+def write_city(data_dir, days=240, seed=0):
+    """Small synthetic city: 6-hourly weather, weekly AQI and a feeling row per day; returns its files."""
+    rng = np.random.default_rng(seed)
+    data_dir.mkdir(parents=True, exist_ok=True)
+    times = pd.date_range("2024-01-01", periods=days * 4, freq="6h")
+    day = np.arange(len(times)) / 4
+    temp = 20 + 10 * np.sin(day / 30) + 4 * np.sin(np.arange(len(times)) * np.pi / 2) + rng.normal(0, 1, len(times))
+    pd.DataFrame({'date': times, 'temp': temp.round(2)}).to_csv(data_dir / "weather.csv", index=False)
+
+    weeks = pd.date_range("2024-01-01", periods=days // 7 + 1, freq="7D")
+    aqi = 120 + 60 * np.sin(np.arange(len(weeks)) / 4) + rng.normal(0, 10, len(weeks))
+    pd.DataFrame({'date': weeks, 'aqi': aqi.round(1)}).to_csv(data_dir / "aqi.csv", index=False)
+
+    dates = pd.date_range("2024-01-01", periods=days, freq="D")
+    t = 20 + 10 * np.sin(np.arange(days) / 30)
+    a = 120 + 60 * np.sin(np.arange(days) / 28)
+    pd.DataFrame({'city': CITY, 'date': dates,
+                  'weather_satisfaction': np.clip(10 - np.abs(t - 22) / 2 + rng.normal(0, 0.5, days), 1, 10).round(2),
+                  'air_quality_satisfaction': np.clip(10 - a / 25 + rng.normal(0, 0.5, days), 1, 10).round(2)}
+                 ).to_csv(data_dir / "feeling.csv", index=False)
+    return {'weather': str(data_dir / "weather.csv"), 'aqi': str(data_dir / "aqi.csv"),
+            'feeling': str(data_dir / "feeling.csv")}
+
+
+@pytest.fixture
+def city(tmp_path, monkeypatch):
+    """A registered synthetic city with its own model store, prepared-data cache and backend config."""
+    monkeypatch.setitem(rfm.CITIES_FILES, CITY, write_city(tmp_path / "data"))
+    monkeypatch.setattr(ms, "DEFAULT_STORE_DIR", tmp_path / "store")
+    monkeypatch.setattr(pdc, "DEFAULT_CACHE_DIR", tmp_path / "prepared")
+    monkeypatch.setattr(mb, "CONFIG_PATH", tmp_path / "model_backends.json")
+    monkeypatch.setattr(rfm, "TRAINING_SOURCE", "csv")
+    monkeypatch.setattr(rf, "DEFAULT_FEATURE_SET", "base")
+    return CITY
@@ -0,0 +1,48 @@
+import pandas as pd
+
+import incremental_training as it
+import prediction_service as svc
+import random_forest_model as rfm
+
+
+def extend_readings(city):
+    """Weather and AQI recorded after the last feeling day (2024-08-27)."""
+    files = rfm.CITIES_FILES[city]
+    extra = pd.DataFrame({'date': pd.date_range("2024-08-28", periods=8, freq="6h"),
+                          'temp': [30.0, 32.0, 34.0, 36.0, 10.0, 12.0, 14.0, 16.0]})
+    pd.concat([pd.read_csv(files['weather']), extra]).to_csv(files['weather'], index=False)
+    aqi = pd.read_csv(files['aqi'])
+    pd.concat([aqi, pd.DataFrame({'date': ["2024-09-02"], 'aqi': [300.0]})]).to_csv(files['aqi'], index=False)
+
+
+def feeling(date, **readings):
+    return dict(date=date, weather_satisfaction=5.0, air_quality_satisfaction=4.0, **readings)
+
+
+def test_new_feelings_take_the_readings_of_their_day(city):
+    extend_readings(city)
+    rows = it.read_feelings([feeling("2024-08-28"), feeling("2024-08-29"), feeling("2024-09-10"),
+                             feeling("2024-09-11", temp=25.0, aqi=100.0)])
+    got = it.attach_readings(city, rows, 'csv').set_index('date')
+
+    # 2024-09-10 has no readings and brought none: dropped instead of repeating 2024-08-29
+    assert [str(d.date()) for d in got.index] == ["2024-08-28", "2024-08-29", "2024-09-11"]
+    assert got.loc["2024-08-28", ['temp', 'temp_min', 'temp_max']].tolist() == [33.0, 30.0, 36.0]
+    assert got.loc["2024-08-29", ['temp', 'temp_min', 'temp_max']].tolist() == [13.0, 10.0, 16.0]
+    assert got.loc["2024-08-28", 'aqi'] < got.loc["2024-08-29", 'aqi'] < 300.0
+    assert got.loc["2024-09-11", ['temp_min', 'temp_max', 'aqi_mean_3d', 'aqi_trend']].tolist() == [25.0, 25.0, 100.0, 0.0]
+
+
+def test_admin_feelings_updates_the_served_model(city):
+    extend_readings(city)
+    models = svc.model_cache([city])
+    before = models[city].version()
+
+    body, status = svc.admin_feelings({"city": city, "rows": [feeling("2024-08-28"), feeling("2024-08-29")]}, models)
+    assert status == 200 and body["new_rows"] == 2
+    assert body["version"] == models[city].version() != before
+    assert models[city].models['meta']['watermark'] == "2024-08-29"
+
+    for bad in ([], {"city": city}, {"city": city, "rows": [1]}, {"city": city, "rows": [feeling("2024-08-30")], "mode": "x"}):
+        body, status = svc.admin_feelings(bad, models)
+        assert status == 400 and "error" in body
@@ -0,0 +1,54 @@
+import pandas as pd
+import pytest
+
+import influx_source
+
+
+def stand_in_source(runner=None):
+    # 30-day chunks split the 240 synthetic days over several queries per series
+    return influx_source.influx_source(runner or influx_source.csv_stand_in(), start="2024-01-01", stop="2024-08-01",
+                                       chunk_days=30, workers=4)
+
+
+def test_stand_in_matches_csv_pipeline(city):
+    src = stand_in_source()
+    df = src.load_city(city)
+    assert len(df) > 0
+    pd.testing.assert_frame_equal(influx_source.csv_frame(city, src.start, src.stop)[df.columns], df, check_dtype=False)
+
+    # the rolling features get the real daily range, not the mean three times
+    assert (df['temp_min'] < df['temp_max']).all()
+    assert ((df['temp_min'] <= df['temp']) & (df['temp'] <= df['temp_max'])).all()
+
+
+def test_recorded_responses_replay_offline(city, tmp_path):
+    fixtures = tmp_path / "fixtures"
+    recorded = stand_in_source(influx_source.recorded_runner(fixtures, influx_source.csv_stand_in())).load_city(city)
+    assert len(list(fixtures.glob("*.json"))) == len(influx_source.query_specs(city, "2024-01-01", "2024-08-01", 30))
+
+    replayed = stand_in_source(influx_source.recorded_runner(fixtures)).load_city(city)
+    pd.testing.assert_frame_equal(recorded, replayed)
+
+    other_range = influx_source.influx_source(influx_source.recorded_runner(fixtures), start="2023-01-01",
+                                              stop="2024-08-01", chunk_days=30)
+    with pytest.raises(FileNotFoundError):
+        other_range.load_city(city)
+
+
+def test_fingerprint_follows_the_last_stored_point(city):
+    # the synthetic data ends on 2024-08-27: later stop dates see the same data
+    fp = {stop: influx_source.influx_source(influx_source.csv_stand_in(), start="2024-01-01", stop=stop).fingerprint(city)
+          for stop in ("2024-08-01", "2024-09-01", "2024-10-01")}
+    assert fp["2024-09-01"] == fp["2024-10-01"] != fp["2024-08-01"]
+
+
+def test_one_source_per_process_closed_at_exit(city, tmp_path, monkeypatch):
+    monkeypatch.setenv("INFLUX_FIXTURES", str(tmp_path))
+    monkeypatch.setattr(influx_source, "_shared", None)
+    closed = []
+    monkeypatch.setattr(influx_source.atexit, "register", closed.append)
+    src = influx_source.shared()
+    assert influx_source.shared() is src
+    assert closed == [src.close]
+    influx_source._after_fork()
+    assert influx_source._shared is None
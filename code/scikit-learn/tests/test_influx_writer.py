@@ -0,0 +1,29 @@
+import influx_writer
+
+
+def test_prediction_lines_follow_the_node_red_schema():
+    lines = influx_writer.prediction_lines({"weather_satisfaction": 7, "air_quality_satisfaction": None}, 1_700_000_000_000)
+    assert lines == ["Temperature _value=7.0 1700000000000"]
+    assert influx_writer.bucket_for("Lahore") == "lahorePredictions"
+
+
+def test_stand_in_receives_every_point_despite_rejected_writes():
+    server = influx_writer.stand_in(fail=2)
+    writer = influx_writer.influx_writer(server.url, batch_size=50, backoff=0.01)
+    try:
+        cities = ("Lahore", "Islamabad", "Karachi")
+        n = 600
+        for i in range(n):
+            assert writer.submit_result({"city": cities[i % 3],
+                                         "predictions": {"weather_satisfaction": 5 + i % 5, "air_quality_satisfaction": 3.5}},
+                                        ts_ms=1_700_000_000_000 + i)
+        writer.flush()
+        status = writer.status()
+        assert status['points'] == 2 * n
+        assert status['retries'] >= 2
+        assert {bucket: len(lines) for bucket, lines in server.lines.items()} == \
+            {influx_writer.bucket_for(c): 2 * len(range(i, n, 3)) for i, c in enumerate(cities)}
+        assert "AQI _value=3.5 1700000000000" in server.lines["lahorePredictions"]
+    finally:
+        writer.close()
+        server.close()
@@ -0,0 +1,43 @@
+import numpy as np
+import pytest
+from sklearn.ensemble import RandomForestRegressor
+
+import model_backends as mb
+import model_families as mf
+import random_forest_model as rfm
+
+
+def family(cv_r2, p99_ms):
+    return {'targets': {'weather': {}}, 'cv_r2': cv_r2, 'latency': {'p99_ms': p99_ms}}
+
+
+def test_pick_names_the_servable_backend():
+    results = {'A': {'linear': family(0.50, 0.01), 'random_forest': family(0.50, 1.0),
+                     'hist_gradient_boosting': family(0.495, 0.5)},
+               'B': {'linear': family(0.30, 0.01)}}
+    picks = mf.pick(results, tolerance=0.01)
+    assert picks['A']['family'] == 'linear'
+    assert picks['A']['backend'] == 'hist_gb'
+    assert picks['B']['backend'] is None
+
+
+def test_apply_serves_the_pick(city):
+    mf.apply({city: {'family': 'hist_gradient_boosting', 'backend': 'hist_gb'}})
+    assert mb.config_for(city)['name'] == 'hist_gb'
+    assert rfm.model(city).backend['name'] == 'hist_gb'
+
+
+def test_forests_are_timed_on_the_flat_engine(monkeypatch):
+    rng = np.random.default_rng(0)
+    X = np.column_stack([rng.uniform(-5, 50, 200), rng.uniform(1, 400, 200)])
+    models = {key: mf.FAMILIES['random_forest']().set_params(n_estimators=10).fit(X, X[:, 0] / 10)
+              for key in ('weather', 'air_quality')}
+
+    def sklearn_predict(self, X):
+        raise AssertionError("served forests answer through forest_engine, not sklearn")
+
+    monkeypatch.setattr(RandomForestRegressor, "predict", sklearn_predict)
+    assert mf.measure(models, n_single=20)['p99_ms'] > 0
+    assert mb._latency_p99(models, n=20) > 0
+    with pytest.raises(AssertionError):
+        rfm.model.from_models("A", models, engine='sklearn').predict_raw('weather', X[:1])
@@ -0,0 +1,37 @@
+import threading
+
+import numpy as np
+from sklearn.ensemble import RandomForestRegressor
+
+import model_store as ms
+
+
+def test_concurrent_saves_of_one_slot(tmp_path):
+    rng = np.random.default_rng(0)
+    X, y = rng.uniform(0, 40, (50, 2)), rng.uniform(1, 10, 50)
+    models = {key: RandomForestRegressor(n_estimators=3, random_state=0).fit(X, y) for key in ms.TARGETS}
+    fingerprint = "f" * 64
+    start = threading.Barrier(4)
+    saved, errors = [], []
+
+    def save():
+        start.wait()
+        try:
+            saved.append(ms.save_artifact("Testville", models, fingerprint, store_dir=tmp_path))
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=save) for _ in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    # each save is a complete version of its own, and nothing is left half written
+    assert errors == []
+    assert len(set(saved)) == 4
+    for version in saved:
+        assert sorted(p.name for p in version.iterdir()) == sorted(
+            ['meta.json'] + [f"{k}.joblib" for k in ms.TARGETS] + [f"{k}.flat" for k in ms.TARGETS])
+    assert not [p for p in saved[0].parent.iterdir() if ".tmp" in p.name]
+    assert ms.load_artifact("Testville", fingerprint, store_dir=tmp_path)['meta']['fingerprint'] == fingerprint
@@ -0,0 +1,75 @@
+import email.utils
+import time
+
+import pandas as pd
+import pytest
+
+import openaq_ingest as oq
+
+pytest.importorskip("httpx")
+
+
+def test_mock_pulls_resume_and_revalidate(tmp_path):
+    cities = list(oq.CITY_CENTERS)
+    targets = {city: tmp_path / f"{city.lower()}_openaq_AQI.csv" for city in cities}
+    kw = dict(targets=targets, concurrency=4, rate=0, cache_dir=tmp_path / "cache", backoff=0.01)
+
+    api = oq.mock_openaq(stop="2024-06-30", rate_limit_every=25)
+    try:
+        _, stats = oq.run(cities, base=api.url, **kw)
+    finally:
+        api.close()
+    assert stats['rate_limited'] > 0
+
+    # a month later: only the new days are fetched, the rest comes from the file and the cache
+    api = oq.mock_openaq(stop="2024-07-31")
+    try:
+        _, stats = oq.run(cities, base=api.url, **kw)
+        assert stats['cached'] > 0
+        for city in cities:
+            got = pd.read_csv(targets[city])
+            sensors = [sid for loc, (lat, _) in api.locations.items() if abs(lat - oq.CITY_CENTERS[city][0]) < 0.25
+                       for sid in api.sensors[loc]]
+            expected = oq.daily_aqi(pd.DataFrame([(d, s, api.value(s, d)) for s in sensors for d in api.days],
+                                                 columns=['date', 'sensor', 'pm25']))
+            assert got['date'].tolist() == api.days
+            assert got['aqi'].tolist() == expected['aqi'].tolist()
+
+        # rerunning the same day: unchanged pages come back as 304 Not Modified
+        oq.run(cities, base=api.url, **kw)
+        _, stats = oq.run(cities, base=api.url, **kw)
+        assert stats['requests'] > 0
+        assert stats['not_modified'] == stats['requests']
+    finally:
+        api.close()
+
+
+def test_failed_sensors_leave_the_stored_days_alone(tmp_path):
+    city = "Lahore"
+    targets = {city: tmp_path / "lahore_openaq_AQI.csv"}
+    kw = dict(targets=targets, concurrency=4, rate=0, cache_dir=tmp_path / "cache", backoff=0.01, max_retries=1)
+    api = oq.mock_openaq(stop="2024-01-31")
+    try:
+        oq.run([city], base=api.url, full=True, **kw)
+    finally:
+        api.close()
+    before = targets[city].read_text()
+
+    # one sensor fails: averages of the others would replace days that averaged every sensor
+    api = oq.mock_openaq(stop="2024-02-29", failing=[10 * min(api.sensors)])
+    try:
+        result, _ = oq.run([city], base=api.url, full=True, **kw)
+    finally:
+        api.close()
+    assert result == {city: 0}
+    assert targets[city].read_text() == before
+
+
+def test_retry_after_seconds_or_http_date():
+    assert oq.retry_after({"Retry-After": "2.5"}, 1.0) == 2.5
+    date = email.utils.formatdate(time.time() + 30, usegmt=True)
+    assert 25 < oq.retry_after({"Retry-After": date}, 1.0) <= 30
+    assert oq.retry_after({"Retry-After": "Wed, 21 Oct 2015 07:28:00 GMT"}, 1.0) == 0.0
+    assert oq.retry_after({"Retry-After": "soon", "X-Ratelimit-Reset": "4"}, 1.0) == 4.0
+    assert oq.retry_after({"Retry-After": "soon"}, 1.0) == 1.0
+    assert oq.retry_after({}, 1.0) == 1.0
@@ -0,0 +1,111 @@
+import json
+
+import pytest
+
+import point_stream as ps
+import prediction_service as svc
+
+BODY = json.dumps({
+    "city": "Lahore",
+    "temperature": [{"_time": "2025-09-01T10:00:00Z", "_value": 21.5}, {"value": 22.0, "_value": 99.0},
+                    {"_value": 98.0, "value": 23.0}],
+    "other": [{"_value": 1000.0}],
+    "aqi": [{"_time": "2025-09-01T10:00:00Z", "_value": 140.0}, {"_value": 160.0}],
+    "meta": {"_value": 7.0},
+}).encode("utf-8")
+
+
+@pytest.mark.parametrize("chunk_size", [1, 3, 17, 1 << 16])
+def test_scanner_matches_safe_mean(chunk_size):
+    data = json.loads(BODY)
+    s = ps.scan(BODY, chunk_size=chunk_size)
+    assert s.city == "Lahore"
+    # numbers after an array are not attributed to it, and each point counts once
+    assert list(s.values["temperature"]) == [21.5, 22.0, 23.0]
+    assert list(s.values["aqi"]) == [140.0, 160.0]
+    assert ps.aggregate(s.values["temperature"]) == svc.safe_mean(data["temperature"])
+    assert ps.aggregate(s.values["aqi"]) == svc.safe_mean(data["aqi"])
+
+
+# bodies json.loads + safe_mean read differently from a naive bracket / key scan
+TRICKY = {
+    "brackets in strings": {"city": "Lahore", "note": "x]}{[\\\"", "temperature": [
+        {"_time": "2025-09-01T10:00:00Z", "tag": "a]b}", "_value": 20.0}, {"tag": "{[\"", "_value": 30.0}],
+        "aqi": [{"tag": "]", "_value": 100.0}]},
+    "city in point tags": {"temperature": [{"city": "Karachi", "_value": 20.0}], "city": "Lahore",
+                           "aqi": [{"tags": {"city": "Karachi"}, "_value": 100.0}]},
+    "non-numeric and null values": {"city": "Lahore", "temperature": [
+        {"value": "12abc"}, {"_value": 5, "value": None}, {"value": "7.5"}, {"value": True}, {"_value": 1, "_value": 2},
+        {"tag": "no value"}, 3.0, "text", [1.0]], "aqi": [{"value": None}, {"_value": 100.0}]},
+    "repeated field": {"city": "Lahore", "aqi": [{"_value": 1.0}], "temperature": [{"_value": 20.0}],
+                       "aqi": [{"_value": 100.0}]},
+}
+
+
+def _body(case):
+    if case == "repeated field":   # a dict cannot hold the key twice
+        return b'{"city": "Lahore", "aqi": [{"_value": 1.0}], "temperature": [{"_value": 20.0}], "aqi": [{"_value": 100.0}]}'
+    if case == "non-numeric and null values":
+        return json.dumps(TRICKY[case]).replace('"_value": 1}', '"_value": 1, "_value": 2}').encode("utf-8")
+    return json.dumps(TRICKY[case]).encode("utf-8")
+
+
+@pytest.mark.parametrize("chunk_size", [1, 3, 17, 1 << 16])
+@pytest.mark.parametrize("case", list(TRICKY))
+def test_scanner_reads_points_like_safe_mean(case, chunk_size):
+    body = _body(case)
+    data = json.loads(body)
+    s = ps.scan(body, chunk_size=chunk_size)
+    assert s.error is None
+    assert s.city == data["city"] == "Lahore"
+    for field in ("temperature", "aqi"):
+        assert ps.aggregate(s.values[field]) == pytest.approx(svc.safe_mean(data[field]))
+        assert len(s.values[field]) == sum(ps.point_value(item) is not None for item in data[field])
+
+
+@pytest.mark.parametrize("chunk_size", [1, 1 << 16])
+def test_non_finite_points_are_kept_and_rejected(chunk_size):
+    body = b'{"city": "Lahore", "temperature": [{"_value": NaN}, {"_value": 20.0}], "aqi": [{"_value": -Infinity}]}'
+    s = ps.scan(body, chunk_size=chunk_size)
+    assert len(s.values["temperature"]) == 2 and len(s.values["aqi"]) == 1
+    assert not ps.all_finite(s.values["temperature"]) and not ps.all_finite(s.values["aqi"])
+    assert svc.predict_post_stream(s, {"Lahore": None})[1] == 400
+
+
+@pytest.mark.parametrize("chunk_size", [1, 3, 1 << 16])
+@pytest.mark.parametrize("body", [
+    b'', b'{"city": "Lahore", "temperature": [{"_value": 1.0}', b'{"city": "Lahore", "temperature": [1 2]}',
+    b'{"city": "Lahore", "temperature": [1,]}', b'{"city": "Lahore", "temperature": [{"_value": 1.0 "a": 2}]}',
+    b'{"city": "Lahore", "temperature": [{"_value": 1.0]}', b'{"city": "Lahore", "temperature": [abc]}',
+    b'{"city": "Lahore", "other": nope}', b'{"city": "Lahore",}', b'{"city": "Lahore" "aqi": []}',
+    b'{"city": "Lahore"} {}',
+])
+def test_invalid_json_bodies_are_client_errors(body, chunk_size):
+    with pytest.raises(ValueError):
+        json.loads(body)
+    s = ps.scan(body, chunk_size=chunk_size)
+    assert s.error
+    assert svc.predict_post_stream(s, {"Lahore": None})[1] == 400
+
+
+@pytest.mark.parametrize("body", [b'[1, 2]', b'"Lahore"', b'{"city": "Lahore", "temperature": 5}'])
+def test_bodies_of_the_wrong_shape_are_client_errors(body):
+    assert svc.predict_post_data(json.loads(body), {"Lahore": None})[1] == 400
+    s = ps.scan(body)
+    assert s.error
+    assert svc.predict_post_stream(s, {"Lahore": None})[1] == 400
+
+
+def test_non_string_city_is_a_client_error():
+    for city in ('{"name": "Lahore"}', '["Lahore"]', '12'):
+        body = '{"city": %s, "temperature": [{"_value": 1.0}]}' % city
+        s = ps.scan(body.encode("utf-8"), chunk_size=3)
+        assert s.error is None and s.city == json.loads(city)
+        assert svc.predict_post_stream(s, {"Lahore": None}) == svc.predict_post_data(json.loads(body), {"Lahore": None})
+
+
+@pytest.mark.parametrize("window", ["0", "-3"])
+def test_stream_options_reject_non_positive_window(window):
+    with pytest.raises(ValueError):
+        svc.stream_options({"window": window})
+    assert svc.stream_options({"window": "5"})["window"] == 5
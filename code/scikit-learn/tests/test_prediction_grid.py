@@ -0,0 +1,12 @@
+import prediction_grid as pg
+import random_forest_model as rfm
+
+
+def test_error_report_measures_against_the_forests(city):
+    plain = rfm.model(city)
+    gridded = rfm.model(city, grid={'temp': (0, 40, 2.0), 'aqi': (1, 300, 10.0)})
+
+    report = gridded.grid.error_report(gridded, n_samples=2000)
+    expected = pg.prediction_grid(plain, temp=(0, 40, 2.0), aqi=(1, 300, 10.0)).error_report(plain, n_samples=2000)
+    assert report == expected
+    assert report['weather_satisfaction']['max_abs_error'] > 0
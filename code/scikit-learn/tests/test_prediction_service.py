@@ -0,0 +1,64 @@
+import pytest
+
+import point_stream as ps
+import prediction_cache
+import prediction_service as svc
+
+
+def post(city, temp, aqi):
+    return {"city": city, "temperature": [{"_value": temp}], "aqi": [{"_value": aqi}]}
+
+
+def test_prediction_cache_is_opt_in(city, monkeypatch):
+    assert not prediction_cache.prediction_cache.from_env().enabled
+    monkeypatch.setenv("PREDICTION_CACHE", "1")
+    assert prediction_cache.prediction_cache.from_env().enabled
+
+
+def test_cached_answers_report_their_snapped_inputs(city, monkeypatch):
+    models = svc.model_cache([city])
+    m = models[city]
+    monkeypatch.setattr(svc, "predictions", prediction_cache.prediction_cache(enabled=False))
+    body, status = svc.predict_post_data(post(city, 21.234, 97.6), models)
+    assert status == 200
+    assert "model_inputs" not in body["result"]
+    assert body["result"]["raw_model_output"] == m.run(21.234, 97.6)
+
+    monkeypatch.setattr(svc, "predictions", prediction_cache.prediction_cache())
+    body, status = svc.predict_post_data(post(city, 21.234, 97.6), models)
+    assert body["result"]["model_inputs"] == {"temperature": 21.2, "aqi": 98.0}
+    assert body["result"]["raw_model_output"] == m.run(21.2, 98.0)
+
+
+def test_unknown_city_is_a_client_error(city):
+    models = svc.model_cache([city])
+    body, status = svc.predict_post_data(post("Atlantis", 20.0, 100.0), models)
+    assert status == 400
+    assert "unknown city" in body["error"]
+
+
+def test_non_finite_values_are_rejected(city):
+    models = svc.model_cache([city])
+    for bad in (float("nan"), float("inf"), "-Infinity"):
+        body, status = svc.predict_post_data(post(city, bad, 100.0), models)
+        assert status == 400 and "finite" in body["error"]
+        body, status = svc.predict_batch_request({"city": city, "temperature": [20.0], "aqi": [bad]}, models)
+        assert status == 400 and "finite" in body["error"]
+
+    scanner = ps.scan(b'{"city": "%s", "temperature": [{"_value": 1e999}], "aqi": [{"_value": 90}]}' % city.encode())
+    body, status = svc.predict_post_stream(scanner, models)
+    assert status == 400 and "finite" in body["error"]
+    with pytest.raises(ValueError):
+        svc.stream_options({"trim": "nan"})
+
+    body, status = svc.predict_post_data(post(city, 20.0, 100.0), models)
+    assert status == 200
+
+
+def test_malformed_bodies_are_client_errors(city):
+    models = svc.model_cache([city])
+    for body in ([post(city, 20.0, 100.0)], {"city": [city], "temperature": [{"_value": 20.0}], "aqi": [{"_value": 90}]},
+                 {"city": {"name": city}, "temperature": [20.0], "aqi": [90.0]}):
+        for handler in (svc.predict_post_data, svc.predict_batch_request):
+            answer, status = handler(body, models)
+            assert status == 400 and "error" in answer
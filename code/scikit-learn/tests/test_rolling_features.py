@@ -0,0 +1,47 @@
+import prediction_service as svc
+import random_forest_model as rfm
+import rolling_features as rf
+
+
+def test_stale_reports_retrained_rolling_model(city, monkeypatch):
+    monkeypatch.setattr(rf, "DEFAULT_FEATURE_SET", "rolling")
+    models = svc.model_cache([city])
+    assert models[city].rolling
+    assert models.stale() == []
+
+    rfm.model(city, retrain=True)
+    assert models.stale() == [city]
+
+    models.reload(city)
+    assert models.stale() == []
+
+
+def test_feature_sets_and_backends_have_their_own_artifacts(city, monkeypatch):
+    base = rfm.model(city)
+    monkeypatch.setattr(rf, "DEFAULT_FEATURE_SET", "rolling")
+    rolling = rfm.model(city)
+    hist_gb = rfm.model(city, features='base', backend='hist_gb')
+
+    # switching back loads every one of them from the store instead of retraining
+    assert rfm.model(city, features='base').version() == base.version()
+    assert rfm.model(city).version() == rolling.version()
+    assert rfm.model(city, features='base', backend='hist_gb').version() == hist_gb.version()
+    assert len({base.version(), rolling.version(), hist_gb.version()}) == 3
+
+
+def test_malformed_reading_time_is_a_client_error(city, monkeypatch):
+    monkeypatch.setattr(rf, "DEFAULT_FEATURE_SET", "rolling")
+    monkeypatch.setattr(svc, "rolling", rf.rolling_states())
+    models = svc.model_cache([city])
+    body = {"city": city, "temperature": [{"_time": "2024-09-01T10:00:00Z", "_value": 20.0},
+                                          {"_time": "yesterday", "_value": 21.0}],
+            "aqi": [{"_time": "2024-09-01T10:00:00Z", "_value": 90.0}]}
+    answer, status = svc.predict_post_data(body, models)
+    assert status == 400 and "yesterday" in answer["error"]
+    # nothing of the rejected request was taken
+    assert svc.rolling.status() == {}
+
+    body["temperature"][1]["_time"] = 1725188400000
+    answer, status = svc.predict_post_data(body, models)
+    assert status == 200
+    assert svc.rolling.status()[city]['readings'] == 3
@@ -0,0 +1,21 @@
+import pytest
+
+import service_metrics as sm
+
+
+@pytest.fixture
+def profiler(monkeypatch):
+    p = sm.sampling_profiler()
+    monkeypatch.setattr(sm, "profiler", p)
+    yield p
+    p.stop()
+
+
+@pytest.mark.parametrize("body", [{"interval_ms": 0}, {"seconds": "soon"}, {"seconds": -1}, {"seconds": float("nan")}, [1]])
+def test_bad_profile_request_keeps_the_running_profile(profiler, body):
+    _, status = sm.admin_profile({"seconds": 60, "interval_ms": 1})
+    assert status == 202
+    _, status = sm.admin_profile(body)
+    assert status == 400
+    assert profiler.status()['running']
+    assert profiler.status()['interval_ms'] == 1
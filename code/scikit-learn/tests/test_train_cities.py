@@ -0,0 +1,13 @@
+import model_store as ms
+import random_forest_model as rfm
+import train_cities
+
+
+def test_parallel_training_stores_single_threaded_models_with_watermark(city):
+    report = train_cities.train_all([city], cores=4)
+    assert report['skipped'] == []
+
+    stored = ms.load_artifact(city, rfm.source_fingerprint(city))
+    assert stored['meta']['watermark'] == "2024-08-27"
+    for key in ms.TARGETS:
+        assert stored[key].n_jobs is None
@@ -0,0 +1,12 @@
+import numpy as np
+
+import us_aqi
+
+
+def test_values_above_the_table():
+    # PM2.5 reaches 500: beyond it the index is capped; O3 8-hour stops at 300 and has no answer beyond
+    assert us_aqi.us_aqi([500.4, 600.0, 12.0])[:2].tolist() == [500.0, 500.0]
+    assert us_aqi.us_aqi([0.2, 0.21, 0.3], 'o3')[0] == 300
+    assert np.isnan(us_aqi.us_aqi([0.21, 0.3], 'o3')).all()
+    assert np.isnan(us_aqi.us_aqi([-1.0, np.nan])).all()
+    assert us_aqi.us_aqi([400.0], 'pm25_2024')[0] == 500
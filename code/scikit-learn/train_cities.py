@@ -0,0 +1,120 @@
+# Parallel training of every city x target model into the model store.
+#
+#   python train_cities.py                         # all cities, all cores
+#   python train_cities.py --cores 4 Lahore Karachi
+#   python train_cities.py --compare               # also time the serial path and report the speedup
+import argparse
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import model_backends as mb
+import model_store as ms
+import random_forest_model as rfm
+import rolling_features as rf
+
+TARGETS = ms.TARGETS   # {'weather': 'weather_satisfaction', 'air_quality': 'air_quality_satisfaction'}
+
+
+def prepare_city(city):
+    """Worker: load and align one city's CSVs; returns (city, fingerprint, X, {key: y}, watermark, seconds)."""
+    start = time.perf_counter()
+    fingerprint = rfm.source_fingerprint(city)
+    df = rfm.prepare_training_data(city, fingerprint).dropna(subset=list(TARGETS.values()))
+    X = df[rf.feature_columns()].values   # MODEL_FEATURES (see rolling_features.py)
+    ys = {key: df[col].values for key, col in TARGETS.items()}
+    watermark = str(df['date'].max().date()) if len(df) else None
+    return city, fingerprint, X, ys, watermark, time.perf_counter() - start
+
+
+def fit_one(city, key, X, y, n_jobs, backend=None):
+    """Worker: fit one city x target model (its backend, default the forest); returns (city, key, model, r2, seconds)."""
+    start = time.perf_counter()
+    est, r2 = rfm.fit_target(X, y, n_jobs=n_jobs, backend=backend)
+    return city, key, est, r2, time.perf_counter() - start
+
+
+def train_all(cities, cores=None, store_dir=None, save=True):
+    """
+    Prepare every city and fit every city x target forest in a process pool limited to `cores`
+    processes (forests use n_jobs=1 unless there are fewer tasks than cores), then store the artifacts.
+    Returns a report with per-task and overall wall-clock times; fit_wall_s is the fitting phase alone.
+    """
+    cores = max(1, cores or os.cpu_count() or 1)
+    report = {'cores': cores, 'prepare_s': {}, 'fit_s': {}, 'r2': {}, 'skipped': []}
+    wall = time.perf_counter()
+    prepared = {}
+    with ProcessPoolExecutor(max_workers=min(cores, len(cities))) as pool:
+        for city, fingerprint, X, ys, watermark, secs in pool.map(prepare_city, cities):
+            prepared[city] = (fingerprint, X, ys, watermark)
+            report['prepare_s'][city] = round(secs, 3)
+
+    tasks = [(city, key) for city in cities for key in TARGETS if len(prepared[city][2][key]) >= rfm.MIN_ROWS]
+    report['skipped'] = [f"{c}/{k}" for c in cities for k in TARGETS if (c, k) not in tasks]
+    n_jobs = max(1, cores // max(1, len(tasks)))
+    fitted = {city: {} for city in cities}
+    backends = {city: mb.config_for(city) for city in cities}
+    fit_wall = time.perf_counter()
+    if tasks:
+        with ProcessPoolExecutor(max_workers=min(cores, len(tasks))) as pool:
+            futures = [pool.submit(fit_one, city, key, prepared[city][1], prepared[city][2][key], n_jobs,
+                                   backends[city])
+                       for city, key in tasks]
+            for fut in futures:
+                city, key, est, r2, secs = fut.result()
+                fitted[city][key] = est
+                fitted[city].setdefault('scores', {})[f"{key}_r2"] = r2
+                report['fit_s'][f"{city}/{key}"] = round(secs, 3)
+                report['r2'][f"{city}/{key}"] = round(r2, 4)
+    report['fit_wall_s'] = round(time.perf_counter() - fit_wall, 3)
+
+    if save:
+        for city, models in fitted.items():
+            if any(key in models for key in TARGETS):
+                fingerprint, X, _, watermark = prepared[city]
+                ms.save_artifact(city, models, fingerprint, n_rows=len(X), store_dir=store_dir, watermark=watermark,
+                                 backend=backends[city], features=rf.feature_columns())
+                ms.prune(city, fingerprint, store_dir=store_dir)
+    report['wall_s'] = round(time.perf_counter() - wall, 3)
+    return report
+
+
+def train_serial(cities):
+    """
+    The original path: one city after another, each target fitted in turn with default n_jobs, on the same
+    prepared data and backends as train_all. Only the fitting is timed (fit_wall_s), so the two compare.
+    """
+    report = {'fit_s': {}}
+    prepared = [prepare_city(city) for city in cities]
+    wall = time.perf_counter()
+    for city, _, X, ys, _, _ in prepared:
+        backend = mb.config_for(city)
+        for key, y in ys.items():
+            if len(y) < rfm.MIN_ROWS:
+                continue
+            start = time.perf_counter()
+            rfm.fit_target(X, y, backend=backend)
+            report['fit_s'][f"{city}/{key}"] = round(time.perf_counter() - start, 3)
+    report['fit_wall_s'] = round(time.perf_counter() - wall, 3)
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Train all city models in parallel and write them to the model store")
+    parser.add_argument("cities", nargs="*", help="cities to train (default: all configured cities)")
+    parser.add_argument("--cores", type=int, default=None, help="process/core budget (default: all cores)")
+    parser.add_argument("--compare", action="store_true", help="also run the serial path and report the speedup")
+    args = parser.parse_args()
+
+    cities = args.cities or list(rfm.CITIES_FILES)
+    report = train_all(cities, cores=args.cores)
+    for task, secs in report['fit_s'].items():
+        print(f"{task:<28} fit {secs:7.2f}s  R^2 = {report['r2'][task]:.3f}")
+    for task in report['skipped']:
+        print(f"{task:<28} skipped (fewer than {rfm.MIN_ROWS} rows)")
+    print(f"parallel: {len(report['fit_s'])} models on {report['cores']} cores in {report['wall_s']:.2f}s "
+          f"(fitting {report['fit_wall_s']:.2f}s)")
+    if args.compare:
+        serial = train_serial(cities)
+        print(f"serial:   {len(serial['fit_s'])} models fitted in {serial['fit_wall_s']:.2f}s "
+              f"-> fitting speedup {serial['fit_wall_s'] / report['fit_wall_s']:.2f}x")
@@ -0,0 +1,159 @@
+import math
+import time
+
+import numpy as np
+import pandas as pd
+
+# ---------------------------
+# Vectorized US AQI from pollutant concentrations (EPA breakpoint tables)
+# ---------------------------
+# Concentrations are truncated to the table's precision (EPA guidance), the breakpoint row of every
+# value is found with np.searchsorted over the rows' upper bounds and the index is interpolated
+# linearly within the row, all on whole arrays. Values above a table that reaches 500 are capped at 500;
+# a table that stops lower (O3 8-hour ends at 300: higher ozone is rated from 1-hour values) gives NaN
+# above its last row, as do negative and missing values. daily_mean() averages many sensors' readings per day with grouped
+# reductions (pd.factorize + np.bincount) instead of dicts of lists.
+
+INDEX = [(0, 50), (51, 100), (101, 150), (151, 200), (201, 300), (301, 400), (401, 500)]
+
+# pollutant -> (decimals kept when truncating, [(C_low, C_high), ...] matching INDEX)
+BREAKPOINTS = {
+    # PM2.5 24-hour, µg/m³ (the table used by aqiDataPull.py and the stored AQI files)
+    'pm25': (1, [(0.0, 12.0), (12.1, 35.4), (35.5, 55.4), (55.5, 150.4), (150.5, 250.4), (250.5, 350.4), (350.5, 500.4)]),
+    # PM2.5 24-hour, µg/m³, as revised by the EPA in 2024 (301-500 is a single row)
+    'pm25_2024': (1, [(0.0, 9.0), (9.1, 35.4), (35.5, 55.4), (55.5, 125.4), (125.5, 225.4), (225.5, 325.4)]),
+    # PM10 24-hour, µg/m³
+    'pm10': (0, [(0, 54), (55, 154), (155, 254), (255, 354), (355, 424), (425, 504), (505, 604)]),
+    # O3 8-hour, ppm (no rows above 300: the EPA rates those levels from 1-hour concentrations)
+    'o3': (3, [(0.000, 0.054), (0.055, 0.070), (0.071, 0.085), (0.086, 0.105), (0.106, 0.200)]),
+    # CO 8-hour, ppm
+    'co': (1, [(0.0, 4.4), (4.5, 9.4), (9.5, 12.4), (12.5, 15.4), (15.5, 30.4), (30.5, 40.4), (40.5, 50.4)]),
+    # SO2 1-hour, ppb
+    'so2': (0, [(0, 35), (36, 75), (76, 185), (186, 304), (305, 604), (605, 804), (805, 1004)]),
+    # NO2 1-hour, ppb
+    'no2': (0, [(0, 53), (54, 100), (101, 360), (361, 649), (650, 1249), (1250, 1649), (1650, 2049)]),
+}
+INDEX_2024 = INDEX[:5] + [(301, 500)]
+
+_TABLES = {}
+
+
+def _table(pollutant):
+    """(decimals, c_low, c_high, i_low, i_high) arrays of a pollutant's table."""
+    if pollutant not in _TABLES:
+        if pollutant not in BREAKPOINTS:
+            raise KeyError(f"Unknown pollutant '{pollutant}', expected one of {sorted(BREAKPOINTS)}")
+        decimals, rows = BREAKPOINTS[pollutant]
+        index = INDEX_2024 if pollutant == 'pm25_2024' else INDEX[:len(rows)]
+        c = np.array(rows, dtype=float)
+        i = np.array(index, dtype=float)
+        _TABLES[pollutant] = (decimals, c[:, 0], c[:, 1], i[:, 0], i[:, 1])
+    return _TABLES[pollutant]
+
+
+def truncate(values, decimals):
+    """Drop digits beyond `decimals` (EPA truncation, not rounding)."""
+    scale = 10.0 ** decimals
+    return np.floor(np.asarray(values, dtype=float) * scale) / scale
+
+
+def us_aqi(values, pollutant='pm25'):
+    """US AQI of an array of concentrations (float array; NaN for missing or negative values, see above)."""
+    decimals, c_lo, c_hi, i_lo, i_hi = _table(pollutant)
+    c = truncate(values, decimals)
+    row = np.searchsorted(c_hi, c, side='left')
+    top = row >= len(c_hi)
+    row = np.minimum(row, len(c_hi) - 1)
+    # after truncation a value lies inside its row; the clip only guards the float edge of a row's lower bound
+    lo = c_lo[row]
+    slope = (i_hi[row] - i_lo[row]) / (c_hi[row] - lo)
+    out = np.rint(slope * (np.maximum(c, lo) - lo) + i_lo[row])
+    out[top] = 500 if i_hi[-1] == 500 else np.nan   # beyond a shorter table the index is unknown, not its top
+    out[~(c >= 0)] = np.nan
+    return out
+
+
+def us_aqi_from_pm25(c):
+    """Scalar convenience wrapper (None for missing values), as in aqiDataPull.py."""
+    if c is None:
+        return None
+    out = us_aqi(np.array([c], dtype=float))[0]
+    return None if np.isnan(out) else int(out)
+
+
+def daily_mean(days, values):
+    """
+    Mean per day of readings from any number of sensors: days is an array of dates (datetime64 or
+    YYYY-MM-DD strings), values the readings. NaNs are ignored. Returns (days as datetime64[D], means, counts),
+    days sorted.
+    """
+    values = np.asarray(values, dtype=float)
+    # hash the day labels once, then sort only the distinct days (far fewer than the readings)
+    codes, labels = pd.factorize(np.asarray(days))
+    uniq, label_day = np.unique(np.asarray(labels).astype('datetime64[D]'), return_inverse=True)
+    keep = (codes >= 0) & ~np.isnan(values)
+    group = label_day.reshape(-1)[codes[keep]]
+    counts = np.bincount(group, minlength=len(uniq))
+    sums = np.bincount(group, weights=values[keep], minlength=len(uniq))
+    present = counts > 0
+    uniq, sums, counts = uniq[present], sums[present], counts[present]
+    return uniq, sums / counts, counts
+
+
+# ---------------------------
+# Benchmark against the per-value loop of aqiDataPull.py
+# ---------------------------
+def _loop_aqi(c):
+    c = math.floor(c * 10) / 10.0
+    for (Cl, Ch), (Il, Ih) in zip(BREAKPOINTS['pm25'][1], INDEX):
+        if Cl <= c <= Ch:
+            return round((Ih - Il) / (Ch - Cl) * (c - Cl) + Il)
+    return 500
+
+
+def _loop_daily_mean(days, values):
+    by_date = {}
+    for d, v in zip(days, values):
+        by_date.setdefault(d, []).append(v)
+    return sorted((d, sum(arr) / len(arr)) for d, arr in by_date.items())
+
+
+def benchmark(n=1_000_000, sensors=20, repeat=3, seed=0):
+    """Readings per second of the loops against us_aqi / daily_mean; raises if the results differ."""
+    rng = np.random.default_rng(seed)
+    pm = np.round(rng.gamma(2.0, 40.0, n), 2)
+    days = (np.datetime64('2000-01-01') + rng.integers(0, n // sensors, n)).astype('datetime64[D]').astype(str)
+
+    start = time.perf_counter()
+    expected = [_loop_aqi(c) for c in pm.tolist()]
+    t_loop = time.perf_counter() - start
+    start = time.perf_counter()
+    for _ in range(repeat):
+        got = us_aqi(pm)
+    t_vec = (time.perf_counter() - start) / repeat
+    if not np.array_equal(np.array(expected, dtype=float), got):
+        raise AssertionError("us_aqi differs from the per-value loop")
+
+    start = time.perf_counter()
+    expected = _loop_daily_mean(days.tolist(), pm.tolist())
+    t_loop_mean = time.perf_counter() - start
+    start = time.perf_counter()
+    for _ in range(repeat):
+        uniq, means, _ = daily_mean(days, pm)
+    t_vec_mean = (time.perf_counter() - start) / repeat
+    if uniq.astype(str).tolist() != [d for d, _ in expected] or not np.allclose(means, [m for _, m in expected]):
+        raise AssertionError("daily_mean differs from the dict-of-lists average")
+
+    return {'readings': n, 'days': len(uniq),
+            'aqi_loop_per_s': n / t_loop, 'aqi_vectorized_per_s': n / t_vec, 'aqi_speedup': t_loop / t_vec,
+            'mean_loop_per_s': n / t_loop_mean, 'mean_vectorized_per_s': n / t_vec_mean,
+            'mean_speedup': t_loop_mean / t_vec_mean}
+
+
+if __name__ == "__main__":
+    r = benchmark()
+    print(f"{r['readings']:,} PM2.5 readings over {r['days']:,} days")
+    print(f"US AQI:     loop={r['aqi_loop_per_s']:>14,.0f}/s  vectorized={r['aqi_vectorized_per_s']:>14,.0f}/s  "
+          f"speedup={r['aqi_speedup']:.0f}x")
+    print(f"daily mean: loop={r['mean_loop_per_s']:>14,.0f}/s  vectorized={r['mean_vectorized_per_s']:>14,.0f}/s  "
+          f"speedup={r['mean_speedup']:.0f}x")